@@ -0,0 +1,281 @@
+"""
+Throughput and memory of the main client paths, against the local
+stand-in of the Search Ads API (fake_server.py), without network access:
+
+    python benchmarks/api_benchmark.py [--campaigns 20] [--latency 0.005]
+        [--throttle 0.02] [--json results.json] [--baseline base.json]
+
+Every scenario runs --repeat times (best time kept) and once more under
+tracemalloc for its peak memory. With --baseline, the run fails (status 1)
+when a scenario is more than --tolerance slower, or uses that much more
+memory, than in the baseline results: write them with --json on the
+reference commit.
+
+The reports.threads and reports.asyncio scenarios download the keyword
+reports of --report-campaigns campaigns at the same time, with --workers
+threads (SearchAds) or --workers requests in flight (AsyncSearchAds, when
+aiohttp is installed).
+
+The client rate limiter is raised to --rate calls per second, so that the
+client is measured rather than the Apple rate limits.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Run from a checkout: import search_ads from the parent directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from fake_server import FakeSearchAds  # noqa: E402
+
+from search_ads import (  # noqa: E402
+    SearchAds, DataBase, SyncManager, set_api_url, set_scheduler, Scheduler,
+    get_instrumentation, HistogramExporter)
+from search_ads.api.utils import set_env  # noqa: E402
+from search_ads.models.reports import _async_report, _report  # noqa: E402
+
+try:
+    import aiohttp
+except ImportError:  # the asyncio scenario is skipped
+    aiohttp = None
+
+
+class Scenario(object):
+    """
+    A benchmarked call: prepare() runs untimed before every repetition and
+    returns the function to time, which returns the number of items handled
+    """
+
+    def __init__(self, name, unit, prepare):
+        self.name = name
+        self.unit = unit
+        self.prepare = prepare
+
+
+def scenarios(api, args):
+    start = datetime(2018, 1, 1)
+    end = start + timedelta(days=args.days - 1)
+    campaigns = api.get_campaigns()
+
+    def get_campaigns():
+        return lambda: len(api.get_campaigns())
+
+    def report():
+        def run():
+            return len(_report(campaigns[0], path='keywords',
+                               org_id=api.org_id,
+                               start_time=start.strftime('%Y-%m-%d'),
+                               end_time=end.strftime('%Y-%m-%d'),
+                               granularity='DAILY'))
+        return run
+
+    report_kwargs = dict(path='keywords', org_id=api.org_id,
+                         start_time=start.strftime('%Y-%m-%d'),
+                         end_time=end.strftime('%Y-%m-%d'),
+                         granularity='DAILY')
+
+    def reports_threads():
+        def run():
+            with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                return sum(executor.map(
+                    lambda campaign: len(_report(campaign, **report_kwargs)),
+                    campaigns[:args.report_campaigns]))
+        return run
+
+    def reports_asyncio():
+        from search_ads.api.async_utils import AsyncTransport
+
+        async def gather():
+            transport = AsyncTransport(max_in_flight=args.workers)
+            try:
+                reports = await asyncio.gather(*[
+                    _async_report(campaign, transport=transport,
+                                  **report_kwargs)
+                    for campaign in campaigns[:args.report_campaigns]])
+            finally:
+                await transport.close()
+            return sum(len(report) for report in reports)
+        return lambda: asyncio.run(gather())
+
+    def store_reports():
+        def run():
+            database = DataBase()
+            with contextlib.redirect_stderr(io.StringIO()):  # progress bars
+                api.store_reports(campaigns[:args.report_campaigns], database,
+                                  granularity='DAILY', start_date=start,
+                                  end_date=end + timedelta(days=1),
+                                  max_workers=args.workers)
+            return sum(len(df) for reports in database.reports.values()
+                       if isinstance(reports, dict)
+                       for df in reports.values()) + \
+                len(database.reports.get('campaign', []))
+        return run
+
+    ad_groups = campaigns[0].fetch_ad_groups()
+    for ad_group in ad_groups:
+        ad_group.fetch_keywords(org_id=api.org_id)
+    bump = [0]
+
+    def save_ad_groups():
+        bump[0] += 1
+        for ad_group in ad_groups:
+            for keyword in ad_group.keywords:
+                keyword.bid_amount['amount'] = '%.2f' % (1 + bump[0] * 0.01)
+
+        def run():
+            for ad_group in ad_groups:
+                ad_group.save(chunk_size=args.chunk_size,
+                              max_workers=args.workers)
+            return sum(len(ad_group.keywords) for ad_group in ad_groups)
+        return run
+
+    def synchronize():
+        manager = SyncManager(args.certs)
+        for campaign in campaigns:
+            campaign.set_sync_manager(manager)
+            campaign.name += '!'
+            campaign.save()
+            campaign.set_sync_manager(None)
+        return lambda: len(manager.synchronize(max_workers=args.workers))
+
+    return [
+        Scenario('get_campaigns', 'campaigns', get_campaigns),
+        Scenario('_report', 'rows', report),
+        Scenario('reports.threads', 'rows', reports_threads),
+    ] + ([
+        Scenario('reports.asyncio', 'rows', reports_asyncio),
+    ] if aiohttp is not None else []) + [
+        Scenario('store_reports', 'rows', store_reports),
+        Scenario('AdGroup.save', 'keywords', save_ad_groups),
+        Scenario('SyncManager.synchronize', 'actions', synchronize),
+    ]
+
+
+def measure(scenario, repeat, histograms):
+    best = None
+    for _ in range(repeat):
+        run = scenario.prepare()
+        histograms.reset()
+        start = time.perf_counter()
+        items = run()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best[0]:
+            requests = histograms.get('search_ads_request_retries')
+            best = (elapsed, items, requests.count if requests else 0,
+                    int(requests.sum) if requests else 0)
+    run = scenario.prepare()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    elapsed, items, requests, retries = best
+    return {'seconds': elapsed, 'items': items, 'unit': scenario.unit,
+            'throughput': items / elapsed if elapsed else 0.0,
+            'requests': requests, 'retries': retries, 'peak_bytes': peak}
+
+
+def regressions(results, baseline, tolerance):
+    found = []
+    for name, result in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if result['throughput'] < reference['throughput'] * (1 - tolerance):
+            found.append("%s: %.0f %s/s, baseline %.0f" % (
+                name, result['throughput'], result['unit'],
+                reference['throughput']))
+        if result['peak_bytes'] > reference['peak_bytes'] * (1 + tolerance):
+            found.append("%s: peak %.1f MB, baseline %.1f MB" % (
+                name, result['peak_bytes'] / 1e6,
+                reference['peak_bytes'] / 1e6))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--campaigns', type=int, default=20)
+    parser.add_argument('--ad-groups', type=int, default=5)
+    parser.add_argument('--keywords', type=int, default=100,
+                        help="keywords per ad group")
+    parser.add_argument('--days', type=int, default=7,
+                        help="days of the reports")
+    parser.add_argument('--report-campaigns', type=int, default=2,
+                        help="campaigns downloaded by store_reports and "
+                             "the reports scenarios")
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="seconds added by the server to every call")
+    parser.add_argument('--throttle', type=float, default=0.0,
+                        help="share of the calls answered with a 429")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', help="comma separated scenario names")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--baseline', help="results to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    certs_dir = tempfile.mkdtemp()
+    args.certs = {}
+    for name, suffix in (('SEARCH-ADS-PEM', '.pem'), ('SEARCH-ADS-KEY',
+                                                      '.key')):
+        args.certs[name] = os.path.join(certs_dir, 'benchmark' + suffix)
+        open(args.certs[name], 'w').close()  # not read over plain HTTP
+
+    logging.getLogger('search_ads').setLevel(logging.ERROR)  # retries
+    histograms = get_instrumentation().add_exporter(HistogramExporter())
+    set_scheduler(Scheduler(rate=args.rate, burst=args.rate,
+                            max_concurrency=max(args.workers, 20)))
+    results = {}
+    with FakeSearchAds(campaigns=args.campaigns, ad_groups=args.ad_groups,
+                       keywords=args.keywords, latency=args.latency,
+                       throttle=args.throttle) as server, \
+            set_env(**args.certs):
+        set_api_url(server.url)
+        api = SearchAds(server.org_name)
+        only = args.only.split(',') if args.only else None
+        print("%-24s %10s %14s %9s %8s %10s" % (
+            'scenario', 'seconds', 'throughput', 'requests', 'retries',
+            'peak MB'))
+        for scenario in scenarios(api, args):
+            if only and scenario.name not in only:
+                continue
+            result = results[scenario.name] = measure(
+                scenario, args.repeat, histograms)
+            print("%-24s %10.3f %8.0f %-5s %9d %8d %10.1f" % (
+                scenario.name, result['seconds'], result['throughput'],
+                result['unit'][:5] + '/s', result['requests'],
+                result['retries'], result['peak_bytes'] / 1e6))
+        stats = server.stats()
+    print("server: %d calls, %d throttled" % (stats.get('calls', 0),
+                                               stats.get('throttled', 0)))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for regression in found:
+            print("REGRESSION %s" % regression)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
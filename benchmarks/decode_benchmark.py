@@ -0,0 +1,82 @@
+"""
+Model hydration from a list response: parsing its text against parsing its
+bytes, then building the objects with the constructors (Campaign(**raw),
+...) against the bulk decoders (Campaign.decode, ...).
+
+    python benchmarks/decode_benchmark.py [number of keywords]
+"""
+import gc
+import json
+import os
+import sys
+import time
+
+# Run from a checkout: import search_ads from the parent directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from search_ads.api.utils import _decode_response  # noqa: E402
+from search_ads.models.store_models import (  # noqa: E402
+    Campaign, AdGroup, Keyword)
+from search_ads.models.utils import dumps  # noqa: E402
+
+
+def campaigns_payload(count):
+    return json.dumps({'data': [{
+        'id': 1000 + i, 'orgId': 42, 'name': 'Campaign %d' % i,
+        'adamId': 284882215, 'paymentModel': 'PAYG',
+        'budgetAmount': {'amount': '1000', 'currency': 'USD'},
+        'dailyBudgetAmount': {'amount': '100', 'currency': 'USD'},
+        'status': 'ENABLED', 'servingStatus': 'RUNNING',
+        'displayStatus': 'RUNNING', 'servingStateReasons': None,
+        'storefront': ['US'], 'modificationTime': '2018-03-01T10:00:00.000',
+    } for i in range(count)]}).encode('utf-8')
+
+
+def keywords_payload(count):
+    return json.dumps({'data': [{
+        'id': 10 ** 9 + i, 'adGroupId': 3, 'text': 'keyword %d' % i,
+        'matchType': 'EXACT' if i % 2 else 'BROAD', 'status': 'ACTIVE',
+        'bidAmount': {'amount': str(1 + i % 7 * 0.5), 'currency': 'USD'},
+        'modificationTime': '2018-03-01T10:00:00.000', 'deleted': False,
+    } for i in range(count)]}).encode('utf-8')
+
+
+def best_of(function, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        result = None
+        gc.collect()
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def compare(name, cls, payload):
+    parse_text, _ = best_of(
+        lambda: json.loads(payload.decode('utf-8'))['data'])
+    parse_bytes, data = best_of(
+        lambda: _decode_response(200, payload)['data'])
+    constructors, objects = best_of(lambda: [cls(**raw) for raw in data])
+    expected = [(dumps(obj), obj._snapshot) for obj in objects]
+    del objects
+    decoder, objects = best_of(lambda: cls.decode(data))
+    same = expected == [(dumps(obj), obj._snapshot) for obj in objects]
+    print("%-9s %7d objects | parse: text %.3fs, bytes %.3fs | build: "
+          "constructors %.3fs, decode %.3fs (x%.2f) | total x%.2f | %s" % (
+              name, len(objects), parse_text, parse_bytes, constructors,
+              decoder, constructors / decoder,
+              (parse_text + constructors) / (parse_bytes + decoder),
+              "same objects" if same else "DIFFERENT OBJECTS"))
+
+
+if __name__ == '__main__':
+    keywords = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    compare('campaigns', Campaign, campaigns_payload(keywords // 20))
+    compare('adgroups', AdGroup, json.dumps({'data': [
+        {'id': i, 'campaignId': 1, 'name': 'Ad Group %d' % i,
+         'status': 'ENABLED', 'storefronts': ['US'],
+         'defaultCpcBid': {'amount': '1', 'currency': 'USD'}}
+        for i in range(keywords // 20)]}).encode('utf-8'))
+    compare('keywords', Keyword, keywords_payload(keywords))
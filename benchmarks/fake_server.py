@@ -0,0 +1,468 @@
+"""
+Local stand-in for the Search Ads API, for benchmarks without network
+access. It serves an account of generated campaigns, ad groups, keywords
+and reports, with a configurable latency and share of throttled (429)
+calls:
+
+    python benchmarks/fake_server.py --port 8000 --latency 0.02
+
+and the client is pointed to it with
+
+    set_api_url('http://127.0.0.1:8000/api/{endpoint}')
+
+The client certificate is not checked (plain HTTP), but the certificate
+paths must exist. GET /_stats returns the number of calls served and
+throttled.
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+MATCH_TYPES = ('EXACT', 'BROAD')
+MODIFICATION_TIME = '2018-03-01T10:00:00.000'
+
+
+def _amount(value):
+    return {'amount': '%.2f' % value, 'currency': 'USD'}
+
+
+class Account(object):
+    """
+    A deterministic account: the same sizes always give the same entities,
+    generated when first requested
+    """
+
+    def __init__(self, campaigns=20, ad_groups=5, keywords=200,
+                 org_id=1, org_name='Benchmark Org'):
+        """
+        :param campaigns: number of campaigns
+        :param ad_groups: number of ad groups per campaign
+        :param keywords: number of keywords per ad group
+        :param org_id: the organization id
+        :param org_name: the organization name
+        """
+        self.campaign_count = campaigns
+        self.ad_group_count = ad_groups
+        self.keyword_count = keywords
+        self.org_id = org_id
+        self.org_name = org_name
+        self._next_id = 10 ** 9
+        self._lock = threading.Lock()
+
+    def new_id(self):
+        with self._lock:
+            self._next_id += 1
+            return self._next_id
+
+    def campaign_ids(self):
+        return [100000 + i for i in range(self.campaign_count)]
+
+    def campaign(self, campaign_id):
+        i = campaign_id - 100000
+        return {
+            'id': campaign_id, 'orgId': self.org_id,
+            'name': 'Campaign %d' % i, 'adamId': 284882215 + i % 3,
+            'paymentModel': 'PAYG',
+            'budgetAmount': _amount(10000), 'dailyBudgetAmount': _amount(500),
+            'locInvoiceDetails': None, 'budgetOrders': [],
+            'status': 'ENABLED' if i % 5 else 'PAUSED',
+            'servingStatus': 'RUNNING', 'displayStatus': 'RUNNING',
+            'servingStateReasons': None, 'storefront': ['US'],
+            'modificationTime': MODIFICATION_TIME, 'deleted': False,
+        }
+
+    def ad_group_ids(self, campaign_id):
+        return [campaign_id * 100 + j for j in range(self.ad_group_count)]
+
+    def ad_group(self, campaign_id, ad_group_id):
+        j = ad_group_id - campaign_id * 100
+        return {
+            'id': ad_group_id, 'campaignId': campaign_id,
+            'name': 'Ad Group %d' % j, 'status': 'ENABLED',
+            'servingStatus': 'RUNNING', 'displayStatus': 'RUNNING',
+            'servingStateReasons': None, 'storefronts': ['US'],
+            'defaultCpcBid': _amount(1), 'cpaGoal': None,
+            'automatedKeywordsOptIn': False,
+            'targetingDimensions': {'age': None, 'gender': None,
+                                    'deviceClass': {'included': ['IPHONE']},
+                                    'daypart': None, 'adminArea': None,
+                                    'locality': None, 'appDownloaders': None},
+            'startTime': '2018-01-01T00:00:00.000', 'endTime': None,
+            'modificationTime': MODIFICATION_TIME, 'deleted': False,
+        }
+
+    def keywords(self, ad_group_id):
+        return [{
+            'id': ad_group_id * 10000 + k, 'adGroupId': ad_group_id,
+            'text': 'keyword %d %d' % (ad_group_id, k),
+            'matchType': MATCH_TYPES[k % 2],
+            'status': 'ACTIVE' if k % 10 else 'PAUSED',
+            'bidAmount': _amount(0.5 + k % 7 * 0.25),
+            'modificationTime': MODIFICATION_TIME, 'deleted': False,
+        } for k in range(self.keyword_count)]
+
+    def report_rows(self, campaign_id, path):
+        """
+        :return: the metadata of the rows of a report
+        """
+        if not campaign_id:
+            return [{
+                'campaignId': c, 'campaignName': 'Campaign %d' % (c - 100000),
+                'campaignStatus': 'ENABLED', 'deleted': False,
+                'app': {'appName': 'App', 'adamId': 284882215},
+                'servingStatus': 'RUNNING', 'countriesOrRegions': ['US'],
+                'modificationTime': MODIFICATION_TIME,
+                'totalBudget': _amount(10000), 'dailyBudget': _amount(500),
+                'displayStatus': 'RUNNING',
+            } for c in self.campaign_ids()]
+        ad_groups = self.ad_group_ids(campaign_id)
+        if path == 'adgroups':
+            return [{
+                'adGroupId': a, 'adGroupName': 'Ad Group %d' % (a % 100),
+                'campaignId': campaign_id, 'adGroupStatus': 'ENABLED',
+                'adGroupServingStatus': 'RUNNING', 'defaultCpcBid': _amount(1),
+                'deleted': False, 'modificationTime': MODIFICATION_TIME,
+            } for a in ad_groups]
+        if path == 'searchterms':
+            return [{
+                'searchTermText': 'search term %d' % k, 'searchTermSource':
+                'TARGETED', 'keywordId': a * 10000 + k,
+                'keyword': 'keyword %d %d' % (a, k), 'matchType':
+                MATCH_TYPES[k % 2], 'adGroupId': a, 'adGroupName':
+                'Ad Group %d' % (a % 100), 'deleted': False,
+            } for a in ad_groups for k in range(0, self.keyword_count, 2)]
+        return [{
+            'keywordId': keyword['id'], 'keyword': keyword['text'],
+            'keywordStatus': keyword['status'],
+            'matchType': keyword['matchType'],
+            'bidAmount': keyword['bidAmount'], 'deleted': False,
+            'keywordDisplayStatus': 'RUNNING', 'adGroupId': a,
+            'adGroupName': 'Ad Group %d' % (a % 100), 'adGroupDeleted': False,
+            'modificationTime': MODIFICATION_TIME,
+        } for a in ad_groups for keyword in self.keywords(a)]
+
+
+def _periods(start, end, granularity):
+    """
+    The labels of the report cells between start and end (included)
+    """
+    day = datetime.strptime(start, '%Y-%m-%d')
+    last = datetime.strptime(end, '%Y-%m-%d')
+    labels = []
+    while day <= last:
+        if granularity == 'HOURLY':
+            labels.extend((day + timedelta(hours=hour)).strftime(
+                '%Y-%m-%d %H:00') for hour in range(24))
+        elif granularity == 'WEEKLY':
+            if day.weekday() == 0 or not labels:
+                labels.append(day.strftime('%Y-%m-%d'))
+        elif granularity == 'MONTHLY':
+            if day.day == 1 or not labels:
+                labels.append(day.strftime('%Y-%m'))
+        else:
+            labels.append(day.strftime('%Y-%m-%d'))
+        day += timedelta(days=1)
+    return labels
+
+
+def _metrics(seed, date):
+    impressions = seed % 997 + 10
+    taps = impressions // 17
+    installs = taps // 3
+    spend = taps * 0.8
+    return {
+        'date': date, 'impressions': impressions, 'taps': taps,
+        'installs': installs, 'newDownloads': installs - installs // 4,
+        'redownloads': installs // 4, 'latOnInstalls': installs // 5,
+        'latOffInstalls': installs - installs // 5,
+        'ttr': round(taps / float(impressions), 4),
+        'conversionRate': round(installs / float(taps), 4) if taps else 0,
+        'avgCPA': _amount(spend / installs if installs else 0),
+        'avgCPT': _amount(spend / taps if taps else 0),
+        'localSpend': _amount(spend),
+    }
+
+
+_routes = [(method, re.compile('^/api/v\\d+/%s/?$' % pattern), name)
+           for method, pattern, name in [
+    ('GET', 'acls', 'acls'),
+    ('GET', 'campaigns', 'campaigns'),
+    ('POST', 'campaigns/find', 'find_campaigns'),
+    ('POST', 'campaigns', 'create_campaign'),
+    ('GET', 'campaigns/(\\d+)', 'campaign'),
+    ('PUT', 'campaigns/(\\d+)', 'update'),
+    ('GET', 'campaigns/(\\d+)/adgroups', 'ad_groups'),
+    ('POST', 'campaigns/(\\d+)/adgroups', 'create_ad_group'),
+    ('PUT', 'campaigns/(\\d+)/adgroups/(\\d+)', 'update'),
+    ('GET', 'campaigns/(\\d+)/adgroups/(\\d+)/targetingkeywords', 'keywords'),
+    ('POST', 'keywords/targeting', 'import_keywords'),
+    ('POST', 'reports/campaigns', 'report'),
+    ('POST', 'reports/campaigns/(\\d+)/(\\w+)', 'report'),
+]]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, as the Apple API
+    # Headers and body are written separately: without this, delayed ACKs
+    # add 40ms to most calls
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def _send(self, status, body, headers=()):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        url = urlparse(self.path)
+        if url.path == '/_stats':
+            return self._send(200, dict(server.stats))
+        server.count('calls')
+        if server.latency:
+            time.sleep(server.latency)
+        if server.throttled():
+            server.count('throttled')
+            return self._send(429, {'data': None, 'error': {'errors': [{
+                'messageCode': 'RATE_LIMIT_EXCEEDED',
+                'message': 'Too many requests', 'field': ''}]}},
+                headers=[('Retry-After', str(server.retry_after))])
+        for route_method, pattern, name in _routes:
+            match = pattern.match(url.path)
+            if match and route_method == method:
+                query = dict((key, values[0]) for key, values in
+                             parse_qs(url.query).items())
+                status, response = getattr(self, 'route_' + name)(
+                    *[int(group) if group.isdigit() else group
+                      for group in match.groups()],
+                    query=query, body=body)
+                return self._send(status, response)
+        self._send(404, {'data': None, 'error': {'errors': [{
+            'messageCode': 'NOT_FOUND', 'message': 'Unknown endpoint %s %s'
+            % (method, url.path), 'field': ''}]}})
+
+    def _page(self, items, query):
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', 1000))
+        return 200, {'data': items[offset:offset + limit], 'pagination': {
+            'totalResults': len(items), 'startIndex': offset,
+            'itemsPerPage': limit}}
+
+    def route_acls(self, query, body):
+        account = self.server.account
+        return 200, {'data': [{'orgName': account.org_name,
+                               'orgId': account.org_id, 'currency': 'USD',
+                               'paymentModel': 'PAYG',
+                               'roleNames': ['Admin']}]}
+
+    def route_campaigns(self, query, body):
+        account = self.server.account
+        return self._page([account.campaign(campaign_id) for campaign_id
+                           in account.campaign_ids()], query)
+
+    def route_find_campaigns(self, query, body):
+        pagination = (body or {}).get('pagination') or {}
+        return self.route_campaigns(pagination, body)
+
+    def route_campaign(self, campaign_id, query, body):
+        return 200, {'data': self.server.account.campaign(campaign_id)}
+
+    def route_create_campaign(self, query, body):
+        return 200, {'data': dict(body, id=self.server.account.new_id())}
+
+    def route_update(self, *ids, **kwargs):
+        return 200, {'data': dict(kwargs['body'] or {}, id=ids[-1])}
+
+    def route_ad_groups(self, campaign_id, query, body):
+        account = self.server.account
+        return self._page([account.ad_group(campaign_id, ad_group_id)
+                           for ad_group_id in
+                           account.ad_group_ids(campaign_id)], query)
+
+    def route_create_ad_group(self, campaign_id, query, body):
+        return 200, {'data': dict(body, id=self.server.account.new_id(),
+                                  campaignId=campaign_id)}
+
+    def route_keywords(self, campaign_id, ad_group_id, query, body):
+        return self._page(self.server.account.keywords(ad_group_id), query)
+
+    def route_import_keywords(self, query, body):
+        account = self.server.account
+        return 200, {'data': [
+            dict(operation, id=operation.get('id')
+                 if operation.get('importAction') == 'UPDATE'
+                 else account.new_id())
+            for operation in body or []]}
+
+    def route_report(self, campaign_id=None, path='', query=None, body=None):
+        return 200, self.server.report(campaign_id, path, body)
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, account, latency=0.0, throttle=0.0,
+                 retry_after=0, seed=0):
+        ThreadingHTTPServer.__init__(self, address, Handler)
+        self.account = account
+        self.latency = latency
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.stats = Counter()
+        self._random = random.Random(seed)
+        self._reports = {}
+        self._lock = threading.Lock()
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def throttled(self):
+        with self._lock:
+            return self._random.random() < self.throttle
+
+    def report(self, campaign_id, path, request):
+        """
+        A page of a report; the rows of a report are generated once
+        """
+        key = (campaign_id, path, request['startTime'], request['endTime'],
+               request['granularity'])
+        with self._lock:
+            rows = self._reports.get(key)
+        if rows is None:
+            dates = _periods(request['startTime'], request['endTime'],
+                             request['granularity'])
+            rows = [{'metadata': metadata, 'granularity': [
+                _metrics(position * 31 + day, date)
+                for day, date in enumerate(dates)],
+                'other': False, 'total': _metrics(position, None)}
+                for position, metadata in enumerate(
+                    self.account.report_rows(campaign_id, path))]
+            with self._lock:
+                self._reports[key] = rows
+        pagination = request['selector'].get('pagination') or {}
+        offset = pagination.get('offset', 0)
+        limit = pagination.get('limit', 1000)
+        return {'data': {'reportingDataResponse': {
+            'row': rows[offset:offset + limit],
+            'grandTotals': {'other': False, 'total': _metrics(0, None)}}},
+            'pagination': {'totalResults': len(rows), 'startIndex': offset,
+                           'itemsPerPage': limit}}
+
+
+def _serve(port, options, ready):
+    server = FakeServer(('127.0.0.1', port), Account(**options['account']),
+                        **options['server'])
+    ready.send(server.server_address[1])
+    server.serve_forever()
+
+
+class FakeSearchAds(object):
+    """
+    Runs the fake API in a separate process, so that it does not compete
+    with the benchmarked client for the GIL:
+
+    >>> with FakeSearchAds(campaigns=50, latency=0.02) as server:
+    ...     set_api_url(server.url)
+    """
+
+    def __init__(self, campaigns=20, ad_groups=5, keywords=200, latency=0.0,
+                 throttle=0.0, retry_after=0, port=0,
+                 org_name='Benchmark Org'):
+        """
+        :param campaigns: number of campaigns of the account
+        :param ad_groups: number of ad groups per campaign
+        :param keywords: number of keywords per ad group
+        :param latency: seconds added to every call
+        :param throttle: share of the calls answered with a 429
+        :param retry_after: Retry-After seconds of the 429 responses
+        :param port: the port, default a free one
+        :param org_name: the organization name
+        """
+        self.org_name = org_name
+        self.port = port
+        self.options = {
+            'account': dict(campaigns=campaigns, ad_groups=ad_groups,
+                            keywords=keywords, org_name=org_name),
+            'server': dict(latency=latency, throttle=throttle,
+                           retry_after=retry_after),
+        }
+        self._process = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d/api/{endpoint}' % self.port
+
+    def start(self):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        self._process = multiprocessing.Process(
+            target=_serve, args=(self.port, self.options, sender),
+            daemon=True)
+        self._process.start()
+        self.port = receiver.recv()
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def stats(self):
+        """
+        :return: the number of calls served and throttled so far
+        """
+        import requests
+
+        return requests.get('http://127.0.0.1:%d/_stats' % self.port).json()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--campaigns', type=int, default=20)
+    parser.add_argument('--ad-groups', type=int, default=5)
+    parser.add_argument('--keywords', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--throttle', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=0)
+    args = parser.parse_args()
+    server = FakeServer(('127.0.0.1', args.port),
+                        Account(args.campaigns, args.ad_groups, args.keywords),
+                        latency=args.latency, throttle=args.throttle,
+                        retry_after=args.retry_after)
+    print("Serving on http://127.0.0.1:%d/api/{endpoint}" % args.port)
+    server.serve_forever()
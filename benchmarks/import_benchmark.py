@@ -0,0 +1,50 @@
+"""
+Import time regression check: `import search_ads` and the models used by
+the bid jobs must not import the heavy optional dependencies.
+
+    python benchmarks/import_benchmark.py [max milliseconds]
+
+Exits with status 1 when a heavy module is imported or when the median
+import time is over the budget (default 500ms).
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+# Run from a checkout: the measured interpreter imports search_ads from the
+# parent directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('pandas', 'numpy', 'tqdm', 'aiohttp', 'pyarrow')
+
+SCRIPT = """
+import sys, time
+start = time.perf_counter()
+from search_ads import Campaign, AdGroup, Keyword, SearchAds, SyncManager
+elapsed = time.perf_counter() - start
+heavy = [name for name in %r if name in sys.modules]
+print(elapsed, ','.join(heavy))
+""" % (HEAVY_MODULES,)
+
+
+def measure(runs=7):
+    timings = []
+    heavy = set()
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', SCRIPT],
+                                         cwd=ROOT)
+        elapsed, _, modules = output.decode().strip().partition(' ')
+        timings.append(float(elapsed) * 1000)
+        heavy.update(module for module in modules.split(',') if module)
+    return statistics.median(timings), sorted(heavy)
+
+
+if __name__ == '__main__':
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 500
+    median, heavy = measure()
+    print("import search_ads: %.0fms (median), budget %.0fms" % (median,
+                                                                 budget))
+    if heavy:
+        print("heavy modules imported: %s" % ', '.join(heavy))
+    sys.exit(1 if heavy or median > budget else 0)
@@ -5,7 +5,48 @@ __version__ = "0.2.6"
 __maintainer__ = "Luca Giacomel"
 __email__ = "luca.giacomel@gmail.com"
 
-from search_ads.api.search_ads_building_blocks import SearchAds, DataBase
-from search_ads.api.utils import set_env
-from search_ads.models.store_models import Campaign, AdGroup, Keyword, \
-    SyncManager
+import importlib
+
+# The public names are imported on first access (PEP 562), so that scripts
+# only saving campaigns do not import pandas, aiohttp or pyarrow
+_exports = {
+    'SearchAds': 'search_ads.api.search_ads_building_blocks',
+    'DataBase': 'search_ads.api.search_ads_building_blocks',
+    'AsyncSearchAds': 'search_ads.api.async_search_ads',
+    'set_report_cache': 'search_ads.api.cache',
+    'MemoryCache': 'search_ads.api.cache',
+    'DirectoryCache': 'search_ads.api.cache',
+    'SQLiteCache': 'search_ads.api.cache',
+    'set_env': 'search_ads.api.utils',
+    'set_transport': 'search_ads.api.utils',
+    'Transport': 'search_ads.api.utils',
+    'set_scheduler': 'search_ads.api.utils',
+    'Scheduler': 'search_ads.api.utils',
+    'set_api_url': 'search_ads.api.utils',
+    'SearchAdsError': 'search_ads.api.utils',
+    'get_instrumentation': 'search_ads.api.instrumentation',
+    'set_instrumentation': 'search_ads.api.instrumentation',
+    'Instrumentation': 'search_ads.api.instrumentation',
+    'HistogramExporter': 'search_ads.api.instrumentation',
+    'PrometheusExporter': 'search_ads.api.instrumentation',
+    'Campaign': 'search_ads.models.store_models',
+    'AdGroup': 'search_ads.models.store_models',
+    'Keyword': 'search_ads.models.store_models',
+    'SyncManager': 'search_ads.models.store_models',
+    'KeywordTable': 'search_ads.models.keyword_table',
+}
+
+__all__ = sorted(_exports)
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError(
+            "module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module(_exports[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,206 @@
+import logging
+
+from search_ads.api.async_utils import AsyncTransport, api_get, paginate
+from search_ads.api.utils import get_scheduler
+from search_ads.models.store_models import Campaign
+from search_ads.models.reports import _today, _async_report
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSearchAds(object):
+    """
+    asyncio version of SearchAds.
+
+    All the report getters are coroutines returning the same DataFrames as
+    SearchAds, and at most max_in_flight requests are sent at the same time,
+    so many reports can be gathered at once. The requests also go through
+    the scheduler shared with SearchAds, whose max_concurrency (20 by
+    default) caps the requests in flight of each org:
+
+    >>> set_scheduler(Scheduler(max_concurrency=30))
+    >>> async with AsyncSearchAds("MyCompany", max_in_flight=30) as api:
+    ...     campaigns = await api.get_campaigns()
+    ...     reports = await asyncio.gather(*[
+    ...         api.get_campaign_keywords_report(campaign)
+    ...         for campaign in campaigns])
+    """
+
+    def __init__(self, org_name, api_version='v1', max_in_flight=20):
+        """
+        Initialize the API object, the organization is resolved by connect()
+        :param org_name: Your organization name as found in the SearchAds interface
+        :param api_version: The API version (current is v1)
+        :param max_in_flight: max number of concurrent requests, at most
+                              the max_concurrency of the scheduler
+                              (set_scheduler) for a single org
+        """
+        self.org_name = org_name
+        self.api_version = api_version
+        self.org_id = None
+        self.transport = AsyncTransport(max_in_flight=max_in_flight)
+        max_concurrency = get_scheduler().max_concurrency
+        if max_in_flight > max_concurrency:
+            logger.warning(
+                "max_in_flight=%d is capped by the %d calls in flight per "
+                "org of the scheduler, see set_scheduler", max_in_flight,
+                max_concurrency)
+
+    async def connect(self):
+        """
+        Resolve the organization id
+        """
+        orgs = await api_get("acls", api_version=self.api_version,
+                             transport=self.transport)
+        for org in orgs['data']:
+            if org['orgName'] == self.org_name:
+                self.org_id = org['orgId']
+        if not self.org_id:
+            raise Exception(
+                "Organization %s does not exist on this account" %
+                self.org_name)
+        return self
+
+    async def close(self):
+        await self.transport.close()
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def get_campaigns(self, limit=None):
+        """
+        Return all campaigns in the account
+        :param limit: limit the results (default is no limit)
+        :return: a list of Campaign objects
+        """
+        campaigns = []
+        pages = paginate(
+            lambda offset, page_size: api_get(
+                'campaigns', org_id=self.org_id, api_version=self.api_version,
+                limit=page_size, offset=offset, transport=self.transport),
+            page_size=min(limit or 1000, 1000)
+        )
+        async for page in pages:
+            campaigns.extend(Campaign.decode(page['data']))
+            if limit is not None and len(campaigns) >= limit:
+                return campaigns[:limit]
+        return campaigns
+
+    async def get_campaigns_by_name(self, name):
+        """
+        Fetches all campaigns that match a certain name
+        :param name: the query for the name
+        :return: a list of Campaign objects
+        """
+        return [campaign for campaign in await self.get_campaigns()
+                if name.lower() in campaign.name.lower()]
+
+    async def _report(self, campaign=None, path='', **kwargs):
+        return await _async_report(campaign=campaign, path=path,
+                                   org_id=self.org_id,
+                                   transport=self.transport, **kwargs)
+
+    async def get_campaign_keywords_report(self,
+                                           campaign,
+                                           start_time=_today(),
+                                           end_time=_today(),
+                                           timezone='UTC',
+                                           granularity='HOURLY',
+                                           selector=None,
+                                           group_by=[],
+                                           return_records_with_no_metrics=True,
+                                           return_row_totals=False):
+        """
+        See SearchAds.get_campaign_keywords_report
+        """
+        return await self._report(
+            campaign,
+            path='keywords',
+            start_time=start_time,
+            end_time=end_time,
+            timezone=timezone,
+            granularity=granularity,
+            selector=selector,
+            group_by=group_by,
+            return_records_with_no_metrics=return_records_with_no_metrics,
+            return_row_totals=return_row_totals
+        )
+
+    async def get_campaign_searchterms_report(self,
+                                              campaign,
+                                              start_time=_today(),
+                                              end_time=_today(),
+                                              timezone='UTC',
+                                              granularity='HOURLY',
+                                              selector=None,
+                                              group_by=[],
+                                              return_records_with_no_metrics=True,
+                                              return_row_totals=False):
+        """
+        See SearchAds.get_campaign_searchterms_report
+        """
+        return await self._report(
+            campaign,
+            path='searchterms',
+            start_time=start_time,
+            end_time=end_time,
+            timezone=timezone,
+            granularity=granularity,
+            selector=selector,
+            group_by=group_by,
+            return_records_with_no_metrics=return_records_with_no_metrics,
+            return_row_totals=return_row_totals
+        )
+
+    async def get_campaign_adgroups_report(self,
+                                           campaign,
+                                           start_time=_today(),
+                                           end_time=_today(),
+                                           timezone='UTC',
+                                           granularity='HOURLY',
+                                           selector=None,
+                                           group_by=[],
+                                           return_records_with_no_metrics=True,
+                                           return_row_totals=False):
+        """
+        See SearchAds.get_campaign_adgroups_report
+        """
+        return await self._report(
+            campaign,
+            path='adgroups',
+            start_time=start_time,
+            end_time=end_time,
+            timezone=timezone,
+            granularity=granularity,
+            selector=selector,
+            group_by=group_by,
+            return_records_with_no_metrics=return_records_with_no_metrics,
+            return_row_totals=return_row_totals
+        )
+
+    async def get_campaign_report(self,
+                                  start_time=_today(),
+                                  end_time=_today(),
+                                  timezone='UTC',
+                                  granularity='HOURLY',
+                                  selector=None,
+                                  group_by=[],
+                                  return_records_with_no_metrics=True,
+                                  return_row_totals=False):
+        """
+        See SearchAds.get_campaign_report
+        """
+        return await self._report(
+            path='',
+            start_time=start_time,
+            end_time=end_time,
+            timezone=timezone,
+            granularity=granularity,
+            selector=selector,
+            group_by=group_by,
+            return_records_with_no_metrics=return_records_with_no_metrics,
+            return_row_totals=return_row_totals
+        )
@@ -0,0 +1,296 @@
+import asyncio
+import logging
+import ssl
+import time
+
+from search_ads.api.instrumentation import get_instrumentation, RequestEvent
+from search_ads.api.utils import get_api_url, get_credentials, \
+    get_scheduler, SearchAdsError, _decode_response, _retry_after
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp is only needed by the asyncio client
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTransport(object):
+    """
+    asyncio counterpart of utils.Transport.
+
+    Keeps one aiohttp.ClientSession per (certificate, org) pair and bounds
+    the number of requests in flight with a semaphore shared by all of them.
+    Sessions are bound to the event loop they were created in, so close the
+    transport before that loop ends.
+
+    api_call also goes through the Scheduler of the threaded client, so each
+    org has at most Scheduler.max_concurrency requests in flight (20 by
+    default) whatever max_in_flight is: raise both to send more, e.g.
+    set_scheduler(Scheduler(max_concurrency=50)).
+    """
+
+    def __init__(self, max_in_flight=20, pool_maxsize=None):
+        """
+        :param max_in_flight: max number of concurrent requests, across orgs
+        :param pool_maxsize: max number of connections per session
+                             (defaults to max_in_flight)
+        """
+        if aiohttp is None:
+            raise ImportError(
+                "The asyncio client requires aiohttp: "
+                "pip install apple_search_ads[async]")
+        self.max_in_flight = max_in_flight
+        self.pool_maxsize = pool_maxsize or max_in_flight
+        self._sessions = {}
+        self._semaphore = None
+
+    def _session(self, cert, org_id=None, secure=True):
+        """
+        :param secure: whether the session sends https requests, which need
+                       the client certificate; plain http sessions (e.g. to
+                       a local stand-in of the API) do not load it
+        """
+        key = (tuple(cert), str(org_id) if org_id else None, secure)
+        session = self._sessions.get(key)
+        if session is None:
+            connector_kwargs = {'limit': self.pool_maxsize}
+            if secure:
+                ssl_context = ssl.create_default_context()
+                ssl_context.load_cert_chain(*cert)
+                connector_kwargs['ssl'] = ssl_context
+            headers = {}
+            if org_id:
+                headers["Authorization"] = "orgId={org_id}".format(
+                    org_id=org_id)
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(**connector_kwargs),
+                headers=headers
+            )
+            self._sessions[key] = session
+        return session
+
+    async def request(self, method, url, cert, org_id=None, headers=None,
+                      json_data=None):
+        """
+        Send a request, waiting for a free slot if max_in_flight requests
+        are already running
+        :param method: the HTTP method ('GET', 'PUT', 'POST', ...)
+        :param url: the full URL
+        :param cert: a (pem path, key path) tuple
+        :param org_id: the organization id, if any
+        :param headers: extra headers for this request only
+        :param json_data: the JSON body, if any
+        :return: a (status, body bytes, Retry-After seconds) tuple
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        call_kwargs = {}
+        if headers:
+            call_kwargs['headers'] = headers
+        if json_data:
+            call_kwargs['json'] = json_data
+        async with self._semaphore:
+            session = self._session(cert, org_id,
+                                    secure=not url.startswith('http://'))
+            async with session.request(method, url, **call_kwargs) as res:
+                return res.status, await res.read(), _retry_after(res)
+
+    async def close(self):
+        """
+        Close every session
+        """
+        sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            await session.close()
+
+
+_transport = None
+
+
+def get_transport():
+    global _transport
+    if _transport is None:
+        _transport = AsyncTransport()
+    return _transport
+
+
+async def _acquire(bucket, limiter):
+    """
+    Wait for a token of the bucket and a slot of the limiter, without
+    blocking the event loop as their acquire() would: the coroutine sleeps
+    until the next token, and until the limiter signals a release
+    :param bucket: a TokenBucket
+    :param limiter: an AdaptiveLimiter
+    """
+    wait = bucket.try_acquire()
+    while wait:
+        await asyncio.sleep(wait)
+        wait = bucket.try_acquire()
+    if limiter.try_acquire():
+        return
+    loop = asyncio.get_running_loop()
+    released = asyncio.Event()
+
+    def wake():  # called by release(), possibly from another thread
+        try:
+            loop.call_soon_threadsafe(released.set)
+        except RuntimeError:  # the loop is closed
+            pass
+
+    limiter.add_listener(wake)
+    try:
+        while True:
+            released.clear()
+            if limiter.try_acquire():
+                return
+            await released.wait()
+    finally:
+        limiter.remove_listener(wake)
+
+
+async def api_call(endpoint, headers={}, json_data={}, method='GET',
+                   api_version='v1', limit=1000, offset=0, org_id=None,
+                   verbose=False, transport=None, idempotent=None):
+    """
+    asyncio counterpart of utils.api_call: the call goes through the token
+    bucket and adaptive concurrency limit of its org, and is retried as
+    Scheduler.execute does
+    :param idempotent: whether the call can safely be sent twice, default
+                       all methods but POST
+    """
+    endpoint = "{}/{}".format(api_version, endpoint)
+    transport = transport or get_transport()
+    if idempotent is None:
+        idempotent = method != 'POST'
+
+    # The certificate may be written to disk on first use
+    cert = await asyncio.get_running_loop().run_in_executor(
+        None, get_credentials().get_cert)
+    scheduler = get_scheduler()
+    bucket, limiter = scheduler._org(org_id)
+    instrumentation = get_instrumentation()
+    event = RequestEvent(endpoint, method, org_id)
+    instrumentation.request_started(event)
+
+    start = time.perf_counter()
+    attempt = 0
+    try:
+        while True:
+            await _acquire(bucket, limiter)
+            status, body, retry_after, error = None, None, None, None
+            try:
+                status, body, retry_after = await transport.request(
+                    method,
+                    get_api_url().format(endpoint=endpoint),
+                    cert=cert,
+                    org_id=org_id,
+                    headers=headers,
+                    json_data=json_data
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            finally:
+                limiter.release(throttled=status == 429)
+            scheduler._count('requests')
+
+            if status is not None and status not in scheduler.RETRY_STATUSES:
+                break
+            throttled = status == 429
+            if throttled:
+                scheduler._count('throttled')
+            if attempt >= scheduler.max_retries or not scheduler.retryable(
+                    status, idempotent=idempotent,
+                    sent=not isinstance(error, aiohttp.ClientConnectorError)):
+                scheduler._count('failures')
+                if status is None:
+                    event.error = SearchAdsError(
+                        "Request failed after %d attempts: %s" % (
+                            attempt + 1, error))
+                    raise event.error
+                break
+
+            delay = scheduler.backoff(attempt, retry_after)
+            if throttled:
+                bucket.pause(delay)  # other calls of this org wait too
+            logger.warning("Retrying in %.1fs (%s)", delay,
+                           error or "HTTP %d" % status)
+            scheduler._count('retries')
+            await asyncio.sleep(delay)
+            attempt += 1
+        event.status = status
+        event.response_bytes = len(body)
+    finally:
+        event.latency = time.perf_counter() - start
+        event.retries = attempt
+        instrumentation.request_finished(event)
+
+    if verbose:
+        print(body.decode('utf-8', 'replace'))
+    return _decode_response(status, body)
+
+
+async def api_get(endpoint, api_version='v1', limit=1000, offset=0,
+                  org_id=None, verbose=False, transport=None):
+    return await api_call(
+        endpoint="{endpoint}?limit={limit}&offset={offset}".format(
+            endpoint=endpoint, limit=limit, offset=offset),
+        api_version=api_version,
+        limit=limit,
+        offset=offset,
+        org_id=org_id,
+        verbose=verbose,
+        transport=transport
+    )
+
+
+async def api_put(endpoint, data, api_version='v1', org_id=None,
+                  verbose=False, transport=None):
+    return await api_call(
+        endpoint,
+        json_data=data,
+        method='PUT',
+        api_version=api_version,
+        org_id=org_id,
+        verbose=verbose,
+        transport=transport
+    )
+
+
+async def api_post(endpoint, data, api_version='v1', org_id=None,
+                   verbose=False, transport=None, idempotent=False):
+    """
+    :param idempotent: True for the POSTs only reading data (reports,
+                       searches), which are retried like GETs
+    """
+    return await api_call(
+        endpoint,
+        json_data=data,
+        method='POST',
+        api_version=api_version,
+        org_id=org_id,
+        verbose=verbose,
+        transport=transport,
+        idempotent=idempotent
+    )
+
+
+async def paginate(fetch, page_size=1000, offset=0,
+                   items=lambda page: page['data']):
+    """
+    Async version of utils.paginate
+    :param fetch: a coroutine function (offset, limit) -> decoded response
+    :param page_size: number of results requested per page
+    :param offset: offset of the first result
+    :param items: a function returning the results contained in a page
+    :return: an async generator of decoded responses
+    """
+    while True:
+        page = await fetch(offset, page_size)
+        yield page
+        count = len(items(page) or [])
+        total = (page.get('pagination') or {}).get('totalResults')
+        offset += count
+        if count == 0 or (total is not None and offset >= total) or \
+                (total is None and count < page_size):
+            return
@@ -0,0 +1,276 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+
+def fingerprint(org_id, url, data):
+    """
+    Content address of a request
+    :param org_id: the organization id
+    :param url: the endpoint
+    :param data: the request body
+    :return: a hex digest
+    """
+    normalized = json.dumps([str(org_id), url, data], sort_keys=True,
+                            separators=(',', ':'))
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+class ReportCache(object):
+    """
+    Base class of the report caches.
+
+    Apple restates the metrics of the last few days, so reports whose
+    endTime is in the last `lookback_days` days, today or later expire after
+    `today_ttl` seconds; older reports never change and are kept until
+    evicted. Subclasses implement _get, _set and _evict, which are called
+    concurrently: they lock what they share, but not their disk I/O and
+    JSON decoding.
+    """
+
+    def __init__(self, today_ttl=3600, lookback_days=2):
+        """
+        :param today_ttl: seconds a recent report is kept
+        :param lookback_days: days before today whose metrics may still
+                              change, as in SearchAds.store_reports
+        """
+        self.today_ttl = today_ttl
+        self.lookback_days = lookback_days
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def ttl(self, data):
+        """
+        :param data: the report request body
+        :return: seconds the response can be kept, None for ever
+        """
+        end_time = str(data.get('endTime') or '')
+        settled = datetime.now() - timedelta(days=self.lookback_days)
+        if end_time[:10] >= settled.strftime("%Y-%m-%d"):
+            return self.today_ttl
+        return None
+
+    def get(self, org_id, url, data):
+        """
+        :return: the cached response of a request, None if missing
+        """
+        entry = self._get(fingerprint(org_id, url, data))
+        hit = entry is not None and (entry[0] is None or
+                                     entry[0] > time.time())
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry[1] if hit else None
+
+    def set(self, org_id, url, data, value):
+        """
+        Store the response of a request
+        """
+        ttl = self.ttl(data)
+        expires = time.time() + ttl if ttl is not None else None
+        self._set(fingerprint(org_id, url, data), expires, value)
+        self._evict()
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _set(self, key, expires, value):
+        raise NotImplementedError
+
+    def _evict(self):
+        raise NotImplementedError
+
+
+class MemoryCache(ReportCache):
+    """
+    In-process LRU cache
+    """
+
+    def __init__(self, max_entries=1024, today_ttl=3600, lookback_days=2):
+        """
+        :param max_entries: max number of responses kept
+        :param today_ttl: seconds a recent report is kept
+        :param lookback_days: days before today whose reports are recent
+        """
+        super(MemoryCache, self).__init__(today_ttl=today_ttl,
+                                          lookback_days=lookback_days)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _set(self, key, expires, value):
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+
+    def _evict(self):
+        with self._lock:
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DirectoryCache(ReportCache):
+    """
+    One JSON file per response in a local directory; the least recently
+    used files are deleted when the directory grows over max_bytes. The
+    files are listed once, when the cache is opened, and their total size
+    is then kept up to date by this process.
+    """
+
+    def __init__(self, path, max_bytes=1024 ** 3, today_ttl=3600,
+                 lookback_days=2):
+        """
+        :param path: the cache directory, created if missing
+        :param max_bytes: max total size of the cached files
+        :param today_ttl: seconds a recent report is kept
+        :param lookback_days: days before today whose reports are recent
+        """
+        super(DirectoryCache, self).__init__(today_ttl=today_ttl,
+                                             lookback_days=lookback_days)
+        self.path = path
+        self.max_bytes = max_bytes
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        files = []
+        for name in os.listdir(path):
+            if name.endswith('.json'):
+                stat = os.stat(os.path.join(path, name))
+                files.append((stat.st_mtime, name[:-len('.json')],
+                              stat.st_size))
+        # {key: file size}, least recently used first
+        self._sizes = OrderedDict((key, size) for _, key, size
+                                  in sorted(files))
+        self._total = sum(self._sizes.values())
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.json')
+
+    def _get(self, key):
+        try:
+            with open(self._file(key)) as f:
+                entry = json.load(f)
+            os.utime(self._file(key), None)  # recently used, for next opens
+        except (IOError, OSError, ValueError):
+            return None
+        with self._lock:
+            if key in self._sizes:
+                self._sizes.move_to_end(key)
+        return entry['expires'], entry['value']
+
+    def _set(self, key, expires, value):
+        temp_file = '%s.%d.tmp' % (self._file(key), threading.get_ident())
+        with open(temp_file, 'w') as f:
+            json.dump({'expires': expires, 'value': value}, f)
+            size = f.tell()
+        os.replace(temp_file, self._file(key))
+        with self._lock:
+            self._total += size - self._sizes.pop(key, 0)
+            self._sizes[key] = size
+
+    def _evict(self):
+        evicted = []
+        with self._lock:
+            while self._total > self.max_bytes and self._sizes:
+                key, size = self._sizes.popitem(last=False)
+                self._total -= size
+                evicted.append(key)
+        for key in evicted:
+            try:
+                os.remove(self._file(key))
+            except OSError:
+                pass
+
+
+class SQLiteCache(ReportCache):
+    """
+    Responses stored in a single SQLite file; the least recently used ones
+    are deleted when their total size grows over max_bytes
+    """
+
+    def __init__(self, path, max_bytes=1024 ** 3, today_ttl=3600,
+                 lookback_days=2):
+        """
+        :param path: the SQLite database file
+        :param max_bytes: max total size of the cached responses
+        :param today_ttl: seconds a recent report is kept
+        :param lookback_days: days before today whose reports are recent
+        """
+        super(SQLiteCache, self).__init__(today_ttl=today_ttl,
+                                          lookback_days=lookback_days)
+        self.path = path
+        self.max_bytes = max_bytes
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, "
+            "value TEXT, expires REAL, accessed REAL, size INTEGER)")
+        self._connection.commit()
+
+    def _get(self, key):
+        with self._lock:  # the connection is shared by the threads
+            row = self._connection.execute(
+                "SELECT expires, value FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE cache SET accessed = ? WHERE key = ?",
+                (time.time(), key))
+            self._connection.commit()
+        return row[0], json.loads(row[1])
+
+    def _set(self, key, expires, value):
+        value = json.dumps(value)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)",
+                (key, value, expires, time.time(), len(value)))
+            self._connection.commit()
+
+    def _evict(self):
+        with self._lock:
+            total = self._connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for key, size in self._connection.execute(
+                    "SELECT key, size FROM cache ORDER BY accessed"
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                self._connection.execute("DELETE FROM cache WHERE key = ?",
+                                         (key,))
+                total -= size
+            self._connection.commit()
+
+
+_report_cache = None
+
+
+def get_report_cache():
+    return _report_cache
+
+
+def set_report_cache(cache):
+    """
+    Cache the report responses, e.g. across processes:
+
+    >>> set_report_cache(SQLiteCache('reports_cache.db'))
+
+    :param cache: a ReportCache object, None to disable caching
+    """
+    global _report_cache
+    _report_cache = cache
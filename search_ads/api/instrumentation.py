@@ -0,0 +1,392 @@
+import bisect
+import contextlib
+import logging
+import os
+import re
+import threading
+import time
+from tempfile import mkstemp
+
+logger = logging.getLogger(__name__)
+
+_ids = re.compile(r'(?<=/)\d+(?=/|$)')
+
+
+def endpoint_route(endpoint):
+    """
+    The endpoint without query string and with the ids replaced by {id},
+    e.g. 'v1/campaigns/{id}/adgroups', so that it can be used as a label
+    """
+    return _ids.sub('{id}', endpoint.split('?', 1)[0])
+
+
+class RequestEvent(object):
+    """
+    What is known about an API call: before_request hooks receive it with
+    the request fields only, after_request hooks once it completed
+    """
+    __slots__ = ('endpoint', 'method', 'org_id', 'status', 'request_bytes',
+                 'response_bytes', 'latency', 'retries', 'error')
+
+    def __init__(self, endpoint, method, org_id=None):
+        """
+        :param endpoint: the endpoint, with the API version and query string
+        :param method: the HTTP method
+        :param org_id: the organization id, if any
+        """
+        self.endpoint = endpoint
+        self.method = method
+        self.org_id = org_id
+        self.status = None  # None if no response was received
+        self.request_bytes = None  # None when unknown
+        self.response_bytes = None
+        self.latency = None  # seconds, retries and backoff included
+        self.retries = 0
+        self.error = None  # the exception raised by the last attempt
+
+    @property
+    def route(self):
+        return endpoint_route(self.endpoint)
+
+    def labels(self):
+        """
+        :return: the labels of the request metrics
+        """
+        return {'endpoint': self.route, 'method': self.method,
+                'org': str(self.org_id or ''),
+                'status': str(self.status or 'error')}
+
+    def __repr__(self):
+        return "RequestEvent(%s %s, org=%s, status=%s, %s bytes, %.3fs, " \
+               "%d retries)" % (self.method, self.endpoint, self.org_id,
+                                self.status, self.response_bytes,
+                                self.latency or 0, self.retries)
+
+
+class Instrumentation(object):
+    """
+    Instrumentation of the client: hooks called around every API call, and
+    exporters receiving the request metrics and the timings of the local
+    steps (report flattening, DataFrame construction, ...).
+
+    An exporter is any object with an observe(name, value, labels) method,
+    e.g. HistogramExporter or PrometheusExporter. Hooks and exporters must
+    be thread safe: the calls are made from the threads sending requests.
+    Their exceptions are logged, never raised.
+    """
+
+    def __init__(self, exporters=()):
+        """
+        :param exporters: the exporters receiving the metrics
+        """
+        self.before_request = []
+        self.after_request = []
+        self.exporters = list(exporters)
+
+    def add_hooks(self, before=None, after=None):
+        """
+        Register functions called with a RequestEvent before and after
+        every API call
+        :param before: called before the first attempt
+        :param after: called after the last attempt, failed or not
+        """
+        if before is not None:
+            self.before_request.append(before)
+        if after is not None:
+            self.after_request.append(after)
+
+    def add_exporter(self, exporter):
+        """
+        :param exporter: an object with an observe(name, value, labels)
+                         method
+        :return: the exporter
+        """
+        self.exporters.append(exporter)
+        return exporter
+
+    def request_started(self, event):
+        for hook in self.before_request:
+            _safe_call(hook, event)
+
+    def request_finished(self, event):
+        logger.debug("%r", event)
+        for hook in self.after_request:
+            _safe_call(hook, event)
+        if self.exporters:
+            labels = event.labels()
+            self.observe('search_ads_request_seconds', event.latency, labels)
+            self.observe('search_ads_request_retries', event.retries, labels)
+            if event.response_bytes is not None:
+                self.observe('search_ads_response_bytes',
+                             event.response_bytes, labels)
+            if event.request_bytes is not None:
+                self.observe('search_ads_request_bytes', event.request_bytes,
+                             labels)
+
+    def observe(self, name, value, labels=None):
+        """
+        Send a measure to every exporter
+        :param name: the metric name
+        :param value: the measured value
+        :param labels: a dict of labels
+        """
+        for exporter in self.exporters:
+            _safe_call(exporter.observe, name, value, labels or {})
+
+    @contextlib.contextmanager
+    def timer(self, step, **labels):
+        """
+        Time a block of code, observed as search_ads_step_seconds{step=...}:
+
+        >>> with get_instrumentation().timer('report_dataframe'):
+        ...     df = columns.to_dataframe()
+
+        :param step: the name of the step
+        :param labels: more labels
+        """
+        if not self.exporters:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_step(step, time.perf_counter() - start, **labels)
+
+    def observe_step(self, step, seconds, **labels):
+        """
+        Record the duration of a step measured by the caller
+        :param step: the name of the step
+        :param seconds: its duration
+        :param labels: more labels
+        """
+        if self.exporters:
+            self.observe('search_ads_step_seconds', seconds,
+                         dict(labels, step=step))
+
+
+def _safe_call(function, *args):
+    try:
+        function(*args)
+    except Exception:
+        logger.exception("Instrumentation hook %r failed", function)
+
+
+_instrumentation = Instrumentation()
+
+
+def get_instrumentation():
+    return _instrumentation
+
+
+def set_instrumentation(instrumentation):
+    """
+    Replace the instrumentation used by the client:
+
+    >>> histograms = HistogramExporter()
+    >>> set_instrumentation(Instrumentation(exporters=[histograms]))
+
+    :param instrumentation: an Instrumentation object
+    """
+    global _instrumentation
+    _instrumentation = instrumentation
+
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30, 60)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+                 16777216, 67108864)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10)
+
+
+def default_buckets(name):
+    """
+    :return: the upper bounds of the histogram buckets of a metric,
+             chosen from the suffix of its name
+    """
+    if name.endswith('_seconds'):
+        return SECONDS_BUCKETS
+    if name.endswith('_bytes'):
+        return BYTES_BUCKETS
+    return COUNT_BUCKETS
+
+
+class Histogram(object):
+    """
+    Bucket counts (not cumulative) of a metric, plus count, sum, min and
+    max
+    """
+
+    def __init__(self, buckets):
+        """
+        :param buckets: the sorted upper bounds of the buckets
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Estimate a quantile by linear interpolation inside its bucket
+        :param q: between 0 and 1, e.g. 0.95
+        :return: the estimate, None if nothing was observed
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for position, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[position - 1] if position else self.min
+                upper = self.buckets[position] \
+                    if position < len(self.buckets) else self.max
+                lower, upper = max(lower, self.min), min(upper, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+
+class HistogramExporter(object):
+    """
+    Keeps a histogram per metric and label set, in process:
+
+    >>> histograms = get_instrumentation().add_exporter(HistogramExporter())
+    >>> api.store_reports(campaigns, database)
+    >>> for row in histograms.summary(): print(row)
+    """
+
+    def __init__(self, buckets=None):
+        """
+        :param buckets: {metric name: bucket upper bounds}, for the metrics
+                        not using the default_buckets
+        """
+        self.buckets = dict(buckets or {})
+        self.histograms = {}  # (name, sorted label items) -> Histogram
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(
+                    self.buckets.get(name) or default_buckets(name))
+            histogram.observe(value)
+
+    def get(self, name, **labels):
+        """
+        :return: the Histogram of a metric merged over the label sets
+                 matching labels, None if nothing was observed
+        """
+        merged = None
+        with self._lock:
+            for (metric, items), histogram in self.histograms.items():
+                if metric != name or \
+                        any(dict(items).get(key) != str(value)
+                            for key, value in labels.items()):
+                    continue
+                if merged is None:
+                    merged = Histogram(histogram.buckets)
+                merged.counts = [a + b for a, b in
+                                 zip(merged.counts, histogram.counts)]
+                merged.count += histogram.count
+                merged.sum += histogram.sum
+                merged.min = histogram.min if merged.min is None \
+                    else min(merged.min, histogram.min)
+                merged.max = histogram.max if merged.max is None \
+                    else max(merged.max, histogram.max)
+        return merged
+
+    def summary(self):
+        """
+        :return: a list of dicts with the name, labels, count, sum, mean,
+                 p50, p95, p99 and max of every histogram, by name and labels
+        """
+        with self._lock:
+            items = sorted(self.histograms.items())
+        return [dict(name=name, labels=dict(labels), count=histogram.count,
+                     sum=histogram.sum, mean=histogram.sum / histogram.count,
+                     p50=histogram.quantile(0.5), p95=histogram.quantile(0.95),
+                     p99=histogram.quantile(0.99), max=histogram.max)
+                for (name, labels), histogram in items]
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+
+class PrometheusExporter(HistogramExporter):
+    """
+    HistogramExporter rendering its histograms in the Prometheus text
+    exposition format, to serve them or to write them for the node_exporter
+    textfile collector:
+
+    >>> prometheus = get_instrumentation().add_exporter(PrometheusExporter())
+    >>> prometheus.write('/var/lib/node_exporter/search_ads.prom')
+    """
+
+    def render(self):
+        """
+        :return: the metrics in the Prometheus text format
+        """
+        with self._lock:
+            items = sorted((key, list(histogram.counts), histogram.count,
+                            histogram.sum, histogram.buckets)
+                           for key, histogram in self.histograms.items())
+        lines = []
+        last_name = None
+        for (name, labels), counts, count, total, buckets in items:
+            if name != last_name:
+                lines.append("# TYPE %s histogram" % name)
+                last_name = name
+            cumulative = 0
+            for bound, bucket_count in zip(
+                    [_format_number(bound) for bound in buckets] + ['+Inf'],
+                    counts):
+                cumulative += bucket_count
+                lines.append("%s_bucket%s %d" % (
+                    name, _format_labels(labels + (('le', bound),)),
+                    cumulative))
+            lines.append("%s_sum%s %s" % (name, _format_labels(labels),
+                                          _format_number(total)))
+            lines.append("%s_count%s %d" % (name, _format_labels(labels),
+                                            count))
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def write(self, path):
+        """
+        Write the metrics to a file, atomically
+        :param path: the destination path
+        """
+        fd, tmp_path = mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                               suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.render())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+
+def _format_number(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, str(value).replace('\\', '\\\\')
+                     .replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels)
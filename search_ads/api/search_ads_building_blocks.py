@@ -1,12 +1,19 @@
 import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from itertools import islice
 
-import pandas as pd
-from tqdm import tqdm
-
-from search_ads.api.utils import api_get
+from search_ads.api.instrumentation import get_instrumentation
+from search_ads.api.utils import api_get, iter_get
 from search_ads.models.store_models import Campaign, AdGroup
-from search_ads.models.reports import _today, \
+from search_ads.models.registry import EntityRegistry
+from search_ads.models.storage import ParquetStore, OPERATORS
+
+# pandas and tqdm are imported by the functions using them: importing the
+# package (e.g. to save campaigns) does not pay for them
+from search_ads.models.reports import _today, iter_report as _iter_report, \
     get_campaign_report as _get_campaign_report, \
     get_campaign_keywords_report as _get_campaign_keywords_report, \
     get_campaign_searchterms_report as _get_campaign_searchterms_report, \
@@ -14,23 +21,209 @@ from search_ads.models.reports import _today, \
 
 
 class DataBase(object):
-    campaigns = []
-    reports = {}
+    def __init__(self, campaigns=None, reports=None, watermarks=None,
+                 store=None):
+        """
+        Local storage of campaigns and reports
+        :param campaigns: a list of serialized campaigns
+        :param reports: {campaign: {report name: DataFrame}}, the campaigns
+                        report is stored under the 'campaign' key
+        :param watermarks: {(campaign id, report name, granularity): last
+                           settled day}, used by incremental store_reports
+        :param store: the ParquetStore the database was saved to or loaded
+                      from, if any
+        """
+        self.campaigns = campaigns if campaigns is not None else []
+        self.reports = reports if reports is not None else {}
+        self.watermarks = watermarks if watermarks is not None else {}
+        self.store = store
+        # (campaign id, report name) changed since the last save or load,
+        # None standing for the campaigns report
+        self.changed_reports = set()
+
+    def query(self, report, campaign_ids=None, start_date=None,
+              end_date=None, columns=None, filters=None):
+        """
+        Query a report across campaigns. When the database is saved on disk
+        the reports not changed since (see changed_reports) are read from
+        the saved data, the conditions being pushed down to storage (see
+        ParquetStore.query), so only the needed partitions, row groups and
+        columns are read; the changed ones are read from memory.
+        Reports replaced by hand must be added to changed_reports.
+        :param report: 'keywords', 'searchterms', 'adgroup' or 'campaign'
+        :param campaign_ids: the campaign ids, default all
+        :param start_date: first day (yyyy-mm-dd), inclusive
+        :param end_date: last day (yyyy-mm-dd), inclusive
+        :param columns: the columns to return, default all
+        :param filters: a list of (column, operator, value) conditions, all
+                        of which must hold; operators are =, ==, !=, <, <=,
+                        >, >=, in and not in
+        :return: a DataFrame
+        """
+        if self.store is None:
+            return self._query_memory(report, campaign_ids, start_date,
+                                      end_date, columns, filters)
+        changed = set(campaign_id for campaign_id, name
+                      in self.changed_reports if name == report)
+        df = self.store.query(report, campaign_ids=campaign_ids,
+                              start_date=start_date, end_date=end_date,
+                              columns=columns, filters=filters,
+                              exclude_campaign_ids=changed)
+        if not changed:
+            return df
+        import pandas as pd
+
+        dfs = [df, self._query_memory(report, campaign_ids, start_date,
+                                      end_date, columns, filters,
+                                      only=changed)]
+        dfs = [df for df in dfs if len(df)]
+        if not dfs:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(dfs, ignore_index=True)
+
+    def _query_memory(self, report, campaign_ids=None, start_date=None,
+                      end_date=None, columns=None, filters=None, only=None):
+        """
+        Query the reports in memory, see query
+        :param only: the campaign ids to read, None standing for the
+                     campaigns report, default all
+        """
+        if campaign_ids is not None:
+            campaign_ids = set(str(campaign_id) for campaign_id in campaign_ids)
+        dfs = []
+        for key, value in self.reports.items():
+            if isinstance(key, Campaign):
+                if (only is None or key._id in only) and report in value and \
+                        (campaign_ids is None or key._id in campaign_ids):
+                    dfs.append(value[report])
+            elif key == report and (only is None or None in only):
+                dfs.append(value)
+        import pandas as pd
+
+        dfs = [df for df in dfs if len(df)]
+        if not dfs:
+            return pd.DataFrame(columns=columns)
+        df = pd.concat(dfs)
+        mask = pd.Series(True, index=df.index)
+        if start_date:
+            mask &= df['date'].astype(str).str[:10] >= start_date
+        if end_date:
+            mask &= df['date'].astype(str).str[:10] <= end_date
+        for column, operator, value in filters or []:
+            mask &= OPERATORS[operator](df[column], value)
+        df = df[mask.values]
+        return df[columns] if columns else df
 
     def serialize_database(self):
-        return json.dumps(self.__dict__)
+        """
+        Serialize the database as JSON; for large databases prefer save()
+        :return: a JSON string
+        """
+        reports = {}
+        for key, value in self.reports.items():
+            if isinstance(key, Campaign):
+                reports[key._id] = {
+                    'campaign': key.to_json(),
+                    'reports': dict((name, _df_to_json(df))
+                                    for name, df in value.items())
+                }
+            else:
+                reports[key] = _df_to_json(value)
+        return json.dumps({
+            'campaigns': self.campaigns,
+            'reports': reports,
+            'watermarks': [list(key) + [value]
+                           for key, value in self.watermarks.items()],
+        })
 
     @staticmethod
     def restore_database(json_data):
-        return DataBase(**json.loads(json_data))
+        """
+        Restore a database serialized with serialize_database
+        :param json_data: a JSON string
+        :return: a DataBase object
+        """
+        data = json.loads(json_data)
+        reports = {}
+        for key, value in data['reports'].items():
+            if isinstance(value, dict) and 'campaign' in value:
+                campaign = Campaign(**json.loads(value['campaign']))
+                reports[campaign] = dict(
+                    (name, _df_from_json(df))
+                    for name, df in value['reports'].items())
+            else:
+                reports[key] = _df_from_json(value)
+        return DataBase(
+            campaigns=data['campaigns'],
+            reports=reports,
+            watermarks=dict((tuple(item[:3]), item[3])
+                            for item in data['watermarks'])
+        )
+
+    def save(self, path):
+        """
+        Store the database as Parquet files partitioned by campaign, report
+        and day (requires pyarrow). Saving again to the same directory
+        only rewrites the reports in changed_reports
+        :param path: the store directory
+        """
+        if self.store is not None and \
+                os.path.abspath(self.store.path) == os.path.abspath(path):
+            self.store.write(self, changed=self.changed_reports)
+        else:
+            self.store = ParquetStore(path)
+            self.store.write(self)
+        self.changed_reports = set()
+
+    @staticmethod
+    def load(path):
+        """
+        Restore a database stored with save(). Only the manifest is read:
+        each report is read, memory mapped, the first time it is accessed
+        :param path: the store directory
+        :return: a DataBase object
+        """
+        return ParquetStore(path).load(DataBase)
+
+
+def _df_to_json(df):
+    import pandas as pd
+
+    if isinstance(df, pd.DataFrame):
+        return json.loads(df.to_json(orient='split', index=False))
+    return df
+
+
+def _df_from_json(data):
+    import pandas as pd
+
+    if isinstance(data, dict):
+        return pd.DataFrame(data['data'], columns=data['columns'])
+    return data
+
+
+def _merge_report(stored, df, since):
+    """
+    Replace the rows of a stored report dated `since` or later with df
+    """
+    if stored is None or len(stored) == 0 or 'date' not in stored:
+        return df
+    import pandas as pd
+
+    kept = stored[stored['date'].astype(str) < since]
+    if len(df) == 0:
+        return kept
+    return pd.concat([kept, df])
 
 
 class SearchAds(object):
-    def __init__(self, org_name, api_version='v1'):
+    def __init__(self, org_name, api_version='v1', registry_ttl=300):
         """
         Initialize the API object
         :param org_name: Your organization name as found in the SearchAds interface
         :param api_version: The API version (current is v1)
+        :param registry_ttl: seconds the campaigns, ad groups and keywords
+                             used by the lookups are cached, None for ever
         """
         self.api_version = api_version
         orgs = api_get("acls", api_version=self.api_version)
@@ -41,6 +234,8 @@ class SearchAds(object):
         if not self.org_id:
             raise Exception(
                 "Organization %s does not exist on this account" % org_name)
+        self.registry = EntityRegistry(self.get_campaigns, org_id=self.org_id,
+                                       ttl=registry_ttl)
 
     def _call(self, endpoint, verbose=False):
         return \
@@ -52,93 +247,183 @@ class SearchAds(object):
             database.campaigns.append(campaign.to_json())
 
     def store_reports(self, campaigns, database, granularity=None,
-                      start_date=None, end_date=None):
-        _start_date, _end_date, _granularity = start_date, end_date, granularity
-        for campaign in tqdm(campaigns):
-            database.reports[campaign] = {}
-            for report, func in [
-                ('keywords', self.get_campaign_keywords_report),
-                ('searchterms', self.get_campaign_searchterms_report),
-                ('adgroup', self.get_campaign_adgroups_report),
-                ('campaign', self.get_campaign_report)
-            ]:
-                start_date = _start_date or (datetime.now() - timedelta(days=30))
-                end_date = _end_date or datetime.now()
-                granularity = _granularity or 'HOURLY'
-                if report == 'searchterms' and granularity == 'HOURLY':
-                    # "Warning: forcing daily granularity for search terms"
-                    granularity = 'DAILY'
-                step = {
-                    'HOURLY': 7,
-                    'DAILY': 90,
-                    'WEEKLY': 365
-                }[granularity]
-
-                selector = {
-                    "orderBy": [
-                        {
-                            "field": "impressions",
-                            "sortOrder": "DESCENDING"
-                        }
-                    ],
-                    "pagination": {
-                        "offset": 0, "limit": 5000
-                    }
+                      start_date=None, end_date=None, max_workers=1,
+                      incremental=False, lookback_days=2):
+        """
+        Download the keywords, search terms, ad groups and campaign reports
+        of the given campaigns into the database, in time windows
+        :param campaigns: a list of Campaign objects
+        :param database: a DataBase object
+        :param granularity: 'HOURLY' (default), 'DAILY' or 'WEEKLY'
+        :param start_date: a datetime, defaults to 30 days ago
+        :param end_date: a datetime, defaults to now
+        :param max_workers: number of report windows downloaded in parallel;
+                            for more than 10 raise the transport pool size
+                            with set_transport(Transport(pool_maxsize=...))
+        :param incremental: only download what changed since the last run:
+                            reports already in the database are fetched from
+                            their last settled day minus lookback_days, and
+                            merged with the stored data
+        :param lookback_days: days before the last settled day that are
+                              downloaded again, as Apple may restate them
+        :return: a list of (campaign, report, window start, exception)
+                 tuples, one for each window that could not be downloaded
+        """
+        import pandas as pd
+        from tqdm import tqdm
+
+        watermarks = database.watermarks if incremental else None
+        units = self._report_units(campaigns, granularity, start_date,
+                                   end_date, watermarks=watermarks,
+                                   lookback_days=lookback_days)
+        results = [None] * len(units)
+        errors = []
+
+        def run(i):
+            campaign, report, func, kwargs = units[i]
+            try:
+                results[i] = func(**kwargs)
+            except Exception as e:
+                errors.append((i, (campaign, report, kwargs['start_time'], e)))
+
+        if max_workers > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for _ in tqdm(executor.map(run, range(len(units))),
+                              total=len(units)):
+                    pass
+        else:
+            for i in tqdm(range(len(units))):
+                run(i)
+
+        previous = {}
+        if incremental:  # campaigns may be new objects for stored campaigns
+            ids = set(campaign._id for campaign in campaigns)
+            for campaign in list(database.reports):
+                if isinstance(campaign, Campaign) and campaign._id in ids:
+                    previous[campaign._id] = database.reports.pop(campaign)
+        for campaign in campaigns:
+            database.reports[campaign] = previous.get(campaign._id, {})
+
+        # Assemble in scheduling order, whatever the completion order was
+        dfs = OrderedDict()
+        for (campaign, report, _, kwargs), df in zip(units, results):
+            key = (campaign, report, kwargs['granularity'])
+            dfs.setdefault(key, (kwargs['start_time'], []))
+            if df is not None:
+                dfs[key][1].append(df)
+        failed = set((campaign, report) for _, (campaign, report, _, _)
+                     in errors)
+        settled = (min(end_date or datetime.now(), datetime.now()) -
+                   timedelta(days=1)).strftime("%Y-%m-%d")
+        with get_instrumentation().timer('store_reports_assemble'):
+            for (campaign, report, granularity), (since, report_dfs) in \
+                    dfs.items():
+                df = pd.concat(report_dfs) if report_dfs else []
+                stored = database.reports[campaign] \
+                    if campaign is not None else database.reports
+                if incremental:
+                    if (campaign, report) in failed:
+                        continue  # keep the stored data and watermark as is
+                    df = _merge_report(stored.get(report), df, since)
+                    watermarks[(campaign._id if campaign is not None
+                                else None, report, granularity)] = settled
+                stored[report] = df
+                database.changed_reports.add(
+                    (campaign._id if campaign is not None else None, report))
+        return [error for _, error in sorted(errors, key=lambda e: e[0])]
+
+    def _report_units(self, campaigns, granularity=None, start_date=None,
+                      end_date=None, watermarks=None, lookback_days=2):
+        """
+        Split the reports to download in independent (campaign, report,
+        function, kwargs) units, one per time window
+        """
+        selector = {
+            "orderBy": [
+                {
+                    "field": "impressions",
+                    "sortOrder": "DESCENDING"
                 }
-                dfs = []
-                while start_date < end_date:
-                    if report != 'campaign':
-                        tdf = func(
-                            campaign=campaign,
-                            start_time=start_date.strftime("%Y-%m-%d"),
-                            end_time=(start_date + timedelta(days=step)).strftime(
-                                "%Y-%m-%d"),
-                            granularity=granularity,
-                            return_records_with_no_metrics=False,
-                            return_row_totals=False,
-                            selector=selector
-                        )
-                    else:
-                        tdf = func(
-                            start_time=start_date.strftime("%Y-%m-%d"),
-                            end_time=(start_date + timedelta(days=step)).strftime(
-                                "%Y-%m-%d"),
-                            granularity=granularity,
-                            return_records_with_no_metrics=False,
-                            return_row_totals=False,
-                            selector=selector
-                        )
-                    start_date += timedelta(days=step)
-                    dfs.append(tdf)
-                if report != 'campaign':
-                    database.reports[campaign][report] = pd.concat(
-                        dfs) if dfs else []
-                else:
-                    database.reports[report] = pd.concat(
-                        dfs) if dfs else []
-
-    def get_campaigns(self, limit=2000):
+            ],
+            "pagination": {
+                "offset": 0, "limit": 5000
+            }
+        }
+        units = []
+        reports = [
+            ('keywords', self.get_campaign_keywords_report),
+            ('searchterms', self.get_campaign_searchterms_report),
+            ('adgroup', self.get_campaign_adgroups_report),
+        ]
+        targets = [(campaign, report, func)
+                   for campaign in campaigns for report, func in reports]
+        if campaigns:
+            # The campaign report covers the whole org, download it once
+            targets.append((None, 'campaign', self.get_campaign_report))
+
+        for campaign, report, func in targets:
+            window_start = start_date or (datetime.now() - timedelta(days=30))
+            window_end = end_date or datetime.now()
+            report_granularity = granularity or 'HOURLY'
+            if report == 'searchterms' and report_granularity == 'HOURLY':
+                # "Warning: forcing daily granularity for search terms"
+                report_granularity = 'DAILY'
+            step = {
+                'HOURLY': 7,
+                'DAILY': 90,
+                'WEEKLY': 365
+            }[report_granularity]
+            watermark = (watermarks or {}).get(
+                (campaign._id if campaign is not None else None, report,
+                 report_granularity))
+            if watermark:
+                window_start = datetime.strptime(watermark, "%Y-%m-%d") + \
+                    timedelta(days=1 - lookback_days)
+
+            while window_start < window_end:
+                kwargs = dict(
+                    start_time=window_start.strftime("%Y-%m-%d"),
+                    end_time=min(window_start + timedelta(days=step),
+                                 window_end).strftime("%Y-%m-%d"),
+                    granularity=report_granularity,
+                    return_records_with_no_metrics=False,
+                    return_row_totals=False,
+                    selector=selector
+                )
+                if campaign is not None:
+                    kwargs['campaign'] = campaign
+                units.append((campaign, report, func, kwargs))
+                window_start += timedelta(days=step)
+        return units
+
+    def get_campaigns(self, limit=None):
         """
         Return all campaigns in the account
-        :param limit: limit the results (default is 2000)
+        :param limit: limit the results (default is no limit)
         :return: a list of Campaign objects
         """
-        campaigns = []
-        data = \
-            api_get('campaigns', org_id=self.org_id,
-                    api_version=self.api_version,
-                    limit=limit)['data']
-        for raw_campaign in data:
-            campaigns.append(Campaign(**raw_campaign))
-        return campaigns
+        return list(islice(self.iter_campaigns(), limit))
 
-    def get_campaigns_by_name(self, name):
+    def iter_campaigns(self, page_size=1000, prefetch=False):
         """
-        Fetches all campaigns that match a certain name
+        Lazily yield all campaigns in the account, page by page
+        :param page_size: number of campaigns downloaded per call
+        :param prefetch: download the next page while the current one is consumed
+        :return: a generator of Campaign objects
+        """
+        return iter_get('campaigns', org_id=self.org_id,
+                        api_version=self.api_version, page_size=page_size,
+                        prefetch=prefetch, decode=Campaign.decode)
+
+    def get_campaigns_by_name(self, name, prefix=False):
+        """
+        Find the campaigns whose name contains name, ignoring the case.
+        Campaigns are looked up in self.registry, so they are only
+        downloaded once every registry_ttl seconds.
         :param name: the query for the name
+        :param prefix: match the beginning of the names only
         :return: a list of Campaign objects
         """
-        campaigns = []
         """
         # Unfortunately apple doesn't document the parameters for /find (...)
         data = \
@@ -148,10 +433,44 @@ class SearchAds(object):
             campaigns.append(Campaign(**raw_campaign))
         return campaigns
         """
-        for campaign in self.get_campaigns():
-            if name.lower() in campaign.name.lower():
-                campaigns.append(campaign)
-        return campaigns
+        return self.registry.campaigns().search(name, prefix=prefix)
+
+    def get_campaign_by_name(self, name):
+        """
+        Find the campaign named name, ignoring the case
+        :param name: the campaign name
+        :return: a Campaign object, None if missing
+        """
+        campaigns = self.registry.campaigns().find(name)
+        return campaigns[0] if campaigns else None
+
+    def get_campaign_by_id(self, campaign_id):
+        """
+        :param campaign_id: the campaign id
+        :return: a Campaign object, None if missing
+        """
+        return self.registry.campaigns().get(campaign_id)
+
+    def get_ad_group_by_name(self, campaign, name):
+        """
+        Find the Ad Group of a campaign named name, ignoring the case
+        :param campaign: a Campaign object
+        :param name: the Ad Group name
+        :return: an AdGroup object, None if missing
+        """
+        ad_groups = self.registry.ad_groups(campaign).find(name)
+        return ad_groups[0] if ad_groups else None
+
+    def get_keywords_by_text(self, ad_group, text, prefix=False):
+        """
+        Find the keywords of an Ad Group whose text contains text, ignoring
+        the case
+        :param ad_group: an AdGroup object
+        :param text: the query for the text
+        :param prefix: match the beginning of the texts only
+        :return: a list of Keyword objects
+        """
+        return self.registry.keywords(ad_group).search(text, prefix=prefix)
 
     def get_campaign_keywords_report(self,
                                      campaign,
@@ -295,6 +614,28 @@ class SearchAds(object):
             return_row_totals=return_row_totals
         )
 
+    def iter_report(self, campaign=None, report='keywords', batch_size=None,
+                    prefetch=False, **kwargs):
+        """
+        Lazily yield the flattened rows of a report, so that it can be
+        exported in constant memory
+        :param campaign: a Campaign object, None for the campaigns report
+        :param report: 'keywords', 'searchterms' or 'adgroups'; ignored for
+                       the campaigns report
+        :param batch_size: if set, yield lists of up to batch_size rows
+        :param prefetch: download the next page while the current one is consumed
+        :param kwargs: any parameter of get_campaign_keywords_report (start_time, ...)
+        :return: a generator of dicts (or of lists of dicts)
+        """
+        return _iter_report(
+            campaign=campaign,
+            path=report if campaign else '',
+            org_id=self.org_id,
+            batch_size=batch_size,
+            prefetch=prefetch,
+            **kwargs
+        )
+
     def create_campaign(self,
                         campaign_name,
                         ad_group_name,
@@ -355,4 +696,5 @@ class SearchAds(object):
 
         campaign.save(cascade=False)
 
+        self.registry.invalidate()
         return self.get_campaign_by_name(campaign_name)
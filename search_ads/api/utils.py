@@ -1,10 +1,49 @@
+import atexit
 import contextlib
+import json
+import logging
 
 import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+
 import requests
 from decouple import config
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+from search_ads.api.instrumentation import get_instrumentation, RequestEvent
+
+try:
+    import orjson
+except ImportError:  # orjson is an optional, faster, JSON parser
+    orjson = None
+
+from tempfile import mkstemp
+
+API_URL = "https://api.searchads.apple.com/api/{endpoint}"
+
+logger = logging.getLogger(__name__)
+
+
+class SearchAdsError(Exception):
+    """
+    Error returned by the Search Ads API
+    """
 
-from tempfile import NamedTemporaryFile
+    def __init__(self, message, status=None, response=None):
+        """
+        :param message: the error message
+        :param status: the HTTP status code, if any
+        :param response: the decoded response body, if any
+        """
+        super(SearchAdsError, self).__init__(message)
+        self.status = status
+        self.response = response
 
 
 @contextlib.contextmanager
@@ -31,62 +70,574 @@ def set_env(**environ):
         os.environ.update(old_environ)
 
 
-def api_call(endpoint, headers={}, json_data={}, method=requests.get,
-             api_version='v1', limit=1000, offset=0, org_id=None,
-             verbose=False):
-    endpoint = "{}/{}".format(api_version, endpoint)
-    # print("Endpoint:", endpoint)
-    # print("Data:", json_data)
+class Transport(object):
+    """
+    Keep-alive HTTP transport shared by every API call.
 
-    temp_pem = NamedTemporaryFile(suffix='.pem')
-    temp_key = NamedTemporaryFile(suffix='.key')
+    One requests.Session (and therefore one connection pool) is kept for each
+    (certificate, org) pair, so consecutive calls reuse the same TLS
+    connection instead of doing a new handshake every time.
+    """
 
-    pem_env_var = config('SEARCH-ADS-PEM')
-    key_env_var = config('SEARCH-ADS-KEY')
+    def __init__(self, pool_connections=10, pool_maxsize=10, timeout=60):
+        """
+        :param pool_connections: number of host pools cached per session
+        :param pool_maxsize: max number of connections kept alive per pool
+        :param timeout: seconds to wait for the server before giving up
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
 
-    try:
-        if pem_env_var.endswith('.pem'):  # env is the name of file
-            call_kwargs = {
-                "cert": (
-                    pem_env_var,
-                    key_env_var
-                ),
-                "headers": headers,
-            }
-        else:   # env var is the key explicit
-            pem_lines = pem_env_var.split("\\n")
-            temp_pem.writelines(["%s\n" % item for item in pem_lines])
-            temp_pem.flush()  # ensure all data written
-
-            key_lines = key_env_var.split("\\n")
-            temp_key.writelines(["%s\n" % item for item in key_lines])
-            temp_key.flush()  # ensure all data written
-
-            call_kwargs = {
-                "cert": (
-                    temp_pem.name,
-                    temp_key.name
-                ),
-                "headers": headers,
-            }
+    def session(self, cert, org_id=None):
+        """
+        Return the pooled session for a (certificate, org) pair
+        :param cert: a (pem path, key path) tuple
+        :param org_id: the organization id, if any
+        :return: a requests.Session
+        """
+        key = (tuple(cert), str(org_id) if org_id else None)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                                      pool_maxsize=self.pool_maxsize)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.cert = tuple(cert)
+                if org_id:
+                    session.headers["Authorization"] = \
+                        "orgId={org_id}".format(org_id=org_id)
+                self._sessions[key] = session
+        return session
+
+    def request(self, method, url, cert, org_id=None, headers=None,
+                json_data=None):
+        """
+        Send a request through the pooled session
+        :param method: the HTTP method ('GET', 'PUT', 'POST', ...)
+        :param url: the full URL
+        :param cert: a (pem path, key path) tuple
+        :param org_id: the organization id, if any
+        :param headers: extra headers for this request only
+        :param json_data: the JSON body, if any
+        :return: a requests.Response
+        """
+        call_kwargs = {'timeout': self.timeout}
+        if headers:
+            call_kwargs['headers'] = headers
         if json_data:
             call_kwargs['json'] = json_data
-        if org_id:
-            call_kwargs['headers']["Authorization"] = "orgId={org_id}".format(
-                org_id=org_id)
-        req = method(
-            "https://api.searchads.apple.com/api/{endpoint}".format(
-                endpoint=endpoint),
-            **call_kwargs
+        return self.session(cert, org_id).request(method, url, **call_kwargs)
+
+    def release(self, cert, org_id=None):
+        """
+        Close and forget the session of a (certificate, org) pair
+        """
+        key = (tuple(cert), str(org_id) if org_id else None)
+        with self._lock:
+            session = self._sessions.pop(key, None)
+        if session is not None:
+            session.close()
+
+    def close(self):
+        """
+        Close every pooled session
+        """
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            session.close()
+
+
+_transport = Transport()
+
+
+def get_transport():
+    return _transport
+
+
+def set_transport(transport):
+    """
+    Replace the transport used by api_call, e.g. to change the pool size:
+
+    >>> set_transport(Transport(pool_maxsize=50))
+
+    :param transport: a Transport object
+    """
+    global _transport
+    old_transport, _transport = _transport, transport
+    if old_transport is not transport:
+        old_transport.close()
+
+
+class CredentialProvider(object):
+    """
+    Resolve the client certificate once per process.
+
+    SEARCH-ADS-PEM / SEARCH-ADS-KEY can either be paths to the certificate
+    files or the certificates themselves. In the latter case they are written
+    to disk a single time and the files are reused until the configured value
+    changes (e.g. inside a different set_env block) or the process exits.
+    """
+
+    def __init__(self, pem_var='SEARCH-ADS-PEM', key_var='SEARCH-ADS-KEY'):
+        """
+        :param pem_var: name of the setting holding the pem certificate
+        :param key_var: name of the setting holding the key certificate
+        """
+        self.pem_var = pem_var
+        self.key_var = key_var
+        self._source = None
+        self._cert = None
+        self._files = []
+        self._lock = threading.Lock()
+        atexit.register(self.clear)
+
+    def get_cert(self):
+        """
+        Return the certificate to use for the current configuration
+        :return: a (pem path, key path) tuple
+        """
+        source = (config(self.pem_var), config(self.key_var))
+        if source != self._source:
+            with self._lock:
+                if source != self._source:
+                    self._rotate(source)
+        return self._cert
+
+    def _rotate(self, source):
+        self._remove_files()
+        pem_env_var, key_env_var = source
+        if pem_env_var.endswith('.pem'):  # env is the name of file
+            cert = source
+        else:   # env var is the key explicit
+            cert = (self._materialize(pem_env_var, '.pem'),
+                    self._materialize(key_env_var, '.key'))
+        self._cert, self._source = cert, source
+
+    def _materialize(self, value, suffix):
+        fd, path = mkstemp(suffix=suffix)  # readable by the owner only
+        self._files.append(path)
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(["%s\n" % item for item in value.split("\\n")])
+        return path
+
+    def _remove_files(self):
+        for path in self._files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._files = []
+
+    def clear(self):
+        """
+        Forget the cached certificate and delete the files written for it
+        """
+        with self._lock:
+            self._remove_files()
+            self._cert, self._source = None, None
+
+
+_credentials = CredentialProvider()
+
+
+def get_credentials():
+    return _credentials
+
+
+def set_credentials(credentials):
+    """
+    Replace the credential provider used by api_call
+    :param credentials: a CredentialProvider object
+    """
+    global _credentials
+    old_credentials, _credentials = _credentials, credentials
+    if old_credentials is not credentials:
+        old_credentials.clear()
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket: allows `rate` calls per second on average, with
+    bursts of up to `burst` calls
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        """
+        Take a token if one is available
+        :return: 0 if a token was taken, else the seconds to wait before the
+                 next one
+        """
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """
+        Take a token, waiting until one is available
+        """
+        wait = self.try_acquire()
+        while wait:
+            time.sleep(wait)
+            wait = self.try_acquire()
+
+    def pause(self, seconds):
+        """
+        Stop handing out tokens for the next `seconds` seconds
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+class AdaptiveLimiter(object):
+    """
+    Concurrency limit that adapts to throttling: it is halved every time the
+    server throttles a call and grows back by one every `increase_every`
+    successful calls (additive increase, multiplicative decrease)
+    """
+
+    def __init__(self, max_concurrency, min_concurrency=1, increase_every=10):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.increase_every = increase_every
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+        self._listeners = set()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def try_acquire(self):
+        """
+        :return: True if a call may start, which is then counted in flight
+        """
+        with self._condition:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def add_listener(self, listener):
+        """
+        Call listener() after every release, e.g. to wake up the coroutines
+        waiting for a slot (they cannot wait on the thread condition)
+        """
+        with self._condition:
+            self._listeners.add(listener)
+
+    def remove_listener(self, listener):
+        with self._condition:
+            self._listeners.discard(listener)
+
+    def release(self, throttled=False):
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.increase_every:
+                    self.limit = min(self.max_concurrency, self.limit + 1)
+                    self._successes = 0
+            self._condition.notify_all()
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener()
+
+
+class Scheduler(object):
+    """
+    Central request scheduler.
+
+    Every call goes through a token bucket and an adaptive concurrency limit
+    of its org. Throttled (429), unavailable (5xx) and dropped calls are
+    retried with jittered exponential backoff, honoring Retry-After. Calls
+    that are not idempotent (POSTs creating entities) are only retried when
+    the server did not process them: on a 429, or when the connection could
+    not be opened. What happened is counted in `stats`.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, rate=20, burst=20, max_concurrency=20,
+                 min_concurrency=1, max_retries=5, backoff_base=0.5,
+                 backoff_max=60):
+        """
+        :param rate: calls per second allowed for each org
+        :param burst: calls allowed in a burst for each org
+        :param max_concurrency: max number of calls in flight for each org
+        :param min_concurrency: lower bound of the adaptive concurrency limit
+        :param max_retries: max number of retries of a single call
+        :param backoff_base: seconds of backoff for the first retry
+        :param backoff_max: max seconds of backoff for a single retry
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.stats = Counter()
+        self._orgs = {}
+        self._lock = threading.Lock()
+
+    def _org(self, org_id):
+        key = str(org_id) if org_id else None
+        with self._lock:
+            if key not in self._orgs:
+                self._orgs[key] = (
+                    TokenBucket(self.rate, self.burst),
+                    AdaptiveLimiter(self.max_concurrency, self.min_concurrency)
+                )
+            return self._orgs[key]
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def concurrency(self, org_id=None):
+        """
+        :return: the current concurrency limit of an org
+        """
+        return int(self._org(org_id)[1].limit)
+
+    def backoff(self, attempt, retry_after=None):
+        """
+        :param attempt: number of the failed attempt, starting from 0
+        :param retry_after: seconds requested by the server, if any
+        :return: seconds to wait before the next attempt
+        """
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def retryable(self, status=None, sent=True, idempotent=True):
+        """
+        :param status: the HTTP status of the failed attempt, None if no
+                       response was received
+        :param sent: False if the request never reached the server
+        :param idempotent: whether sending the request twice is harmless
+        :return: whether the attempt may be sent again
+        """
+        if status is not None:
+            return status == 429 or \
+                (idempotent and status in self.RETRY_STATUSES)
+        return idempotent or not sent
+
+    def execute(self, send, org_id=None, idempotent=True):
+        """
+        Run a call, retrying it when it makes sense
+        :param send: a function sending the request and returning a
+                     requests.Response
+        :param org_id: the organization id, if any
+        :param idempotent: False for the calls that must not be sent twice
+                           if the server may have processed them
+        :return: the last requests.Response
+        """
+        bucket, limiter = self._org(org_id)
+        attempt = 0
+        while True:
+            bucket.acquire()
+            limiter.acquire()
+            res, error, throttled = None, None, False
+            try:
+                res = send()
+                throttled = res.status_code == 429
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            finally:
+                limiter.release(throttled=throttled)
+            self._count('requests')
+
+            if res is not None and res.status_code not in self.RETRY_STATUSES:
+                return res
+            if throttled:
+                self._count('throttled')
+            if attempt >= self.max_retries or not self.retryable(
+                    res.status_code if res is not None else None,
+                    sent=not _never_sent(error), idempotent=idempotent):
+                self._count('failures')
+                if res is None:
+                    raise SearchAdsError(
+                        "Request failed after %d attempts: %s" % (
+                            attempt + 1, error))
+                return res
+
+            delay = self.backoff(attempt, _retry_after(res))
+            if throttled:
+                bucket.pause(delay)  # other threads of this org wait too
+            logger.warning("Retrying in %.1fs (%s)", delay,
+                           error or "HTTP %d" % res.status_code)
+            self._count('retries')
+            time.sleep(delay)
+            attempt += 1
+
+
+def _never_sent(error):
+    """
+    Whether a requests exception means the connection could not be opened,
+    so that the request did not reach the server
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) \
+        if error is not None and error.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+def _retry_after(res):
+    value = res.headers.get('Retry-After') if res is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() -
+                       time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+_scheduler = Scheduler()
+
+
+def get_scheduler():
+    return _scheduler
+
+
+def set_scheduler(scheduler):
+    """
+    Replace the scheduler used by api_call, e.g. to change the rate limits:
+
+    >>> set_scheduler(Scheduler(rate=5, max_retries=10))
+
+    :param scheduler: a Scheduler object
+    """
+    global _scheduler
+    _scheduler = scheduler
+
+
+_api_url = API_URL
+
+
+def get_api_url():
+    return _api_url
+
+
+def set_api_url(api_url=API_URL):
+    """
+    Send the API calls to another server, e.g. a local stand-in of the
+    Search Ads API in the benchmarks:
+
+    >>> set_api_url('http://127.0.0.1:8000/api/{endpoint}')
+
+    :param api_url: the URL template, {endpoint} being replaced by the
+                    API version and the endpoint; default the Apple API
+    """
+    global _api_url
+    _api_url = api_url
+
+
+def api_call(endpoint, headers={}, json_data={}, method='GET',
+             api_version='v1', limit=1000, offset=0, org_id=None,
+             verbose=False, idempotent=None):
+    endpoint = "{}/{}".format(api_version, endpoint)
+    if callable(method):  # backwards compatibility with requests.get & co.
+        method = method.__name__.upper()
+    if idempotent is None:
+        idempotent = method != 'POST'
+
+    cert = get_credentials().get_cert()
+    transport = get_transport()
+    instrumentation = get_instrumentation()
+    event = RequestEvent(endpoint, method, org_id)
+    instrumentation.request_started(event)
+    attempts = []
+
+    def send():
+        attempts.append(None)
+        return transport.request(
+            method,
+            get_api_url().format(endpoint=endpoint),
+            cert=cert,
+            org_id=org_id,
+            headers=headers,
+            json_data=json_data
         )
+
+    start = time.perf_counter()
+    try:
+        req = get_scheduler().execute(send, org_id=org_id,
+                                      idempotent=idempotent)
+    except SearchAdsError as e:
+        event.error = e
+        raise
+    else:
+        event.status = req.status_code
+        event.response_bytes = len(req.content)
+        request = getattr(req, 'request', None)
+        if request is not None and request.body is not None:
+            event.request_bytes = len(request.body)
     finally:
-        # Automatically cleans up the file
-        temp_pem.close()
-        temp_key.close()
+        event.latency = time.perf_counter() - start
+        event.retries = max(len(attempts) - 1, 0)
+        instrumentation.request_finished(event)
 
     if verbose:
         print(req.text)
-    return req.json()
+    return _decode_response(req.status_code, req.content)
+
+
+def _decode_response(status, content):
+    """
+    Parse a response body straight from its bytes (or text)
+    """
+    try:
+        if not content:
+            body = None
+        elif orjson is not None:
+            body = orjson.loads(content)
+        else:
+            body = json.loads(content)
+    except ValueError:  # orjson.JSONDecodeError is a ValueError as well
+        body = None
+    if status >= 400:
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', 'replace')
+        raise SearchAdsError("HTTP %d: %s" % (status, content), status=status,
+                             response=body)
+    return body
 
 
 def api_get(endpoint, api_version='v1', limit=1000, offset=0, org_id=None,
@@ -106,19 +657,86 @@ def api_put(endpoint, data, api_version='v1', org_id=None, verbose=False):
     return api_call(
         endpoint,
         json_data=data,
-        method=requests.put,
+        method='PUT',
         api_version=api_version,
         org_id=org_id,
         verbose=verbose
     )
 
 
-def api_post(endpoint, data, api_version='v1', org_id=None, verbose=False):
+def api_post(endpoint, data, api_version='v1', org_id=None, verbose=False,
+             idempotent=False):
+    """
+    :param idempotent: True for the POSTs only reading data (reports,
+                       searches), which are retried like GETs
+    """
     return api_call(
         endpoint,
         json_data=data,
-        method=requests.post,
+        method='POST',
         api_version=api_version,
         org_id=org_id,
-        verbose=verbose
+        verbose=verbose,
+        idempotent=idempotent
+    )
+
+
+def paginate(fetch, page_size=1000, offset=0, prefetch=False,
+             items=lambda page: page['data']):
+    """
+    Lazily yield the pages of a paginated endpoint, until
+    pagination.totalResults results (or a short page) have been read
+    :param fetch: a function (offset, limit) -> decoded response
+    :param page_size: number of results requested per page
+    :param offset: offset of the first result
+    :param prefetch: download the next page while the current one is consumed
+    :param items: a function returning the results contained in a page
+    :return: a generator of decoded responses
+    """
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        page = fetch(offset, page_size)
+        while True:
+            count = len(items(page) or [])
+            total = (page.get('pagination') or {}).get('totalResults')
+            offset += count
+            if count == 0 or (total is not None and offset >= total) or \
+                    (total is None and count < page_size):
+                yield page
+                return
+            if executor:
+                next_page = executor.submit(fetch, offset, page_size)
+                yield page
+                page = next_page.result()
+            else:
+                yield page
+                page = fetch(offset, page_size)
+    finally:
+        if executor:
+            executor.shutdown(wait=False)
+
+
+def iter_get(endpoint, api_version='v1', page_size=1000, org_id=None,
+             verbose=False, prefetch=False, decode=None):
+    """
+    Lazily yield every result of a list endpoint, page by page
+    :param endpoint: the endpoint, e.g. 'campaigns'
+    :param api_version: the API version
+    :param page_size: number of results requested per call
+    :param org_id: the organization id
+    :param verbose: Verbosity
+    :param prefetch: download the next page while the current one is consumed
+    :param decode: a function building objects from the results of a page,
+                   e.g. Campaign.decode
+    :return: a generator of decoded results
+    """
+    pages = paginate(
+        lambda offset, limit: api_get(endpoint, api_version=api_version,
+                                      limit=limit, offset=offset,
+                                      org_id=org_id, verbose=verbose),
+        page_size=page_size,
+        prefetch=prefetch
     )
+    for page in pages:
+        for item in page['data'] if decode is None else decode(page['data']):
+            yield item
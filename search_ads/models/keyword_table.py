@@ -0,0 +1,252 @@
+import numpy as np
+import pandas as pd
+
+from search_ads.models.store_models import AdGroup, Campaign
+
+
+class KeywordTable(object):
+    """
+    Columnar view of the keywords of Campaigns and Ad Groups, to edit bids
+    and statuses of many keywords at once:
+
+    >>> table = KeywordTable(campaign)
+    >>> table.multiply_bids(1.1, where=table.df['matchType'] == 'EXACT')
+    >>> table.pause(lambda df: df['text'].str.contains('free'))
+    >>> table.save()
+
+    table.df has one row per keyword with the columns campaignId, adGroupId,
+    id, text, matchType, status, bidAmount (a float, NaN when the keyword
+    uses the Ad Group default bid) and currency. Edit bidAmount and status
+    only: the other columns are written back nowhere.
+    """
+
+    def __init__(self, *entities):
+        """
+        :param entities: Campaign or AdGroup objects (or lists of them)
+        """
+        self._ad_groups = []
+        for entity in entities:
+            for item in entity if isinstance(entity, (list, tuple)) \
+                    else [entity]:
+                if isinstance(item, Campaign):
+                    self._ad_groups.extend(item.ad_groups)
+                elif isinstance(item, AdGroup):
+                    self._ad_groups.append(item)
+                else:
+                    raise TypeError("Expected a Campaign or an AdGroup, "
+                                    "got %r" % (item,))
+
+        self.keywords = []
+        owners = []
+        for position, ad_group in enumerate(self._ad_groups):
+            self.keywords.extend(ad_group.keywords)
+            owners.extend([position] * len(ad_group.keywords))
+        self._owners = np.array(owners, dtype=np.int64)
+
+        # Bids are shared frozen values, so parse each distinct one once
+        bids = [keyword._bid_amount for keyword in self.keywords]
+        parsed = {}
+        for bid in set(bids):
+            bid_dict = dict(bid) if bid is not None else {}
+            parsed[bid] = (float(bid_dict['amount'])
+                           if bid_dict.get('amount') is not None else np.nan,
+                           bid_dict.get('currency'))
+        amounts, currencies = zip(*[parsed[bid] for bid in bids]) \
+            if bids else ((), ())
+        # Keywords without a bid get the currency of their Ad Group bid
+        default_currencies = [(ad_group.default_cpc_bid or {}).get('currency')
+                              for ad_group in self._ad_groups]
+        currencies = [currency if currency is not None
+                      else default_currencies[owner]
+                      for currency, owner in zip(currencies, owners)]
+
+        campaign_ids = [ad_group._campaign_id for ad_group in self._ad_groups]
+        ad_group_ids = [ad_group._id for ad_group in self._ad_groups]
+        self.df = pd.DataFrame({
+            'campaignId': np.array(campaign_ids, dtype=object)[self._owners]
+            if campaign_ids else [],
+            'adGroupId': np.array(ad_group_ids, dtype=object)[self._owners]
+            if ad_group_ids else [],
+            'id': [keyword._id for keyword in self.keywords],
+            'text': [keyword.text for keyword in self.keywords],
+            'matchType': [keyword.match_type for keyword in self.keywords],
+            'status': [keyword.status for keyword in self.keywords],
+            'bidAmount': np.array(amounts, dtype=float),
+            'currency': currencies,
+        })
+        self._mark_saved()
+
+    def _mark_saved(self, positions=None):
+        """
+        :param positions: the rows known by Apple, default all of them
+        """
+        if positions is None:
+            self._saved_bids = self.df['bidAmount'].to_numpy(copy=True)
+            self._saved_statuses = self.df['status'].to_numpy(copy=True)
+            return
+        self._saved_bids[positions] = \
+            self.df['bidAmount'].to_numpy()[positions]
+        self._saved_statuses[positions] = \
+            self.df['status'].to_numpy()[positions]
+
+    def __len__(self):
+        return len(self.df)
+
+    def _mask(self, where):
+        if where is None:
+            return np.ones(len(self.df), dtype=bool)
+        if callable(where):
+            where = where(self.df)
+        return np.asarray(where, dtype=bool)
+
+    def set_bids(self, amount, where=None):
+        """
+        Set the bid of the keywords
+        :param amount: the new bid, a number or an array aligned on the rows
+        :param where: a boolean mask, or a function of df returning one,
+                      default all the keywords
+        """
+        mask = self._mask(where)
+        if not np.isscalar(amount):
+            amount = np.asarray(amount, dtype=float)[mask]
+        self.df.loc[mask, 'bidAmount'] = amount
+
+    def multiply_bids(self, factor, where=None, min_bid=None, max_bid=None):
+        """
+        Multiply the bid of the keywords, rounded to the cent
+        :param factor: the multiplier, e.g. 1.1 for +10%
+        :param where: a boolean mask, or a function of df returning one,
+                      default all the keywords
+        :param min_bid: lower bound of the new bids
+        :param max_bid: upper bound of the new bids
+        """
+        mask = self._mask(where)
+        bids = (self.df['bidAmount'].to_numpy()[mask] * factor).round(2)
+        if min_bid is not None or max_bid is not None:
+            bids = np.clip(bids, min_bid, max_bid)
+        self.df.loc[mask, 'bidAmount'] = bids
+
+    def pause(self, where=None):
+        """
+        Pause the keywords
+        :param where: a boolean mask, or a function of df returning one,
+                      default all the keywords
+        """
+        self.df.loc[self._mask(where), 'status'] = 'PAUSED'
+
+    def activate(self, where=None):
+        """
+        Activate the keywords (unpause)
+        :param where: a boolean mask, or a function of df returning one,
+                      default all the keywords
+        """
+        self.df.loc[self._mask(where), 'status'] = 'ENABLED'
+
+    def changed(self):
+        """
+        :return: a boolean mask of the keywords edited since the table was
+                 built (or saved), new keywords included
+        """
+        bids = self.df['bidAmount'].to_numpy()
+        saved_bids = self._saved_bids
+        bid_changed = (bids != saved_bids) & \
+            ~(np.isnan(bids) & np.isnan(saved_bids))
+        return bid_changed | \
+            (self.df['status'].to_numpy() != self._saved_statuses) | \
+            (self.df['id'].to_numpy() == 'None')
+
+    def to_bulk_export(self, only_changed=True):
+        """
+        Compile the keywords to a keywords/targeting/ payload, as
+        Keyword.prepare_for_bulk_export does: a renamed keyword gives an
+        UPDATE pausing its old text and a CREATE of the new one
+        :param only_changed: export only the edited and new keywords
+        :return: a list of dicts
+        """
+        positions = np.flatnonzero(self.changed()) if only_changed \
+            else np.arange(len(self.df))
+        df = self.df.iloc[positions]
+        amounts = [None if amount != amount else _format_amount(amount)
+                   for amount in df['bidAmount'].tolist()]
+        payload = []
+        for position, campaign_id, ad_group_id, keyword_id, text, \
+                match_type, status, amount, currency in zip(
+                positions.tolist(), df['campaignId'].tolist(),
+                df['adGroupId'].tolist(), df['id'].tolist(),
+                df['text'].tolist(), df['matchType'].tolist(),
+                df['status'].tolist(), amounts, df['currency'].tolist()):
+            row = {
+                'importAction': 'CREATE' if keyword_id == 'None'
+                else 'UPDATE',
+                'campaignId': campaign_id,
+                'adGroupId': ad_group_id,
+                'bidAmount': {'amount': amount, 'currency': currency}
+                if amount is not None else None,
+                'id': keyword_id,
+                'matchType': match_type,
+                'status': status,
+                'text': text,
+            }
+            keyword = self.keywords[position]
+            saved_text = keyword._dirty()[1] if keyword_id != 'None' \
+                else None
+            if saved_text is None:
+                payload.append(row)
+            else:
+                # Renamed: pause the old keyword and create the new text
+                payload.append(dict(row, status='PAUSED', text=saved_text))
+                payload.append(dict(row, importAction='CREATE',
+                                    text=keyword.text))
+        return payload
+
+    def apply(self):
+        """
+        Write the edited bids and statuses back to the Keyword objects,
+        which are then saved along with their Ad Group
+        :return: the positions of the edited keywords
+        """
+        positions = self._write_back()
+        self._mark_saved()
+        return positions
+
+    def _write_back(self):
+        positions = np.flatnonzero(self.changed())
+        df = self.df.iloc[positions]
+        for position, status, amount, currency in zip(
+                positions.tolist(), df['status'].tolist(),
+                df['bidAmount'].tolist(), df['currency'].tolist()):
+            keyword = self.keywords[position]
+            keyword.status = status
+            if amount == amount:
+                keyword.bid_amount = {'amount': _format_amount(amount),
+                                      'currency': currency}
+        return positions
+
+    def save(self, chunk_size=1000, max_workers=4, verbose=False):
+        """
+        Write the edits back to the keywords and import the edited ones,
+        see AdGroup.import_keywords. If an import fails, the rows that were
+        not imported stay changed.
+        :param chunk_size: max number of keyword operations per request
+        :param max_workers: number of keyword requests sent in parallel
+        :param verbose: Verbosity
+        """
+        positions = self._write_back().tolist()
+        by_ad_group = {}
+        for position in positions:
+            by_ad_group.setdefault(self._owners[position], []).append(
+                self.keywords[position])
+        try:
+            for owner, keywords in by_ad_group.items():
+                self._ad_groups[owner].import_keywords(
+                    keywords, chunk_size=chunk_size, max_workers=max_workers,
+                    verbose=verbose)
+        finally:
+            # Imported keywords are marked as saved by import_keywords
+            self._mark_saved([position for position in positions
+                              if not self.keywords[position].has_changes()])
+            self.df['id'] = [keyword._id for keyword in self.keywords]
+
+
+def _format_amount(amount):
+    return '%.2f' % amount
@@ -0,0 +1,198 @@
+import threading
+import time
+from bisect import bisect_left
+
+
+class EntityIndex(object):
+    """
+    Hash indexes of entities by id and by case-folded name, plus a sorted
+    list of the names for prefix searches
+    """
+
+    def __init__(self, entities=(), name=lambda entity: entity.name):
+        """
+        :param entities: the entities to index
+        :param name: a function returning the name of an entity
+        """
+        self._name = name
+        self._by_id = {}
+        self._by_name = {}
+        self._sorted_names = None
+        for entity in entities:
+            self.add(entity)
+
+    def add(self, entity):
+        """
+        Index an entity, replacing the one with the same id
+        """
+        self.remove(entity._id)
+        self._by_id[entity._id] = entity
+        self._by_name.setdefault(_fold(self._name(entity)), []).append(entity)
+        self._sorted_names = None
+
+    def remove(self, entity_id):
+        """
+        Remove the entity with this id, if indexed
+        """
+        entity = self._by_id.pop(str(entity_id), None)
+        if entity is None:
+            return
+        key = _fold(self._name(entity))
+        entities = [other for other in self._by_name.get(key, [])
+                    if other is not entity]
+        if entities:
+            self._by_name[key] = entities
+        else:
+            self._by_name.pop(key, None)
+            self._sorted_names = None
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(list(self._by_id.values()))
+
+    def get(self, entity_id):
+        """
+        :return: the entity with this id, None if missing
+        """
+        return self._by_id.get(str(entity_id))
+
+    def find(self, name):
+        """
+        :return: the entities named name, ignoring the case
+        """
+        return list(self._by_name.get(_fold(name), []))
+
+    def search(self, query, prefix=False):
+        """
+        :param query: part of the name, the case is ignored
+        :param prefix: match the beginning of the names only
+        :return: the entities whose name contains (or starts with) query
+        """
+        query = _fold(query)
+        if not prefix:
+            return [entity for key, entities in self._by_name.items()
+                    if query in key for entity in entities]
+        if self._sorted_names is None:
+            self._sorted_names = sorted(self._by_name)
+        found = []
+        for key in self._sorted_names[
+                bisect_left(self._sorted_names, query):]:
+            if not key.startswith(query):
+                break
+            found.extend(self._by_name[key])
+        return found
+
+
+def _fold(name):
+    return (name or '').casefold()
+
+
+class EntityRegistry(object):
+    """
+    Cache of the campaigns, ad groups and keywords of an organization,
+    indexed by id and name. The lists are downloaded again when older than
+    ttl seconds; on a reload, the campaigns whose modificationTime did not
+    change are kept as they are, with their ad groups and keywords.
+    """
+
+    def __init__(self, load_campaigns, org_id=None, ttl=300):
+        """
+        :param load_campaigns: a function returning all the Campaign objects
+        :param org_id: the organization id, used to download the keywords
+        :param ttl: seconds the lists are kept, None for ever
+        """
+        self.load_campaigns = load_campaigns
+        self.org_id = org_id
+        self.ttl = ttl
+        self._campaigns = EntityIndex()
+        self._loaded_at = None
+        self._ad_groups = {}  # campaign id -> (loaded at, EntityIndex)
+        self._keywords = {}  # ad group id -> (loaded at, EntityIndex)
+        self._lock = threading.RLock()
+
+    def _expired(self, loaded_at):
+        return loaded_at is None or \
+            self.ttl is not None and time.time() - loaded_at > self.ttl
+
+    def invalidate(self):
+        """
+        Forget everything, the next lookups download the lists again
+        """
+        with self._lock:
+            self._campaigns = EntityIndex()
+            self._loaded_at = None
+            self._ad_groups.clear()
+            self._keywords.clear()
+
+    def refresh(self):
+        """
+        Download the campaigns again, keeping the unmodified ones
+        """
+        with self._lock:
+            campaigns = EntityIndex()
+            for campaign in self.load_campaigns():
+                known = self._campaigns.get(campaign._id)
+                if known is not None and campaign._modification_time and \
+                        known._modification_time == \
+                        campaign._modification_time:
+                    campaign = known
+                else:
+                    self._forget_ad_groups(campaign._id)
+                campaigns.add(campaign)
+            for campaign in self._campaigns:
+                if campaigns.get(campaign._id) is None:
+                    self._forget_ad_groups(campaign._id)
+            self._campaigns = campaigns
+            self._loaded_at = time.time()
+
+    def _forget_ad_groups(self, campaign_id):
+        _, ad_groups = self._ad_groups.pop(campaign_id, (None, ()))
+        for ad_group in ad_groups:
+            self._keywords.pop(ad_group._id, None)
+
+    def campaigns(self):
+        """
+        :return: the EntityIndex of the campaigns
+        """
+        with self._lock:
+            if self._expired(self._loaded_at):
+                self.refresh()
+            return self._campaigns
+
+    def ad_groups(self, campaign):
+        """
+        :param campaign: a Campaign object
+        :return: the EntityIndex of its Ad Groups, downloaded if the
+                 campaign has none
+        """
+        with self._lock:
+            loaded_at, index = self._ad_groups.get(campaign._id, (None, None))
+            if self._expired(loaded_at):
+                ad_groups = campaign.ad_groups
+                # Known Ad Groups are downloaded again unless edited
+                if not ad_groups or loaded_at is not None and not any(
+                        ad_group.has_changes() for ad_group in ad_groups):
+                    ad_groups = campaign.fetch_ad_groups()
+                index = EntityIndex(ad_groups)
+                self._ad_groups[campaign._id] = (time.time(), index)
+            return index
+
+    def keywords(self, ad_group):
+        """
+        :param ad_group: an AdGroup object
+        :return: the EntityIndex of its keywords (named by their text),
+                 downloaded if the Ad Group has none
+        """
+        with self._lock:
+            loaded_at, index = self._keywords.get(ad_group._id, (None, None))
+            if self._expired(loaded_at):
+                keywords = ad_group.keywords
+                if not keywords or loaded_at is not None and not any(
+                        keyword.has_changes() for keyword in keywords):
+                    keywords = ad_group.fetch_keywords(org_id=self.org_id)
+                index = EntityIndex(keywords,
+                                    name=lambda keyword: keyword.text)
+                self._keywords[ad_group._id] = (time.time(), index)
+            return index
@@ -1,9 +1,13 @@
 from datetime import datetime
+from itertools import chain, islice
+from operator import itemgetter, methodcaller
+from time import perf_counter
 
 import copy
-import pandas as pd
 
-from search_ads.api.utils import api_post
+from search_ads.api.cache import get_report_cache
+from search_ads.api.instrumentation import get_instrumentation
+from search_ads.api.utils import api_post, paginate, SearchAdsError
 
 
 def _today():
@@ -121,7 +125,230 @@ def _report(campaign=None,
             selector=None,
             group_by=[],
             return_records_with_no_metrics=True,
-            return_row_totals=False):
+            return_row_totals=False,
+            prefetch=False):
+    rows = _iter_report_rows(
+        campaign=campaign,
+        path=path,
+        org_id=org_id,
+        start_time=start_time,
+        end_time=end_time,
+        timezone=timezone,
+        granularity=granularity,
+        selector=selector,
+        group_by=group_by,
+        return_records_with_no_metrics=return_records_with_no_metrics,
+        return_row_totals=return_row_totals,
+        prefetch=prefetch
+    )
+    return _report_to_dataframe(rows, campaign, return_row_totals,
+                                report=path or 'campaigns')
+
+
+def iter_report(campaign=None,
+                path='',
+                org_id=None,
+                start_time=_today(),
+                end_time=_today(),
+                timezone='UTC',
+                granularity='HOURLY',
+                selector=None,
+                group_by=[],
+                return_records_with_no_metrics=True,
+                return_row_totals=False,
+                prefetch=False,
+                batch_size=None):
+    """
+    Lazily yield the flattened rows of a report, one dict per (row,
+    granularity) cell, downloading one page at a time
+    :param campaign: a Campaign object, None for the campaigns report
+    :param path: 'keywords', 'searchterms', 'adgroups' or '' for campaigns
+    :param org_id: the organization id
+    :param start_time: a string (yyyy-mm-dd), start time
+    :param end_time:  a string (yyyy-mm-dd), end time
+    :param timezone: UTC or ORTZ
+    :param granularity: 'HOURLY', 'DAILY', 'WEEKLY', 'MONTHLY'
+    :param selector: an object with keys {conditions, fields, orderBy, pagination}
+    :param group_by: field to group by
+    :param return_records_with_no_metrics: whether to return zero rows or not
+    :param return_row_totals: whether to return row totals or not
+    :param prefetch: download the next page while the current one is consumed
+    :param batch_size: if set, yield lists of up to batch_size rows instead
+    :return: a generator of dicts (or of lists of dicts)
+    """
+    rows = _iter_report_rows(
+        campaign=campaign,
+        path=path,
+        org_id=org_id,
+        start_time=start_time,
+        end_time=end_time,
+        timezone=timezone,
+        granularity=granularity,
+        selector=selector,
+        group_by=group_by,
+        return_records_with_no_metrics=return_records_with_no_metrics,
+        return_row_totals=return_row_totals,
+        prefetch=prefetch
+    )
+    flat_rows = _flatten_rows(rows, campaign, return_row_totals)
+    if batch_size:
+        return _batched(flat_rows, batch_size)
+    return flat_rows
+
+
+def _iter_report_rows(campaign=None,
+                      path='',
+                      org_id=None,
+                      start_time=_today(),
+                      end_time=_today(),
+                      timezone='UTC',
+                      granularity='HOURLY',
+                      selector=None,
+                      group_by=[],
+                      return_records_with_no_metrics=True,
+                      return_row_totals=False,
+                      prefetch=False):
+    url, data = _report_request(
+        campaign=campaign,
+        path=path,
+        start_time=start_time,
+        end_time=end_time,
+        timezone=timezone,
+        granularity=granularity,
+        selector=selector,
+        group_by=group_by,
+        return_records_with_no_metrics=return_records_with_no_metrics,
+        return_row_totals=return_row_totals
+    )
+    return (row
+            for page in iter_report_pages(url, data, org_id=org_id,
+                                          prefetch=prefetch)
+            for row in _report_rows(page))
+
+
+def _batched(iterable, batch_size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_report_pages(url, data, org_id=None, prefetch=False):
+    """
+    Lazily yield all the pages of a report, following its pagination
+    :param url: the report endpoint
+    :param data: the report request, its selector pagination gives the
+                 page size and the first offset
+    :param org_id: the organization id
+    :param prefetch: download the next page while the current one is consumed
+    :return: a generator of decoded responses
+    """
+    pagination = data['selector'].get('pagination') or {}
+    return paginate(
+        lambda offset, limit: _cached_post(
+            url, org_id=org_id, data=_paginated(data, offset, limit)),
+        page_size=pagination.get('limit', 1000),
+        offset=pagination.get('offset', 0),
+        prefetch=prefetch,
+        items=_report_rows
+    )
+
+
+def _cached_post(url, org_id, data):
+    cache = get_report_cache()
+    api_res = cache.get(org_id, url, data) if cache else None
+    if api_res is None:
+        api_res = api_post(url, org_id=org_id, data=data, idempotent=True)
+        if cache:
+            cache.set(org_id, url, data, api_res)
+    return api_res
+
+
+def _paginated(data, offset, limit):
+    selector = dict(data['selector'],
+                    pagination={'offset': offset, 'limit': limit})
+    return dict(data, selector=selector)
+
+
+def _report_rows(api_res):
+    try:
+        return api_res['data']['reportingDataResponse']['row']
+    except (KeyError, TypeError):
+        raise SearchAdsError("Unexpected report response: %s" % api_res,
+                             response=api_res)
+
+
+async def _async_report(campaign=None,
+                        path='',
+                        org_id=None,
+                        start_time=_today(),
+                        end_time=_today(),
+                        timezone='UTC',
+                        granularity='HOURLY',
+                        selector=None,
+                        group_by=[],
+                        return_records_with_no_metrics=True,
+                        return_row_totals=False,
+                        transport=None):
+    import asyncio
+    from search_ads.api.async_utils import api_post as async_api_post, \
+        paginate as async_paginate
+
+    url, data = _report_request(
+        campaign=campaign,
+        path=path,
+        start_time=start_time,
+        end_time=end_time,
+        timezone=timezone,
+        granularity=granularity,
+        selector=selector,
+        group_by=group_by,
+        return_records_with_no_metrics=return_records_with_no_metrics,
+        return_row_totals=return_row_totals
+    )
+    pagination = data['selector'].get('pagination') or {}
+
+    async def fetch(offset, limit):
+        page_data = _paginated(data, offset, limit)
+        cache = get_report_cache()
+        # Disk caches read and write files: keep them off the event loop
+        loop = asyncio.get_running_loop()
+        api_res = await loop.run_in_executor(
+            None, cache.get, org_id, url, page_data) if cache else None
+        if api_res is None:
+            api_res = await async_api_post(url, org_id=org_id, data=page_data,
+                                           transport=transport,
+                                           idempotent=True)
+            if cache:
+                await loop.run_in_executor(None, cache.set, org_id, url,
+                                           page_data, api_res)
+        return api_res
+
+    pages = async_paginate(
+        fetch,
+        page_size=pagination.get('limit', 1000),
+        offset=pagination.get('offset', 0),
+        items=_report_rows
+    )
+    rows = []
+    async for page in pages:
+        rows.extend(_report_rows(page))
+    return _report_to_dataframe(rows, campaign, return_row_totals,
+                                report=path or 'campaigns')
+
+
+def _report_request(campaign=None,
+                    path='',
+                    start_time=_today(),
+                    end_time=_today(),
+                    timezone='UTC',
+                    granularity='HOURLY',
+                    selector=None,
+                    group_by=[],
+                    return_records_with_no_metrics=True,
+                    return_row_totals=False):
     if not selector:
         selector = {
             "orderBy": [
@@ -145,29 +372,174 @@ def _report(campaign=None,
         url = "reports/campaigns/%s/%s" % (campaign._id, path)
     else:
         url = "reports/campaigns"
-    output = []
-    api_res = api_post(url, org_id=org_id, data=data)
-    try:
-        res = api_res['data']['reportingDataResponse']['row']
-    except:
-        raise Exception(api_res)  # ['data']['error']['errors'])
-    for row in res:
-        base = {}
-        base.update(row['metadata'])
-        if return_row_totals:
-            base.update(row['total'])
-        if campaign:
-            base['adamId'] = campaign._adam_id
-            base['campaignId'] = campaign._id
-        else:
-            base['adamId'] = base['app']['adamId']
-            base['appName'] = base['app']['appName']
-            del base['app']
+    return url, data
+
+
+def _report_to_dataframe(rows, campaign=None, return_row_totals=False,
+                         report='campaigns'):
+    instrumentation = get_instrumentation()
+    columns = _ReportColumns()
+    if instrumentation.exporters:
+        # rows downloads the pages as it goes: only time the flattening
+        flattening = 0.0
+        for row in rows:
+            start = perf_counter()
+            columns.add(_row_base(row, campaign, return_row_totals),
+                        row['granularity'])
+            flattening += perf_counter() - start
+        instrumentation.observe_step('report_flatten', flattening,
+                                     report=report)
+    else:
+        for row in rows:
+            columns.add(_row_base(row, campaign, return_row_totals),
+                        row['granularity'])
+    with instrumentation.timer('report_dataframe', report=report):
+        return columns.to_dataframe()
+
+
+def _row_base(row, campaign=None, return_row_totals=False):
+    base = {}
+    base.update(row['metadata'])
+    if return_row_totals:
+        base.update(row['total'])
+    if campaign:
+        base['adamId'] = campaign._adam_id
+        base['campaignId'] = campaign._id
+    else:
+        base['adamId'] = base['app']['adamId']
+        base['appName'] = base['app']['appName']
+        del base['app']
+    return base
+
+
+def _flatten_rows(rows, campaign=None, return_row_totals=False):
+    """
+    Yield one flat dict per (row, granularity) cell of a report, with ids
+    as strings and amounts as floats
+    """
+    for row in rows:
+        base = _row_base(row, campaign, return_row_totals)
+        for field_name, value in base.items():
+            base[field_name] = _convert_value(field_name, value)
         for granularity in row['granularity']:
-            final_row = copy.copy(base)
-            final_row.update(granularity)
-            output.append(convert_to_float_all_amounts_in_row(convert_to_str_all_ids_in_row(final_row)))
-    return pd.DataFrame(output)
+            final_row = dict(base)
+            for field_name, value in granularity.items():
+                final_row[field_name] = _convert_value(field_name, value)
+            yield final_row
+
+
+class _ReportColumns(object):
+    """
+    Accumulates the (row, granularity) cells of a report, and builds their
+    DataFrame a column at a time, converting ids and amounts in bulk. The
+    fields shared by the cells of a row are kept once per row and repeated
+    by pandas.
+    """
+
+    def __init__(self):
+        self.bases = []  # the fields shared by the cells, per report row
+        self.counts = []  # number of cells of each report row
+        self.cells = []
+        self.names = {}  # the cell fields, as an ordered set
+        self.regular = True  # whether all the cells have the same fields
+
+    def add(self, base, cells):
+        """
+        Add the cells of a report row
+        :param base: the fields shared by all the cells
+        :param cells: the granularity dicts
+        """
+        if cells:
+            names = cells[0].keys()
+            if len(set(map(len, cells))) > 1:
+                self.regular = False
+                names = set().union(*cells)
+                # cells lacking a field that others override keep the base
+                shared = dict((name, value) for name, value in base.items()
+                              if name in names)
+                if shared:
+                    cells = [dict(shared, **cell) for cell in cells]
+            if names != self.names.keys():
+                if self.names:
+                    self.regular = False
+                self.names.update(dict.fromkeys(names))
+        self.bases.append(base)
+        self.counts.append(len(cells))
+        self.cells.extend(cells)
+
+    def _cell_column(self, name):
+        if self.regular:
+            try:
+                return list(map(itemgetter(name), self.cells))
+            except KeyError:  # some cells of a row lack fields of others
+                self.regular = False
+                self.names = dict.fromkeys(chain.from_iterable(self.cells))
+        return list(map(methodcaller('get', name), self.cells))
+
+    def to_dataframe(self):
+        import numpy as np
+        import pandas as pd
+
+        repeats = np.repeat(np.arange(len(self.bases)), self.counts)
+        data = {}
+        for name in dict.fromkeys(chain.from_iterable(self.bases)):
+            if name in self.names and self.regular:
+                data[name] = None  # overridden by every cell
+                continue
+            column = _convert_column(name, list(map(
+                methodcaller('get', name), self.bases)))
+            data[name] = pd.Series(column).take(repeats).array
+        if not self.regular:
+            self.names = dict.fromkeys(chain.from_iterable(self.cells))
+        done = set()
+        pending = list(self.names)
+        while pending:  # _cell_column may find more fields
+            for name in pending:
+                column = _convert_column(name, self._cell_column(name))
+                base = data.get(name)
+                if base is not None:  # cells lacking it keep the base value
+                    column = [value if value is not None else base[i]
+                              for i, value in enumerate(column)]
+                data[name] = column
+                done.add(name)
+            pending = [name for name in self.names if name not in done]
+        return pd.DataFrame(data, index=pd.RangeIndex(len(self.cells)))
+
+
+def _convert_column(name, column):
+    if name[-2:] == "Id":
+        # ids become strings: convert each distinct id once
+        import pandas as pd
+
+        codes, ids = pd.factorize(pd.Series(column, dtype=object))
+        ids = pd.array([str(value) for value in ids], dtype='str')
+        return ids.take(codes, allow_fill=True)
+    sample = next((value for value in column if value is not None), None)
+    if type(sample) in (int, float, bool):
+        import numpy as np
+
+        array = np.array(column)
+        # only counters and rates, without missing values
+        return array if array.dtype.kind in 'biuf' else column
+    if not isinstance(sample, dict):
+        return column
+    if 'currency' in sample:
+        import numpy as np
+
+        try:
+            return np.fromiter(map(float, map(itemgetter('amount'), column)),
+                               dtype=np.float64, count=len(column))
+        except (KeyError, TypeError, ValueError):
+            pass  # not only amounts in here, convert one value at a time
+    return [_convert_value(name, value) for value in column]
+
+
+def _convert_value(field_name, value):
+    if field_name[-2:] == "Id":
+        return str(value)
+    if isinstance(value, dict) and 'currency' in value:
+        return amount_to_float(value)
+    return value
 
 
 def amount_to_float(amount):
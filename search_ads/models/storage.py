@@ -0,0 +1,309 @@
+import json
+import operator
+import os
+
+from collections.abc import MutableMapping
+
+from search_ads.models.store_models import Campaign
+
+# pandas and pyarrow are imported when a ParquetStore is created
+pa = ds = pq = fs = None
+
+# Filter operators, they work both on pyarrow fields and pandas Series
+OPERATORS = {
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda column, values: column.isin(list(values)),
+    'not in': lambda column, values: ~column.isin(list(values)),
+}
+
+
+def _import_pyarrow():
+    global pa, ds, pq, fs
+    if pq is None:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.fs
+        import pyarrow.parquet
+        pa, ds, pq = pyarrow, pyarrow.dataset, pyarrow.parquet
+        fs = pyarrow.fs.LocalFileSystem(use_mmap=True)
+
+
+class LazyDict(MutableMapping):
+    """
+    A dict whose values are only computed the first time they are read
+    """
+
+    def __init__(self, loaders=None):
+        """
+        :param loaders: {key: function returning the value}
+        """
+        self._loaders = dict(loaders or {})
+        self._values = {}
+
+    def __getitem__(self, key):
+        if key not in self._values:
+            if key not in self._loaders:
+                raise KeyError(key)
+            self._values[key] = self._loaders.pop(key)()
+        return self._values[key]
+
+    def __setitem__(self, key, value):
+        self._loaders.pop(key, None)
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        if key in self._values:
+            del self._values[key]
+        else:
+            del self._loaders[key]
+
+    def __iter__(self):
+        for key in list(self._values) + list(self._loaders):
+            yield key
+
+    def __len__(self):
+        return len(self._values) + len(self._loaders)
+
+    def __contains__(self, key):
+        return key in self._values or key in self._loaders
+
+    def __repr__(self):
+        return "LazyDict(%s)" % list(self)
+
+
+def _campaign_id_set(campaign_ids):
+    return set(str(campaign_id) if campaign_id is not None else None
+               for campaign_id in campaign_ids)
+
+
+class ParquetStore(object):
+    """
+    Stores a DataBase as Parquet files, one per campaign, report and day:
+
+        <path>/manifest.json
+        <path>/reports/campaign=<id>/report=<name>/date=<yyyy-mm-dd>.parquet
+
+    The manifest lists every partition, so a load only reads it and the
+    partitions are memory mapped when (and if) they are accessed.
+    """
+
+    MANIFEST = 'manifest.json'
+    ORG_WIDE = '_org'  # campaign directory of the campaigns report
+
+    def __init__(self, path):
+        """
+        :param path: the store directory, created if missing
+        """
+        try:
+            _import_pyarrow()
+        except ImportError:
+            raise ImportError(
+                "ParquetStore requires pyarrow: "
+                "pip install apple_search_ads[parquet]")
+        self.path = path
+        self._manifest = None
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            manifest_file = os.path.join(self.path, self.MANIFEST)
+            if os.path.exists(manifest_file):
+                with open(manifest_file) as f:
+                    self._manifest = json.load(f)
+            else:
+                self._manifest = {'campaigns': [], 'watermarks': [],
+                                  'partitions': []}
+        return self._manifest
+
+    def write(self, database, changed=None):
+        """
+        Write a DataBase, replacing what was stored before
+        :param database: a DataBase object
+        :param changed: the (campaign id, report name) pairs to write, None
+                        standing for the campaigns report; the partitions of
+                        the other reports are kept as they are. Default all
+        """
+        partitions = []
+        campaigns = {}
+        kept = set()
+        # Reports are only read when written: those loaded lazily and not
+        # changed are not read at all
+        for key in database.reports:
+            if isinstance(key, Campaign):
+                campaign_id, reports = key._id, database.reports[key]
+                campaigns[campaign_id] = key.to_json()
+                names = list(reports)
+            else:
+                campaign_id, reports, names = None, database.reports, [key]
+            for report in names:
+                if changed is None or (campaign_id, report) in changed:
+                    partitions.extend(self._write_report(
+                        campaign_id, report, reports[report]))
+                else:
+                    kept.add((campaign_id, report))
+        if kept:
+            partitions.extend(
+                partition for partition in self.manifest['partitions']
+                if (partition['campaign'], partition['report']) in kept)
+
+        written = set(partition['file'] for partition in partitions)
+        for partition in self.manifest['partitions']:
+            if partition['file'] not in written:
+                try:
+                    os.remove(os.path.join(self.path, partition['file']))
+                except OSError:
+                    pass
+
+        self._manifest = {
+            'campaigns': database.campaigns,
+            'report_campaigns': campaigns,
+            'watermarks': [list(key) + [value] for key, value in
+                           database.watermarks.items()],
+            'partitions': partitions,
+        }
+        manifest_file = os.path.join(self.path, self.MANIFEST)
+        with open(manifest_file + '.tmp', 'w') as f:
+            json.dump(self._manifest, f)
+        os.replace(manifest_file + '.tmp', manifest_file)
+
+    def _write_report(self, campaign_id, report, df):
+        if df is None or len(df) == 0:
+            return []
+        directory = os.path.join(
+            'reports',
+            'campaign=%s' % (campaign_id if campaign_id is not None
+                             else self.ORG_WIDE),
+            'report=%s' % report)
+        if not os.path.isdir(os.path.join(self.path, directory)):
+            os.makedirs(os.path.join(self.path, directory))
+        if 'date' in df:
+            groups = df.groupby(df['date'].astype(str).str[:10], sort=True)
+        else:
+            groups = [('all', df)]
+        partitions = []
+        for date, part in groups:
+            file_name = os.path.join(directory, 'date=%s.parquet' % date)
+            # Write aside and rename, the old file may still be memory mapped
+            full_name = os.path.join(self.path, file_name)
+            pq.write_table(pa.Table.from_pandas(part, preserve_index=False),
+                           full_name + '.tmp')
+            os.replace(full_name + '.tmp', full_name)
+            partitions.append({'campaign': campaign_id, 'report': report,
+                               'date': date, 'file': file_name,
+                               'rows': len(part)})
+        return partitions
+
+    def read(self, campaign_id, report, start_date=None, end_date=None,
+             columns=None):
+        """
+        Read a stored report, touching only the partitions in the date range
+        :param campaign_id: the campaign id, None for the campaigns report
+        :param report: the report name ('keywords', 'searchterms', ...)
+        :param start_date: first day to read (yyyy-mm-dd), inclusive
+        :param end_date: last day to read (yyyy-mm-dd), inclusive
+        :param columns: the columns to read, default all
+        :return: a DataFrame
+        """
+        return self.query(report, campaign_ids=[campaign_id],
+                          start_date=start_date, end_date=end_date,
+                          columns=columns)
+
+    def query(self, report, campaign_ids=None, start_date=None,
+              end_date=None, columns=None, filters=None,
+              exclude_campaign_ids=()):
+        """
+        Query a stored report. Campaigns and dates select the partitions
+        to open, columns and filters are pushed down to the Parquet reader
+        so that only the matching row groups and columns are decoded.
+
+        >>> store.query('keywords', start_date='2018-01-01',
+        ...             columns=['date', 'keyword', 'localSpend'],
+        ...             filters=[('matchType', '=', 'EXACT'),
+        ...                      ('localSpend', '>', 0)])
+
+        :param report: the report name ('keywords', 'searchterms', ...)
+        :param campaign_ids: the campaign ids, default all; None in the list
+                             stands for the campaigns report
+        :param start_date: first day to read (yyyy-mm-dd), inclusive
+        :param end_date: last day to read (yyyy-mm-dd), inclusive
+        :param columns: the columns to read, default all
+        :param filters: a list of (column, operator, value) conditions, all
+                        of which must hold; operators are =, ==, !=, <, <=,
+                        >, >=, in and not in
+        :param exclude_campaign_ids: campaign ids not to read, as for
+                                     campaign_ids
+        :return: a DataFrame
+        """
+        files = self._files(report, campaign_ids, start_date, end_date,
+                            exclude_campaign_ids)
+        if not files:
+            import pandas as pd
+            return pd.DataFrame(columns=columns)
+        schema = pa.unify_schemas([pq.read_schema(f, memory_map=True)
+                                   for f in files])
+        dataset = ds.dataset(files, schema=schema, format='parquet',
+                             filesystem=fs)
+        expression = None
+        for column, operator, value in filters or []:
+            condition = OPERATORS[operator](ds.field(column), value)
+            expression = condition if expression is None \
+                else expression & condition
+        return dataset.to_table(columns=columns,
+                                filter=expression).to_pandas()
+
+    def _files(self, report, campaign_ids=None, start_date=None,
+               end_date=None, exclude_campaign_ids=()):
+        if campaign_ids is not None:
+            campaign_ids = _campaign_id_set(campaign_ids)
+        exclude_campaign_ids = _campaign_id_set(exclude_campaign_ids)
+        files = []
+        for partition in self.manifest['partitions']:
+            if partition['report'] != report or \
+                    campaign_ids is not None and \
+                    partition['campaign'] not in campaign_ids or \
+                    partition['campaign'] in exclude_campaign_ids:
+                continue
+            date = partition['date']
+            if date != 'all' and (start_date and date < start_date or
+                                  end_date and date > end_date):
+                continue
+            files.append(os.path.join(self.path, partition['file']))
+        return files
+
+    def load(self, database_class):
+        """
+        Restore a DataBase whose reports are read on first access
+        :param database_class: the DataBase class
+        :return: a DataBase object
+        """
+        manifest = self.manifest
+        org_reports = set()
+        campaign_reports = {}
+        for partition in manifest['partitions']:
+            if partition['campaign'] is None:
+                org_reports.add(partition['report'])
+            else:
+                campaign_reports.setdefault(
+                    partition['campaign'], set()).add(partition['report'])
+
+        def loader(campaign_id, report):
+            return lambda: self.read(campaign_id, report)
+
+        reports = LazyDict(dict((name, loader(None, name))
+                                for name in org_reports))
+        for campaign_id, names in campaign_reports.items():
+            campaign = Campaign(**json.loads(
+                manifest['report_campaigns'][campaign_id]))
+            reports[campaign] = LazyDict(
+                dict((name, loader(campaign_id, name)) for name in names))
+        watermarks = dict((tuple(item[:3]), item[3])
+                          for item in manifest['watermarks'])
+        return database_class(campaigns=manifest['campaigns'],
+                              reports=reports, watermarks=watermarks,
+                              store=self)
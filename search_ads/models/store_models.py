@@ -1,7 +1,18 @@
+import copy
+import inspect
 import json
+import logging
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import repeat
 
-from search_ads.api.utils import api_put, api_post, set_env
-from search_ads.models.utils import Synchronizable, AppleSerializable, Serializable
+from search_ads.api.utils import api_put, api_post, iter_get, set_env, \
+    Scheduler, SearchAdsError
+from search_ads.models.utils import Synchronizable, AppleSerializable, \
+    Serializable, Trackable, Raw, hydrate, hydrated, intern, pack_id, \
+    pack_time, unpack_id, _freeze, _shared_max
+
+logger = logging.getLogger(__name__)
 
 
 class SyncManager(Serializable):
@@ -12,22 +23,207 @@ class SyncManager(Serializable):
     def __init__(self, certs):
         self.certs = certs
         self.pending_actions = []
+        self._queued = {}  # entity -> (position, action) in pending_actions
+
+    def queue(self, obj, json_data, args=(), kwargs=None, entity_id=None,
+              changes=None):
+        """
+        Queue the save of an entity. Saves of an entity that is already
+        queued are coalesced: the queued action is replaced by the latest
+        snapshot, so each changed entity is sent once.
+        :param obj: the entity class name ('Campaign' or 'AdGroup')
+        :param json_data: the entity serialized with to_json()
+        :param args: positional arguments for save()
+        :param kwargs: keyword arguments for save()
+        :param entity_id: the entity id, read from json_data if missing
+        :param changes: what the save has to send, see _dirty(); None to
+                        send every field, ad group and keyword
+        """
+        action = (obj, json_data, tuple(args), dict(kwargs or {}), changes)
+        key = _entity_key(obj, json_data) if entity_id is None \
+            else _entity_key(obj, entity_id=entity_id)
+        position, queued = self._queued.get(key, (None, None))
+        if key is not None and position is not None and \
+                position < len(self.pending_actions) and \
+                self.pending_actions[position] is queued:
+            self.pending_actions[position] = action
+        else:
+            position = len(self.pending_actions)
+            self.pending_actions.append(action)
+        if key is not None:
+            self._queued[key] = (position, action)
+
+    def to_json(self):
+        # _queued only indexes pending_actions, and its keys are tuples
+        state = dict((name, value) for name, value in self.__dict__.items()
+                     if name != '_queued')
+        return json.dumps(state, default=lambda x: x.__dict__,
+                          sort_keys=True, indent=4)
+
+    def synchronize(self, max_workers=1):
+        """
+        Replay the pending actions against the Apple APIs.
+
+        Actions on different campaigns run concurrently, while the actions
+        of a campaign keep their order where it matters: a campaign change
+        runs before the later changes of its ad groups and vice versa, and
+        the changes of an ad group run in order. Actions that fail, or that
+        depend on an action that failed, stay in pending_actions.
+        :param max_workers: number of actions run in parallel
+        :return: a list of (action, status, error) tuples in the order the
+                 actions were queued, status being 'done', 'failed' or
+                 'skipped' (a previous action of the same entity failed)
+        """
+        actions = list(self.pending_actions)
+        dependencies = _action_dependencies(actions)
+        dependents = [[] for _ in actions]
+        for i, action_dependencies in enumerate(dependencies):
+            for j in action_dependencies:
+                dependents[j].append(i)
+        waiting = [len(action_dependencies)
+                   for action_dependencies in dependencies]
+        results = [None] * len(actions)
+
+        def skip(i):
+            for j in dependents[i]:
+                if results[j] is None:
+                    results[j] = (actions[j], 'skipped', None)
+                    skip(j)
+
+        with set_env(**self.certs), \
+                ThreadPoolExecutor(max_workers=max_workers) as executor:
+            running = {}
+            for i in range(len(actions)):
+                if not waiting[i]:
+                    running[executor.submit(_replay, actions[i])] = i
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        results[i] = (actions[i], 'failed', error)
+                        skip(i)
+                        continue
+                    results[i] = (actions[i], 'done', None)
+                    for j in dependents[i]:
+                        waiting[j] -= 1
+                        if not waiting[j] and results[j] is None:
+                            running[executor.submit(_replay, actions[j])] = j
+
+        self.pending_actions[:] = [
+            action for action, status, _ in results if status != 'done'
+        ] + self.pending_actions[len(actions):]
+        self._queued = {}
+        for position, action in enumerate(self.pending_actions):
+            key = _entity_key(action[0], action[1])
+            if key is not None:
+                self._queued[key] = (position, action)
+        return results
+
+
+def _replay(action):
+    obj, json_data, args, kwargs = action[:4]
+    changes = action[4] if len(action) > 4 else None
+    kwargs = dict(kwargs, force_sync=True)
+    logger.info("Synchronizing a %s", obj)
+    if obj == 'Campaign':
+        obj = Campaign(**json.loads(json_data))
+    else:
+        obj = AdGroup(**json.loads(json_data))
+    if changes is None:  # queued without its changes: send it all
+        obj.mark_changed()
+    else:
+        obj._mark_dirty(changes)
+    obj.save(*args, **kwargs)
+
+
+def _transient(error, creates=False):
+    """
+    Whether a failed call may succeed if sent again: no response was
+    received, or the server was throttling or unavailable. Calls creating
+    entities may have been applied unless throttled, so only a 429 counts.
+    """
+    if not isinstance(error, SearchAdsError):
+        return False
+    if creates:
+        return error.status == 429
+    return error.status is None or error.status in Scheduler.RETRY_STATUSES
+
+
+def _created_id(response, default):
+    """
+    The id of an entity created by a POST, default if the response has none
+    """
+    created = (response or {}).get('data')
+    if isinstance(created, dict) and created.get('id') is not None:
+        return str(created['id'])
+    return default
+
+
+def _keyword_chunks(keywords, campaign_id, ad_group_id, chunk_size):
+    """
+    Split the bulk export of keywords in chunks of at most chunk_size
+    operations (more if a single keyword needs more), the operations of a
+    keyword staying in the same chunk
+    :return: a list of ([(keyword, number of operations)], operations)
+    """
+    chunks = []
+    chunk, operations = [], []
+    for keyword in keywords:
+        exported = keyword.prepare_for_bulk_export(campaign_id, ad_group_id)
+        if chunk and len(operations) + len(exported) > chunk_size:
+            chunks.append((chunk, operations))
+            chunk, operations = [], []
+        chunk.append((keyword, len(exported)))
+        operations.extend(exported)
+    if chunk:
+        chunks.append((chunk, operations))
+    return chunks
+
+
+def _entity_key(obj, json_data=None, entity_id=None):
+    """
+    The (class name, id) of an entity, None for new entities
+    """
+    if entity_id is None:
+        entity_id = json.loads(json_data).get('id')
+    if entity_id in (None, 'None', ''):
+        return None
+    return obj, str(entity_id)
+
+
+def _action_dependencies(actions):
+    """
+    For every action, the indexes of the previous actions it must wait for
+    """
+    dependencies = []
+    previous = {}  # campaign id -> indexes of its actions so far
+    for i, (obj, json_data) in enumerate(action[:2] for action in actions):
+        data = json.loads(json_data)
+        if obj == 'Campaign':
+            campaign_id, ad_group_id = str(data.get('id')), None
+        else:
+            campaign_id, ad_group_id = str(data.get('campaignId')), \
+                str(data.get('id'))
+        action_dependencies = []
+        for j, other_ad_group_id in previous.get(campaign_id, []):
+            if ad_group_id is None or other_ad_group_id is None or \
+                    ad_group_id == other_ad_group_id:
+                action_dependencies.append(j)
+        dependencies.append(action_dependencies)
+        previous.setdefault(campaign_id, []).append((i, ad_group_id))
+    return dependencies
+
+
+class AdGroup(Synchronizable, AppleSerializable, Trackable):
+    __slots__ = ('_start_time', '_storefronts', 'name', 'targeting_dimensions',
+                 'status', '_serving_status', '_serving_state_reasons',
+                 'automated_keywords_opt_in', '_campaign_id', 'cpa_goal',
+                 'default_cpc_bid', '_display_status', '_end_time', '_id',
+                 '_keywords', '_negative_keywords', '_modification_time',
+                 'sync_manager', '_snapshot')
 
-    def synchronize(self):
-        with set_env(**self.certs):
-            for i, (obj, json_data, args, kwargs) in enumerate(self.pending_actions):
-                kwargs['force_sync'] = True
-                # :TODO: actions could be executed in parallel
-                print(obj)
-                if obj == 'Campaign':
-                    obj = Campaign(**json.loads(json_data))
-                else:
-                    obj = AdGroup(**json.loads(json_data))
-                obj.save(*args, **kwargs)
-                del self.pending_actions[i]
-
-
-class AdGroup(Synchronizable, AppleSerializable):
     def __init__(self,
                  cpaGoal=None,
                  startTime=None,
@@ -76,23 +272,20 @@ class AdGroup(Synchronizable, AppleSerializable):
         self._serving_status = servingStatus
         self._serving_state_reasons = servingStateReasons
         self.automated_keywords_opt_in = automatedKeywordsOptIn
-        self._campaign_id = str(campaignId)
+        self._campaign_id = intern(str(campaignId))
         self.cpa_goal = cpaGoal
         self.default_cpc_bid = defaultCpcBid
         self._display_status = displayStatus
         self._end_time = endTime
         self._id = str(id)
-        self.keywords = []
-        self._negative_keywords = []
-        self._modification_time = modificationTime
+        # Keywords are built on first access
+        self._keywords = Raw(keywords)
+        self._negative_keywords = Raw(negativeKeywords)
+        self._modification_time = pack_time(modificationTime)
 
         self.sync_manager = None
 
-        for keyword in negativeKeywords:
-            self._negative_keywords.append(Keyword(**keyword))
-
-        for keyword in keywords:
-            self.keywords.append(Keyword(**keyword))
+        self.mark_saved()
 
     def __repr__(self):
         return "{name} (Ad Group id: {id})".format(name=self.name, id=self._id)
@@ -106,10 +299,73 @@ class AdGroup(Synchronizable, AppleSerializable):
             "targetingDimensions": self.targeting_dimensions,
             "status": self.status,
         }
-        if not self._id:
+        if self._is_new():
             as_json["startTime"] = self._start_time
         return as_json
 
+    def _tracked_fields(self):
+        return self.__editable_fields()
+
+    @property
+    def keywords(self):
+        return hydrate(self, '_keywords', Keyword.decode)
+
+    @keywords.setter
+    def keywords(self, keywords):
+        self._keywords = keywords
+
+    @property
+    def negative_keywords(self):
+        return hydrate(self, '_negative_keywords', Keyword.decode)
+
+    def fetch_keywords(self, org_id=None, page_size=1000):
+        """
+        Download the targeting keywords of the Ad Group, replacing keywords
+        :param org_id: the organization id
+        :param page_size: number of keywords requested per call
+        :return: the list of Keyword objects
+        """
+        self.keywords = list(iter_get(
+            "campaigns/%s/adgroups/%s/targetingkeywords" % (
+                self._campaign_id, self._id),
+            page_size=page_size, org_id=org_id, decode=Keyword.decode))
+        return self.keywords
+
+    def mark_changed(self):
+        """
+        Consider every field of the Ad Group and of its keywords as changed
+        """
+        Trackable.mark_changed(self)
+        for keyword in self.keywords:
+            keyword.mark_changed()
+
+    def _dirty(self):
+        return {'fields': None if self._is_new()
+                else sorted(self.changed_fields()),
+                'keywords': [keyword._dirty() for keyword in
+                             hydrated(self, '_keywords')
+                             if keyword.has_changes()]}
+
+    def _mark_dirty(self, changes):
+        """
+        Mark as changed what _dirty() recorded, once rebuilt from a queued
+        snapshot
+        """
+        Trackable.mark_changed(self, changes.get('fields'))
+        dirty = dict(changes.get('keywords') or ())
+        if dirty:  # new keywords are sent anyway
+            for keyword in self.keywords:
+                if keyword._id in dirty:
+                    keyword._replayed(dirty[keyword._id])
+
+    def has_changes(self):
+        """
+        :return: True if the Ad Group or one of its keywords changed
+        """
+        return Trackable.has_changes(self) or \
+            any(keyword.has_changes()
+                for keyword in hydrated(self, '_keywords'))
+
     def pause(self):
         """
         Pause the Ad Group
@@ -122,35 +378,109 @@ class AdGroup(Synchronizable, AppleSerializable):
         """
         self.status = "ENABLED"
 
+    def import_keywords(self, keywords=None, chunk_size=1000, max_workers=4,
+                        max_retries=2, verbose=False):
+        """
+        Bulk import keywords in chunks sent in parallel. The chunks that
+        fail for a transient reason (throttling, server or network error)
+        are sent again, up to max_retries times, the chunks creating
+        keywords only if they were throttled; other errors are raised at
+        once. The imported keywords are marked as saved and the new ones
+        get their id.
+        :param keywords: the keywords to import, default the changed ones
+        :param chunk_size: max number of keyword operations per request
+        :param max_workers: number of chunks sent in parallel
+        :param max_retries: number of times a failed chunk is sent again
+        :param verbose: Verbosity
+        :return: the number of requests sent
+        """
+        if keywords is None:
+            keywords = [keyword for keyword in hydrated(self, '_keywords')
+                        if keyword.has_changes()]
+        chunks = _keyword_chunks(keywords, self._campaign_id, self._id,
+                                 chunk_size)
+
+        def send(chunk):
+            chunk_keywords, operations = chunk
+            # Updates can be sent twice, creations would be duplicated
+            res = api_post("keywords/targeting/", data=operations,
+                           verbose=verbose, idempotent=all(
+                               operation['importAction'] == 'UPDATE'
+                               for operation in operations))
+            results = (res or {}).get('data')
+            if not isinstance(results, list) or \
+                    len(results) != len(operations):
+                results = None
+            position = 0
+            for keyword, count in chunk_keywords:
+                keyword._imported(
+                    results[position:position + count] if results else [])
+                position += count
+
+        requests = 0
+        errors = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for _ in range(max_retries + 1):
+                if not chunks:
+                    break
+                futures = [(chunk, executor.submit(send, chunk))
+                           for chunk in chunks]
+                requests += len(futures)
+                chunks, errors = [], []
+                for chunk, future in futures:
+                    error = future.exception()
+                    if error is None:
+                        continue
+                    if not _transient(error, creates=any(
+                            operation['importAction'] == 'CREATE'
+                            for operation in chunk[1])):
+                        raise error  # e.g. a 4xx validation error
+                    chunks.append(chunk)
+                    errors.append(error)
+        if errors:
+            raise SearchAdsError(
+                "%d keyword chunks of Ad Group %s failed, first error: %s" % (
+                    len(errors), self._id, errors[0]))
+        return requests
+
     def save(self, verbose=False, force_sync=False,
-             save_callback=lambda x: x):
+             save_callback=lambda x: x, chunk_size=1000, max_workers=4):
         """
-        Save the AdGroup object
+        Save the AdGroup object. Only the changed fields are sent, and only
+        the new or modified keywords are imported, see import_keywords.
         :param force_sync: Force Sync to Apple APIs
         :param save_callback: Callback function called with the json
                                  serialized object as arg
         :param verbose: Verbosity
+        :param chunk_size: max number of keyword operations per request
+        :param max_workers: number of keyword requests sent in parallel
         """
         if force_sync or Synchronizable.synchronize(self,
                                              save_callback=save_callback):
-            keywords_export = []
-            for keyword in self.keywords:
-                keywords_export.extend(
-                    keyword.prepare_for_bulk_export(self._campaign_id,
-                                                    self._id))
-            api_post("keywords/targeting/", data=keywords_export,
-                     verbose=verbose)
-            if self._id:
-                api_put(
-                    "campaigns/%s/adgroups/%s" % (self._campaign_id, self._id),
-                    data=self.__editable_fields(), verbose=verbose)
+            if self._is_new():
+                res = api_post("campaigns/%s/adgroups" % (self._campaign_id),
+                               data=self.__editable_fields(),
+                               verbose=verbose)
+                self._id = _created_id(res, self._id)
             else:
-                api_post("campaigns/%s/adgroups" % (self._campaign_id),
-                         data=self.__editable_fields(),
-                         verbose=verbose)
+                changes = self.changed_fields()
+                if changes:
+                    api_put("campaigns/%s/adgroups/%s" % (self._campaign_id,
+                                                          self._id),
+                            data=changes, verbose=verbose)
+            self.mark_saved()
+            self.import_keywords(chunk_size=chunk_size,
+                                 max_workers=max_workers, verbose=verbose)
+
 
+class Campaign(Synchronizable, AppleSerializable, Trackable):
+    __slots__ = ('_id', '_org_id', '_adam_id', '_payment_model',
+                 '_serving_status', '_display_status', '_serving_state_reasons',
+                 '_modification_time', '_storefront', 'name', 'budget_amount',
+                 'daily_budget_amount', 'loc_invoice_details', 'budget_orders',
+                 'status', '_negative_keywords', '_ad_groups', 'sync_manager',
+                 '_snapshot')
 
-class Campaign(Synchronizable, AppleSerializable):
     def __init__(self,
                  id=None,
                  orgId=None,
@@ -191,13 +521,13 @@ class Campaign(Synchronizable, AppleSerializable):
         :param kwargs:
         """
         self._id = str(id)
-        self._org_id = str(orgId)
-        self._adam_id = str(adamId)
+        self._org_id = intern(str(orgId))
+        self._adam_id = intern(str(adamId))
         self._payment_model = paymentModel
         self._serving_status = servingStatus
         self._display_status = displayStatus
         self._serving_state_reasons = servingStateReasons
-        self._modification_time = modificationTime
+        self._modification_time = pack_time(modificationTime)
         self._storefront = storefront
 
         self.name = name
@@ -207,15 +537,12 @@ class Campaign(Synchronizable, AppleSerializable):
         self.budget_orders = budgetOrders
         self.status = status
 
-        self._negative_keywords = []
-        for keyword in negativeKeywords:
-            self._negative_keywords.append(Keyword(**keyword))
-
-        self.ad_groups = []
-        for ad_group in adGroups:
-            self.ad_groups.append(AdGroup(**ad_group))
+        # Ad Groups are built on first access
+        self._negative_keywords = Raw(negativeKeywords)
+        self._ad_groups = Raw(adGroups)
 
         self.sync_manager = None
+        self.mark_saved()
 
     def __repr__(self):
         return "{name} (Campaign id: {id})".format(name=self.name, id=self._id)
@@ -251,37 +578,198 @@ class Campaign(Synchronizable, AppleSerializable):
             "dailyBudgetAmount": self.daily_budget_amount,
             "status": self.status,
         }
-        if not self._id:
-            as_json['adGroups'] = [i.__editable_fields() for i in
+        if self._is_new():
+            as_json['adGroups'] = [i._tracked_fields() for i in
                                    self.ad_groups]
         return as_json
 
+    def _tracked_fields(self):
+        return self.__editable_fields()
+
+    @property
+    def ad_groups(self):
+        return hydrate(self, '_ad_groups', AdGroup.decode)
+
+    @ad_groups.setter
+    def ad_groups(self, ad_groups):
+        self._ad_groups = ad_groups
+
+    @property
+    def negative_keywords(self):
+        return hydrate(self, '_negative_keywords', Keyword.decode)
+
+    def fetch_ad_groups(self, page_size=1000):
+        """
+        Download the Ad Groups of the campaign, replacing ad_groups. Their
+        keywords are downloaded by AdGroup.fetch_keywords.
+        :param page_size: number of Ad Groups requested per call
+        :return: the list of AdGroup objects
+        """
+        self.ad_groups = list(iter_get(
+            "campaigns/%s/adgroups" % self._id, page_size=page_size,
+            org_id=self._org_id, decode=AdGroup.decode))
+        return self.ad_groups
+
+    def mark_changed(self):
+        """
+        Consider every field of the Campaign and of its Ad Groups as changed
+        """
+        Trackable.mark_changed(self)
+        for ad_group in self.ad_groups:
+            ad_group.mark_changed()
+
+    def _dirty(self):
+        return {'fields': None if self._is_new()
+                else sorted(self.changed_fields()),
+                'adGroups': [[ad_group._id, ad_group._dirty()] for ad_group
+                             in hydrated(self, '_ad_groups')
+                             if ad_group.has_changes()]}
+
+    def _mark_dirty(self, changes):
+        """
+        Mark as changed what _dirty() recorded, once rebuilt from a queued
+        snapshot
+        """
+        Trackable.mark_changed(self, changes.get('fields'))
+        dirty = dict(changes.get('adGroups') or ())
+        if dirty:  # new Ad Groups are sent anyway
+            for ad_group in self.ad_groups:
+                if ad_group._id in dirty:
+                    ad_group._mark_dirty(dirty[ad_group._id])
+
     def save(self, cascade=True, verbose=False, force_sync=False,
-             save_callback=lambda x: x):
+             save_callback=lambda x: x, chunk_size=1000, max_workers=4):
         """
-        Save the Campaign
+        Save the Campaign. Only the changed fields are sent, and unchanged
+        Ad Groups are skipped.
         :param cascade: Also save recursively all attached AdGroups
         :param force_sync: Force Sync to Apple APIs
         :param save_callback: Callback function called with the json
                                  serialized object as arg
         :param verbose: Verbosity
+        :param chunk_size: max number of keyword operations per request
+        :param max_workers: number of keyword requests sent in parallel
         """
         if force_sync or Synchronizable.synchronize(self,
                                              save_callback=save_callback):
-            if cascade:
-                for ad_group in self.ad_groups:
-                    ad_group.save(verbose=verbose)
-            if self._id:
-                api_put("campaigns/%s" % self._id,
-                        data=self.__editable_fields(),
-                        org_id=self._org_id,
-                        verbose=verbose)
+            if self._is_new():
+                # The Ad Groups of a new campaign are created along with it
+                res = api_post("campaigns/", data=self.__editable_fields(),
+                               org_id=self._org_id, verbose=verbose)
+                self._id = _created_id(res, self._id)
             else:
-                api_post("campaigns/", data=self.__editable_fields(),
-                         org_id=self._org_id, verbose=verbose)
+                if cascade:
+                    # Ad Groups never built cannot have changed
+                    for ad_group in hydrated(self, '_ad_groups'):
+                        if ad_group.has_changes():
+                            ad_group.save(verbose=verbose,
+                                          chunk_size=chunk_size,
+                                          max_workers=max_workers)
+                changes = self.changed_fields()
+                if changes:
+                    api_put("campaigns/%s" % self._id, data=changes,
+                            org_id=self._org_id, verbose=verbose)
+            self.mark_saved()
+
+
+_frozen_bids = {}
 
 
-class Keyword(object):
+def _frozen_bid(value):
+    """
+    The shared frozen copy of a bid, bids being converted once (until the
+    table is full, as for intern)
+    """
+    if value is None:
+        return None
+    try:
+        key = (tuple(value.items()), tuple(map(type, value.values())))
+        frozen = _frozen_bids.get(key)
+    except TypeError:  # unhashable values
+        return intern(_freeze(dict(value)))
+    if frozen is None:
+        if len(_frozen_bids) >= _shared_max:
+            _frozen_bids.clear()
+        frozen = _frozen_bids[key] = intern(_freeze(dict(value)))
+    return frozen
+
+
+class BidAmount(dict):
+    """
+    The bid of a Keyword, which is stored as a shared frozen value: a dict
+    that writes its changes through, so that
+    keyword.bid_amount['amount'] = '1.5' updates the keyword. Once the bid
+    of the keyword is replaced it is a plain copy. It serializes as a dict,
+    and copies are plain dicts.
+    """
+    __slots__ = ('_keyword', '_frozen')
+
+    def __init__(self, keyword):
+        dict.__init__(self, keyword._bid_amount)
+        self._keyword = keyword
+        self._frozen = keyword._bid_amount
+
+    def _changed(self):
+        if self._keyword._bid_amount is self._frozen:
+            self._keyword.bid_amount = self
+            self._frozen = self._keyword._bid_amount
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._changed()
+
+    def clear(self):
+        dict.clear(self)
+        self._changed()
+
+    def pop(self, *args):
+        value = dict.pop(self, *args)
+        self._changed()
+        return value
+
+    def popitem(self):
+        item = dict.popitem(self)
+        self._changed()
+        return item
+
+    def setdefault(self, key, default=None):
+        value = dict.setdefault(self, key, default)
+        self._changed()
+        return value
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self._changed()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def copy(self):
+        return dict(self)
+
+    __copy__ = copy
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self), memo)
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+class Keyword(Trackable):
+    # Accounts hold millions of keywords: no __dict__, the repeated values
+    # (ad group id, match type, status, bid, state) are shared, and the id
+    # and modification time are packed as ints
+    __slots__ = ('_ad_group_id', '_bid_amount', '_packed_id', 'match_type',
+                 '_modification_time', 'status', '__text', '__updated_text',
+                 '_snapshot')
+    _shared_snapshots = True
+
     def __init__(self,
                  adGroupId,
                  matchType,
@@ -302,28 +790,72 @@ class Keyword(object):
         :param id:
         :param kwargs:
         """
-        self._ad_group_id = str(adGroupId)
+        self._ad_group_id = intern(str(adGroupId))
         self.bid_amount = bidAmount
-        self._id = str(id)
-        self.match_type = matchType
-        self._modification_time = modificationTime
-        self.status = status
+        self._packed_id = pack_id(id)
+        self.match_type = intern(matchType)
+        self._modification_time = pack_time(modificationTime)
+        self.status = intern(status)
         self.__text = text
         self.__updated_text = None
+        self.mark_saved()
 
     def __repr__(self):
         return "{text} (Keyword id: {id})".format(text=self.text, id=self._id)
 
+    @property
+    def _id(self):
+        return unpack_id(self._packed_id)
+
+    @_id.setter
+    def _id(self, value):
+        self._packed_id = pack_id(value)
+
     def __editable_fields(self):
         as_dict = {
             'adGroupId': str(self._ad_group_id),
-            'bidAmount': self.bid_amount,
+            'bidAmount': self.__bid(),
             'matchType': self.match_type,
             'status': self.status,
             'text': self.text,
         }
         return as_dict
 
+    def __bid(self):
+        return None if self._bid_amount is None else dict(self._bid_amount)
+
+    def _tracked_fields(self):
+        # The text is tracked by __updated_text, which keeps the shared
+        # snapshot free of per keyword values
+        fields = self.__editable_fields()
+        del fields['text']
+        return fields
+
+    def changed_fields(self):
+        fields = Trackable.changed_fields(self)
+        if self._is_new() or self.__updated_text:
+            fields['text'] = self.text
+        return fields
+
+    @property
+    def bid_amount(self):
+        return None if self._bid_amount is None else BidAmount(self)
+
+    @bid_amount.setter
+    def bid_amount(self, value):
+        self._bid_amount = _frozen_bid(value)
+
+    def mark_saved(self):
+        # Trackable.mark_saved without building the fields: the bid is
+        # already frozen and shared, so it is keyed by identity (the
+        # snapshot keeps it alive while in the table)
+        bid, match_type, status = self._bid_amount, self.match_type, \
+            self.status
+        self._snapshot = intern(
+            (str(self._ad_group_id), bid, match_type, status),
+            key=(Keyword, self._ad_group_id, id(bid), type(match_type),
+                 match_type, type(status), status))
+
     @property
     def text(self):
         return self.__updated_text if self.__updated_text else self.__text
@@ -332,6 +864,39 @@ class Keyword(object):
     def text(self, value):
         self.__updated_text = value
 
+    def _dirty(self):
+        """
+        :return: the id of the changed keyword and, if it was renamed, its
+                 text as known by Apple
+        """
+        return [self._id, self.__text if self.__updated_text else None]
+
+    def _replayed(self, saved_text=None):
+        """
+        Mark the keyword as changed once rebuilt from a queued snapshot,
+        which holds its new text only
+        :param saved_text: its text as known by Apple, if it was renamed
+        """
+        if saved_text is not None and self.__updated_text is None:
+            self.__updated_text = self.__text
+            self.__text = saved_text
+        self.mark_changed()
+
+    def _imported(self, results):
+        """
+        Update the keyword once its bulk export went through
+        :param results: the API results of its operations, [] if unknown
+        """
+        if results and (self._is_new() or self.__updated_text):
+            created = results[-1]
+            if isinstance(created, dict) and created.get('id') is not None:
+                self._id = str(created['id'])
+        if self.__updated_text:
+            # The keyword is now the renamed one
+            self.__text = self.__updated_text
+            self.__updated_text = None
+        self.mark_saved()
+
     def pause(self):
         """
         Pause the keyword
@@ -351,12 +916,12 @@ class Keyword(object):
         :param ad_group_id: the id of the Ad Group
         :return: a list of keywords for bulk export
         """
-        if not self.__updated_text or (self.__updated_text and not self._id):
+        if not self.__updated_text or self._is_new():
             return [{
-                'importAction': 'UPDATE' if self._id else 'CREATE',
+                'importAction': 'CREATE' if self._is_new() else 'UPDATE',
                 'campaignId': str(campaign_id),
                 'adGroupId': str(ad_group_id),
-                'bidAmount': self.bid_amount,
+                'bidAmount': self.__bid(),
                 'id': str(self._id),
                 'matchType': self.match_type,
                 'status': self.status,
@@ -367,7 +932,7 @@ class Keyword(object):
                 'importAction': 'UPDATE',
                 'campaignId': str(campaign_id),
                 'adGroupId': str(ad_group_id),
-                'bidAmount': self.bid_amount,
+                'bidAmount': self.__bid(),
                 'id': str(self._id),
                 'matchType': self.match_type,
                 'status': 'PAUSED',  # Pause the old keyword anyway
@@ -376,9 +941,123 @@ class Keyword(object):
                 'importAction': 'CREATE',
                 'campaignId': str(campaign_id),
                 'adGroupId': str(ad_group_id),
-                'bidAmount': self.bid_amount,
+                'bidAmount': self.__bid(),
                 'id': str(self._id),
                 'matchType': self.match_type,
                 'status': self.status,
                 'text': self.__updated_text,
             }]
+
+
+def _each(function, *columns):
+    """
+    Call function on the items of columns, the loop running in C
+    """
+    deque(map(function, *columns), maxlen=0)
+
+
+def _shared_column(column):
+    """
+    The interned values of a column, interning each distinct value once
+    """
+    distinct = dict.fromkeys(column)
+    if not all(type(value) in (str, type(None)) for value in distinct):
+        return list(map(intern, column))  # 1 and True are not the same
+    for value in distinct:
+        distinct[value] = intern(value)
+    return list(map(distinct.__getitem__, column))
+
+
+def _decoder(cls, fields, extra=()):
+    """
+    A bulk decoder: a function building instances of a slotted model class
+    from a list of raw API dicts (e.g. the data array of a list response)
+    without going through __init__ and its keyword arguments. The field map
+    is built once, and the objects are filled column by column: each field
+    is read from all the dicts, converted, interned if shared, and set on
+    its slot, in C loops. The objects must be those the constructor builds.
+    :param cls: the model class
+    :param fields: (JSON key, slot, converter or None, shared) tuples, in
+                   the order of __init__; the defaults are those of
+                   __init__, shared values are interned
+    :param extra: (slot, value) pairs set on every instance
+    :return: a function (list of raw dicts) -> list of objects
+    """
+    parameters = inspect.signature(cls.__init__).parameters
+    field_map = []
+    for key, slot, convert, shared in fields:
+        default = parameters[key].default
+        if default is inspect.Parameter.empty:  # always sent by Apple
+            default = None
+        field_map.append((key, getattr(cls, slot).__set__, default, convert,
+                          shared))
+    extra = [(getattr(cls, slot).__set__, value) for slot, value in extra]
+    new, mark_saved = cls.__new__, cls.mark_saved
+
+    def decode(items):
+        count = len(items)
+        objects = list(map(new, repeat(cls, count)))
+        for key, setter, default, convert, shared in field_map:
+            column = map(dict.get, items, repeat(key, count),
+                         repeat(default, count))
+            if convert is not None:
+                column = map(convert, column)
+            if shared:
+                column = _shared_column(list(column))
+            _each(setter, objects, column)
+        for setter, value in extra:
+            _each(setter, objects, repeat(value, count))
+        _each(mark_saved, objects)
+        return objects
+    return decode
+
+
+Campaign.decode = staticmethod(_decoder(Campaign, [
+    ('id', '_id', str, False),
+    ('orgId', '_org_id', str, True),
+    ('name', 'name', None, False),
+    ('budgetAmount', 'budget_amount', None, False),
+    ('adamId', '_adam_id', str, True),
+    ('paymentModel', '_payment_model', None, False),
+    ('locInvoiceDetails', 'loc_invoice_details', None, False),
+    ('budgetOrders', 'budget_orders', None, False),
+    ('dailyBudgetAmount', 'daily_budget_amount', None, False),
+    ('status', 'status', None, False),
+    ('servingStatus', '_serving_status', None, False),
+    ('displayStatus', '_display_status', None, False),
+    ('servingStateReasons', '_serving_state_reasons', None, False),
+    ('negativeKeywords', '_negative_keywords', Raw, False),
+    ('storefront', '_storefront', None, False),
+    ('adGroups', '_ad_groups', Raw, False),
+    ('modificationTime', '_modification_time', pack_time, False),
+], extra=[('sync_manager', None)]))
+
+AdGroup.decode = staticmethod(_decoder(AdGroup, [
+    ('cpaGoal', 'cpa_goal', None, False),
+    ('startTime', '_start_time', None, False),
+    ('storefronts', '_storefronts', None, False),
+    ('name', 'name', None, False),
+    ('displayStatus', '_display_status', None, False),
+    ('targetingDimensions', 'targeting_dimensions', None, False),
+    ('defaultCpcBid', 'default_cpc_bid', None, False),
+    ('status', 'status', None, False),
+    ('automatedKeywordsOptIn', 'automated_keywords_opt_in', None, False),
+    ('servingStatus', '_serving_status', None, False),
+    ('servingStateReasons', '_serving_state_reasons', None, False),
+    ('id', '_id', str, False),
+    ('negativeKeywords', '_negative_keywords', Raw, False),
+    ('campaignId', '_campaign_id', str, True),
+    ('keywords', '_keywords', Raw, False),
+    ('modificationTime', '_modification_time', pack_time, False),
+    ('endTime', '_end_time', None, False),
+], extra=[('sync_manager', None)]))
+
+Keyword.decode = staticmethod(_decoder(Keyword, [
+    ('adGroupId', '_ad_group_id', str, True),
+    ('matchType', 'match_type', None, True),
+    ('status', 'status', None, True),
+    ('text', '_Keyword__text', None, False),
+    ('bidAmount', '_bid_amount', _frozen_bid, False),
+    ('modificationTime', '_modification_time', pack_time, False),
+    ('id', '_packed_id', pack_id, False),
+], extra=[('_Keyword__updated_text', None)]))
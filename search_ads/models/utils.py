@@ -1,4 +1,21 @@
 import json
+from collections.abc import Mapping
+from datetime import datetime, timedelta
+from functools import lru_cache
+from operator import attrgetter, itemgetter
+
+try:
+    import orjson
+except ImportError:  # orjson is an optional, faster, JSON backend
+    orjson = None
+
+_shared = {}
+# Bound of the shared values: the table is emptied when it is full, so that
+# it does not keep the values of entities that are gone
+_shared_max = 1 << 16
+_missing = object()
+_scalars = (str, int, float, bool, type(None))
+_scalar_types = frozenset(_scalars)
 
 
 def to_camel_case(text):
@@ -6,45 +23,318 @@ def to_camel_case(text):
     return s[:1].lower() + s[1:]
 
 
+def _shared_key(value):
+    """
+    The key of a value in the shared table, which tells equal values of
+    different types (1, 1.0 and True) apart
+    """
+    kind = type(value)
+    if kind is str:
+        return value
+    if kind is tuple:
+        return kind, tuple([_shared_key(val) for val in value])
+    return kind, value
+
+
+def intern(value, key=None):
+    """
+    The shared copy of an immutable value, so that the many keywords holding
+    the same status, match type, ids or bid hold a single object. Only
+    intern values repeated across entities.
+    :param value: a string or any hashable value
+    :param key: a cheaper key of the value, computed from its type and value
+                by default
+    """
+    if key is None:
+        key = _shared_key(value)
+    shared = _shared.get(key, _missing)
+    if shared is _missing:
+        if len(_shared) >= _shared_max:
+            _shared.clear()
+        shared = _shared[key] = value
+    return shared
+
+
+_epoch = datetime(1970, 1, 1)
+_epoch_day = _epoch.toordinal()
+
+
+def pack_time(value):
+    """
+    Pack a timestamp of the Apple APIs ('2018-03-01T10:00:00.000') as the
+    milliseconds since 1970, an int of 32 bytes instead of a str of 72
+    :return: the int, other values (None, other formats) as they are
+    """
+    if type(value) is str and len(value) == 23 and value[10] == 'T' and \
+            value[4] == value[7] == '-' and value[13] == value[16] == ':' \
+            and value[19] == '.':
+        time = datetime.fromisoformat(value)
+        return ((time.toordinal() - _epoch_day) * 86400 + time.hour * 3600 +
+                time.minute * 60 + time.second) * 1000 + \
+            time.microsecond // 1000
+    return value
+
+
+def unpack_time(value):
+    """
+    :return: the timestamp packed by pack_time, as sent by Apple
+    """
+    if type(value) is int:
+        return (_epoch + timedelta(milliseconds=value)).isoformat(
+            timespec='milliseconds')
+    return value
+
+
+def pack_id(value):
+    """
+    Pack an id as an int when it is a decimal number (an int of 28 to 32
+    bytes instead of a str of about 59), unpack_id giving back its str
+    :return: the int, else the id as a str ('None' for new entities)
+    """
+    if type(value) is int:
+        return value
+    value = str(value)
+    if value.isdigit() and value.isascii() and \
+            (value[0] != '0' or value == '0'):
+        return int(value)
+    return value
+
+
+def unpack_id(value):
+    """
+    :return: the id packed by pack_id, as a str
+    """
+    return str(value) if type(value) is int else value
+
+
+def slot_names(cls):
+    """
+    The slots of a class and of its bases, mangled as in __dict__
+    """
+    names = []
+    for klass in cls.__mro__:
+        slots = klass.__dict__.get('__slots__', ())
+        for name in [slots] if isinstance(slots, str) else slots:
+            if name.startswith('__') and not name.endswith('__'):
+                name = '_%s%s' % (klass.__name__.lstrip('_'), name)
+            names.append(name)
+    return names
+
+
+class Raw(tuple):
+    """
+    The raw JSON of a child collection (the ad groups of a campaign, the
+    keywords of an ad group) whose objects are built on first access.
+    It serializes as the JSON it holds.
+    """
+    __slots__ = ()
+
+
+def hydrate(obj, slot, decode):
+    """
+    Build the objects of a lazy child collection, once
+    :param obj: the parent object
+    :param slot: the attribute holding the collection
+    :param decode: a function building the children from their raw JSON
+                   (e.g. Keyword.decode)
+    :return: the list of children
+    """
+    value = getattr(obj, slot)
+    if isinstance(value, Raw):
+        value = decode(value)
+        setattr(obj, slot, value)
+    return value
+
+
+def hydrated(obj, slot):
+    """
+    :return: the children built so far: none if the collection is still raw
+    """
+    value = getattr(obj, slot)
+    return [] if isinstance(value, Raw) else value
+
+
 class Serializable(object):
     def to_json(self):
         return json.dumps(self, default=lambda x: x.__dict__,
                           sort_keys=True, indent=4)
 
 
+# Attributes never serialized, and how some others are read
+_NOT_SERIALIZED = ('_Keyword__updated_text', 'sync_manager', '_snapshot')
+_READ_AS = {
+    '_Keyword__text': ('text', attrgetter('text')),
+    '_bid_amount': ('bid_amount', lambda obj: None if obj._bid_amount is None
+                    else dict(obj._bid_amount)),  # stored frozen
+    '_modification_time': ('modification_time', lambda obj: unpack_time(
+        obj._modification_time)),  # stored packed
+    '_packed_id': ('id', attrgetter('_id')),
+}
+_field_maps = {}
+
+
+@lru_cache(maxsize=None)
+def _json_key(name):
+    if name in _READ_AS:
+        name = _READ_AS[name][0]
+    return to_camel_case(name[1:] if name.startswith('_') else name)
+
+
+def _field_map(cls):
+    """
+    The (JSON key, getter) pairs of the slots of a class, sorted by key,
+    and whether its instances have a __dict__; computed once per class
+    """
+    field_map = _field_maps.get(cls)
+    if field_map is None:
+        getters = sorted(
+            ((_json_key(name), _READ_AS[name][1] if name in _READ_AS
+              else attrgetter(name))
+             for name in slot_names(cls) if name not in _NOT_SERIALIZED),
+            key=itemgetter(0))
+        field_map = _field_maps[cls] = (getters, cls.__dictoffset__ != 0)
+    return field_map
+
+
+def _apple_json(obj):
+    """
+    JSON encoder fallback: the Apple API representation of a model object
+    """
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if isinstance(obj, tuple):  # Raw collections
+        return list(obj)
+    getters, has_dict = _field_map(type(obj))
+    as_json = {}
+    for key, getter in getters:
+        try:
+            as_json[key] = getter(obj)
+        except AttributeError:  # slot never set
+            pass
+    if has_dict:
+        for name, value in obj.__dict__.items():
+            if name not in _NOT_SERIALIZED:
+                as_json[_json_key(name)] = value
+    return as_json
+
+
+def dumps(obj, indent=None):
+    """
+    Serialize model objects to JSON, with orjson when it is installed and
+    the output is compact
+    :param obj: the object to serialize
+    :param indent: indentation of the output, default compact
+    :return: a str
+    """
+    if orjson is not None and indent is None:
+        return orjson.dumps(obj, default=_apple_json).decode('utf-8')
+    separators = (',', ':') if indent is None else None
+    return json.dumps(obj, default=_apple_json, indent=indent,
+                      separators=separators)
+
+
 class AppleSerializable(object):
-    def to_json(self):
-        def make_apple_api_compliant(obj):
-            new_dict = {}
-            dict_repr = obj.__dict__
-            for key, val in dict_repr.items():
-                if key == '_Keyword__text':
-                    key = ' text'
-                    val = dict_repr['_Keyword__updated_text'] if \
-                        dict_repr['_Keyword__updated_text'] is not None else \
-                        dict_repr['_Keyword__text']
-                if key == '_Keyword__updated_text':
-                    continue
-                if key.startswith("_"):
-                    new_key = to_camel_case(key[1:])
-                else:
-                    new_key = to_camel_case(key)
-                new_dict[new_key] = val
-            return new_dict
-
-        return json.dumps(self, default=make_apple_api_compliant,
-                          sort_keys=True, indent=4)
+    __slots__ = ()
+
+    def to_json(self, indent=None):
+        """
+        :param indent: indentation of the output, default compact
+        :return: the object as sent to the Apple APIs, in JSON
+        """
+        return dumps(self, indent=indent)
+
+
+def _freeze(value):
+    """
+    A hashable copy of a JSON like value, used to detect changes of the
+    values that are modified in place (e.g. bid_amount['amount'])
+    """
+    if type(value) in _scalar_types or isinstance(value, _scalars):
+        return value
+    if isinstance(value, dict):
+        return tuple(sorted([(key, _freeze(val))
+                             for key, val in value.items()]))
+    if isinstance(value, (list, tuple)):
+        return tuple([_freeze(val) for val in value])
+    return value
+
+
+class Trackable(object):
+    """
+    Change tracking: the editable fields are recorded when an entity is
+    loaded or saved, so that save() only sends the fields changed since.
+    Subclasses implement _tracked_fields, returning the editable fields as
+    sent to the API, and set _shared_snapshots when many entities share the
+    same state.
+    """
+    __slots__ = ()
+    _shared_snapshots = False
+
+    def _tracked_fields(self):
+        raise NotImplementedError
+
+    def _is_new(self):
+        return getattr(self, '_id', None) in (None, 'None', '')
+
+    def mark_saved(self):
+        """
+        Record the current state as the one known by Apple
+        """
+        snapshot = tuple(map(_freeze, self._tracked_fields().values()))
+        self._snapshot = intern(snapshot) if self._shared_snapshots \
+            else snapshot
+
+    def mark_changed(self, fields=None):
+        """
+        Consider fields as changed, so that the next save sends them
+        :param fields: the names of the fields as sent to the API, default
+                       all of them
+        """
+        snapshot = getattr(self, '_snapshot', None)
+        if fields is None or snapshot is None:
+            self._snapshot = None
+            return
+        self._snapshot = tuple(
+            _missing if key in fields else saved
+            for key, saved in zip(self._tracked_fields(), snapshot))
+
+    def changed_fields(self):
+        """
+        :return: the editable fields changed since load (or last save), all
+                 of them for new entities
+        """
+        fields = self._tracked_fields()
+        snapshot = getattr(self, '_snapshot', None)
+        if snapshot is None or self._is_new() or \
+                len(snapshot) != len(fields):
+            return fields
+        return dict((key, val) for (key, val), saved in
+                    zip(fields.items(), snapshot) if saved != _freeze(val))
+
+    def has_changes(self):
+        return bool(self.changed_fields())
 
 
 class Synchronizable(object):
+    __slots__ = ()
+
     def set_sync_manager(self, sync_manager):
         self.sync_manager = sync_manager
 
+    def _dirty(self):
+        """
+        What a queued save has to send (JSON serializable), None for
+        everything
+        """
+        return None
+
     def synchronize(self, save_callback=lambda x: x, *args, **kwargs):
         if self.sync_manager is not None:
-            save_callback(self.to_json())
-            self.sync_manager.pending_actions.append(
-                (self.__class__.__name__, self.to_json(), args[1:], kwargs)
-            )
+            json_data = self.to_json()
+            save_callback(json_data)
+            self.sync_manager.queue(self.__class__.__name__, json_data,
+                                    args[1:], kwargs,
+                                    entity_id=getattr(self, '_id', None),
+                                    changes=self._dirty())
             return False
         return True
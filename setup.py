@@ -14,4 +14,9 @@ setup(name='apple_search_ads',
           "requests",
           "tqdm",
       ],
+      extras_require={
+          "async": ["aiohttp"],
+          "parquet": ["pyarrow"],
+          "fast": ["orjson"],
+      },
       zip_safe=False)
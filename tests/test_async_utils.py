@@ -0,0 +1,41 @@
+import asyncio
+import threading
+import unittest
+
+from search_ads.api.async_utils import AsyncTransport, _acquire
+from search_ads.api.utils import AdaptiveLimiter, TokenBucket
+
+
+class AcquireTest(unittest.TestCase):
+
+    def test_waits_for_a_release(self):
+        bucket, limiter = TokenBucket(1000, 1000), AdaptiveLimiter(1)
+        limiter.acquire()
+
+        async def main():
+            waiter = asyncio.ensure_future(_acquire(bucket, limiter))
+            await asyncio.sleep(0.05)
+            self.assertFalse(waiter.done())
+            threading.Thread(target=limiter.release).start()
+            await asyncio.wait_for(waiter, 1)
+
+        asyncio.run(main())
+        self.assertEqual(limiter.in_flight, 1)
+        self.assertFalse(limiter._listeners)
+
+
+class AsyncTransportTest(unittest.TestCase):
+
+    def test_plain_http_does_not_load_the_certificate(self):
+        async def main():
+            transport = AsyncTransport()
+            session = transport._session(('missing.pem', 'missing.key'),
+                                         org_id=1, secure=False)
+            await transport.close()
+            return session
+
+        self.assertIsNotNone(asyncio.run(main()))
+
+
+if __name__ == '__main__':
+    unittest.main()
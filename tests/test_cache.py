@@ -0,0 +1,46 @@
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from search_ads.api.cache import DirectoryCache, MemoryCache
+
+
+def request(days_ago):
+    end = (datetime.now() - timedelta(days=days_ago)).strftime('%Y-%m-%d')
+    return {'startTime': '2018-01-01', 'endTime': end}
+
+
+class ReportCacheTest(unittest.TestCase):
+
+    def test_recent_reports_expire(self):
+        cache = MemoryCache(today_ttl=60, lookback_days=2)
+        self.assertEqual(cache.ttl(request(-1)), 60)
+        self.assertEqual(cache.ttl(request(0)), 60)
+        self.assertEqual(cache.ttl(request(1)), 60)  # restated by Apple
+        self.assertEqual(cache.ttl(request(2)), 60)
+        self.assertIsNone(cache.ttl(request(3)))
+        self.assertIsNone(MemoryCache(lookback_days=0).ttl(request(1)))
+
+    def test_expired_reports_are_missing(self):
+        cache = MemoryCache(today_ttl=0)
+        cache.set(1, 'reports/campaigns', request(1), {'data': 1})
+        cache.set(1, 'reports/campaigns', request(30), {'data': 2})
+        self.assertIsNone(cache.get(1, 'reports/campaigns', request(1)))
+        self.assertEqual(cache.get(1, 'reports/campaigns', request(30)),
+                         {'data': 2})
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_directory_cache(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        cache = DirectoryCache(path, max_bytes=10 ** 6)
+        cache.set(1, 'reports/campaigns', request(30), {'data': [1, 2]})
+        reopened = DirectoryCache(path, max_bytes=10 ** 6)
+        self.assertEqual(reopened.get(1, 'reports/campaigns', request(30)),
+                         {'data': [1, 2]})
+        self.assertEqual(reopened._total, cache._total)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pandas as pd
+
+from search_ads.api.search_ads_building_blocks import DataBase
+from search_ads.models.store_models import Campaign
+
+
+def report(dates, spend):
+    return pd.DataFrame({'date': dates, 'keyword': ['photo'] * len(dates),
+                         'localSpend': spend})
+
+
+class SaveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.campaigns = [Campaign(id=1, orgId=42), Campaign(id=2, orgId=42)]
+        self.db = DataBase(reports={
+            'campaign': report(['2018-03-01'], [3.0]),
+            self.campaigns[0]: {'keywords': report(
+                ['2018-03-01', '2018-03-02'], [1.0, 2.0])},
+            self.campaigns[1]: {'keywords': report(['2018-03-01'], [5.0])},
+        })
+        self.db.save(self.path)
+
+    def files(self):
+        files = {}
+        for directory, _, names in os.walk(self.path):
+            for name in names:
+                full_name = os.path.join(directory, name)
+                files[os.path.relpath(full_name, self.path)] = \
+                    os.stat(full_name).st_ino
+        return files
+
+    def test_only_changed_reports_are_rewritten(self):
+        before = self.files()
+        db = DataBase.load(self.path)
+        campaign = [key for key in db.reports if isinstance(key, Campaign)
+                    and key._id == '1'][0]
+        db.reports[campaign]['keywords'] = report(['2018-03-02'], [7.0])
+        db.changed_reports.add(('1', 'keywords'))
+        db.save(self.path)
+
+        after = self.files()
+        changed = set(name for name in before
+                      if after.get(name) != before[name])
+        self.assertEqual(changed, set([
+            'manifest.json',
+            os.path.join('reports', 'campaign=1', 'report=keywords',
+                         'date=2018-03-01.parquet'),
+            os.path.join('reports', 'campaign=1', 'report=keywords',
+                         'date=2018-03-02.parquet')]))
+        self.assertNotIn(os.path.join('reports', 'campaign=1',
+                                      'report=keywords',
+                                      'date=2018-03-01.parquet'), after)
+        # The unchanged reports were neither read nor dropped
+        other = [key for key in db.reports if isinstance(key, Campaign)
+                 and key._id == '2'][0]
+        self.assertIn('campaign', db.reports._loaders)
+        self.assertIn('keywords', db.reports[other]._loaders)
+        reloaded = DataBase.load(self.path)
+        self.assertEqual(
+            sorted(reloaded.query('keywords')['localSpend']), [5.0, 7.0])
+        self.assertEqual(list(reloaded.query('campaign')['localSpend']),
+                         [3.0])
+        self.assertFalse(db.changed_reports)
+
+    def test_saving_elsewhere_writes_everything(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.db.save(path)
+        self.assertEqual(sorted(DataBase.load(path).query('keywords')[
+            'localSpend']), [1.0, 2.0, 5.0])
+
+
+class QueryTest(unittest.TestCase):
+
+    FILTERS = [
+        [('matchType', '=', 'EXACT')],
+        [('matchType', '==', 'BROAD')],
+        [('matchType', '!=', 'EXACT')],
+        [('localSpend', '<', 2.0)],
+        [('localSpend', '<=', 2.0)],
+        [('localSpend', '>', 2.0)],
+        [('localSpend', '>=', 2.0)],
+        [('keyword', 'in', ['photo', 'video'])],
+        [('keyword', 'not in', ('photo',))],
+        [('matchType', '=', 'EXACT'), ('localSpend', '>', 0.5)],
+    ]
+    EXPECTED = [
+        [1, 3, 5], [2, 4, 6], [2, 4, 6], [1], [1, 2], [3, 4, 5, 6],
+        [2, 3, 4, 5, 6], [1, 2, 3, 5], [2, 4, 5, 6], [1, 3, 5],
+    ]
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        keywords = pd.DataFrame({
+            'date': ['2018-03-01', '2018-03-01', '2018-03-02', '2018-03-02',
+                     '2018-03-03', '2018-03-03'],
+            'keyword': ['photo', 'video', 'photo', 'editor', 'video',
+                        'editor'],
+            'matchType': ['EXACT', 'BROAD'] * 3,
+            'localSpend': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+        })
+        self.memory = DataBase(reports={
+            'campaign': report(['2018-03-01'], [10.0]),
+            Campaign(id=1, orgId=42): {'keywords': keywords[:4]},
+            Campaign(id=2, orgId=42): {'keywords': keywords[4:]},
+        })
+        self.memory.save(self.path)
+        self.memory.store = None  # query the DataFrames in memory
+        self.stored = DataBase.load(self.path)
+
+    def rows(self, df):
+        return sorted(tuple(row) for row in
+                      df.astype(object).itertuples(index=False))
+
+    def assertSameRows(self, report, **kwargs):
+        in_memory = self.memory.query(report, **kwargs)
+        self.assertEqual(self.rows(in_memory),
+                         self.rows(self.stored.query(report, **kwargs)))
+        return in_memory
+
+    def test_every_operator(self):
+        for filters, expected in zip(self.FILTERS, self.EXPECTED):
+            for database in (self.memory, self.stored):
+                df = database.query('keywords', filters=filters)
+                self.assertEqual(sorted(df['localSpend']), expected, filters)
+
+    def test_memory_and_parquet_give_the_same_rows(self):
+        for filters in self.FILTERS + [None]:
+            self.assertSameRows('keywords', filters=filters)
+        df = self.assertSameRows('keywords', start_date='2018-03-02',
+                                 end_date='2018-03-02',
+                                 columns=['keyword', 'localSpend'])
+        self.assertEqual(list(df.columns), ['keyword', 'localSpend'])
+        self.assertEqual(len(df), 2)
+        self.assertEqual(len(self.assertSameRows('keywords',
+                                                 campaign_ids=[2])), 2)
+        self.assertEqual(len(self.assertSameRows('campaign')), 1)
+        self.assertEqual(len(self.assertSameRows(
+            'keywords', filters=[('localSpend', '>', 100)])), 0)
+        self.assertEqual(len(self.assertSameRows('adgroup')), 0)
+
+    def test_changed_reports_are_read_from_memory(self):
+        campaign = [key for key in self.stored.reports
+                    if isinstance(key, Campaign) and key._id == '2'][0]
+        self.stored.reports[campaign]['keywords'] = report(
+            ['2018-03-03'], [7.0]).assign(matchType='EXACT')
+        self.stored.changed_reports.add(('2', 'keywords'))
+        df = self.stored.query('keywords', filters=[
+            ('matchType', '=', 'EXACT')], columns=['localSpend'])
+        self.assertEqual(sorted(df['localSpend']), [1.0, 3.0, 7.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+
+from search_ads.models.store_models import AdGroup, Campaign, Keyword
+from search_ads.models.utils import dumps, slot_names
+
+CAMPAIGNS = [
+    {'id': 1, 'orgId': 42, 'name': 'Brand', 'adamId': 284882215,
+     'paymentModel': 'PAYG', 'status': 'ENABLED',
+     'budgetAmount': {'amount': '1000', 'currency': 'USD'},
+     'dailyBudgetAmount': {'amount': '100', 'currency': 'USD'},
+     'servingStatus': 'RUNNING', 'displayStatus': 'RUNNING',
+     'servingStateReasons': None, 'storefront': ['US'],
+     'modificationTime': '2018-03-01T10:00:00.000',
+     'adGroups': [{'id': 5, 'campaignId': 1, 'name': 'Exact'}],
+     'countriesOrRegions': ['US'], 'deleted': False},
+    {'name': 'New campaign', 'orgId': '42'},
+]
+
+AD_GROUPS = [
+    {'id': 5, 'campaignId': 1, 'name': 'Exact', 'status': 'ENABLED',
+     'storefronts': ['US', 'GB'], 'cpaGoal': None,
+     'defaultCpcBid': {'amount': '1', 'currency': 'USD'},
+     'automatedKeywordsOptIn': False, 'startTime': '2018-03-01T00:00:00.000',
+     'keywords': [{'id': 9, 'adGroupId': 5, 'text': 'photo',
+                   'matchType': 'EXACT', 'status': 'ACTIVE'}],
+     'negativeKeywords': [], 'pricingModel': 'CPC'},
+    {'campaignId': '1', 'name': 'New ad group'},
+]
+
+KEYWORDS = [
+    {'id': 9, 'adGroupId': 5, 'text': 'photo', 'matchType': 'EXACT',
+     'status': 'ACTIVE', 'bidAmount': {'amount': '1.5', 'currency': 'USD'},
+     'modificationTime': '2018-03-01T10:00:00.000', 'deleted': False},
+    {'id': '10', 'adGroupId': '5', 'text': 'photo editor',
+     'matchType': 'BROAD', 'status': 'PAUSED',
+     'bidAmount': {'amount': 2, 'currency': 'USD'}},
+    {'adGroupId': 5, 'text': 'new keyword', 'matchType': 'EXACT',
+     'status': 'ACTIVE', 'bidAmount': None},
+]
+
+
+class DecodeTest(unittest.TestCase):
+
+    def assertSameObjects(self, cls, items):
+        decoded = cls.decode(items)
+        self.assertEqual(len(decoded), len(items))
+        for raw, obj in zip(items, decoded):
+            expected = cls(**raw)
+            self.assertIs(type(obj), cls)
+            for name in slot_names(cls):
+                self.assertEqual(getattr(obj, name), getattr(expected, name),
+                                 name)
+                self.assertIs(type(getattr(obj, name)),
+                              type(getattr(expected, name)), name)
+            self.assertEqual(dumps(obj), dumps(expected))
+            self.assertEqual(obj.changed_fields(), expected.changed_fields())
+
+    def test_campaigns(self):
+        self.assertSameObjects(Campaign, CAMPAIGNS)
+
+    def test_ad_groups(self):
+        self.assertSameObjects(AdGroup, AD_GROUPS)
+
+    def test_keywords(self):
+        self.assertSameObjects(Keyword, KEYWORDS)
+
+    def test_shared_values(self):
+        first, second = Keyword.decode([dict(KEYWORDS[0]),
+                                        dict(KEYWORDS[0], id=11)])
+        self.assertIs(first._ad_group_id, second._ad_group_id)
+        self.assertIs(first._bid_amount, second._bid_amount)
+        self.assertIs(first._snapshot, second._snapshot)
+
+    def test_children_are_decoded(self):
+        campaign = Campaign.decode(CAMPAIGNS[:1])[0]
+        ad_group = campaign.ad_groups[0]
+        self.assertIsInstance(ad_group, AdGroup)
+        self.assertEqual(ad_group._campaign_id, '1')
+        keyword = AdGroup.decode(AD_GROUPS[:1])[0].keywords[0]
+        self.assertEqual((keyword._id, keyword.text), ('9', 'photo'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import copy
+import json
+import unittest
+
+from search_ads.models.store_models import Keyword
+from search_ads.models.utils import dumps
+
+
+def keyword(**fields):
+    raw = dict({'id': 542370642, 'adGroupId': 5, 'text': 'photo',
+                'matchType': 'EXACT', 'status': 'ACTIVE',
+                'bidAmount': {'amount': '1.5', 'currency': 'USD'},
+                'modificationTime': '2018-03-01T10:00:00.123'}, **fields)
+    return Keyword.decode([raw])[0]
+
+
+class PackedFieldsTest(unittest.TestCase):
+
+    def test_id_and_modification_time_are_packed(self):
+        kw = keyword()
+        self.assertEqual(kw._packed_id, 542370642)
+        self.assertEqual(kw._id, '542370642')
+        self.assertIsInstance(kw._modification_time, int)
+        self.assertEqual(json.loads(dumps(kw))['modificationTime'],
+                         '2018-03-01T10:00:00.123')
+
+    def test_other_values_are_kept(self):
+        for raw_id, expected in ((None, 'None'), ('007', '007'),
+                                 ('abc', 'abc'), ('0', '0')):
+            self.assertEqual(keyword(id=raw_id)._id, expected)
+        kw = keyword(modificationTime='2018-03-01 10:00:00')
+        self.assertEqual(kw._modification_time, '2018-03-01 10:00:00')
+        self.assertTrue(keyword(id=None)._is_new())
+
+    def test_created_id(self):
+        kw = keyword(id=None)
+        kw._imported([{'id': 77}])
+        self.assertEqual((kw._id, kw._is_new()), ('77', False))
+
+
+class BidAmountTest(unittest.TestCase):
+
+    def test_writes_through(self):
+        kw = keyword()
+        kw.bid_amount['amount'] = '2'
+        self.assertEqual(kw.bid_amount, {'amount': '2', 'currency': 'USD'})
+        self.assertEqual(kw.changed_fields(),
+                         {'bidAmount': {'amount': '2', 'currency': 'USD'}})
+
+    def test_json_and_copies_are_plain_dicts(self):
+        kw = keyword()
+        self.assertEqual(json.loads(json.dumps(kw.bid_amount)),
+                         {'amount': '1.5', 'currency': 'USD'})
+        for copied in (copy.copy(kw.bid_amount), copy.deepcopy(kw.bid_amount),
+                       kw.bid_amount.copy()):
+            self.assertIs(type(copied), dict)
+            copied['amount'] = '9'
+        self.assertEqual(kw.bid_amount['amount'], '1.5')
+        self.assertFalse(kw.has_changes())
+
+    def test_detached_once_replaced(self):
+        kw = keyword()
+        bid = kw.bid_amount
+        kw.bid_amount = {'amount': '3', 'currency': 'USD'}
+        bid['amount'] = '4'
+        self.assertEqual(kw.bid_amount['amount'], '3')
+
+
+if __name__ == '__main__':
+    unittest.main()
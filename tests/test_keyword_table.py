@@ -0,0 +1,49 @@
+import unittest
+
+from search_ads.models.keyword_table import KeywordTable
+from search_ads.models.store_models import AdGroup
+
+AD_GROUP = {
+    'id': 5, 'campaignId': 1, 'name': 'Exact',
+    'defaultCpcBid': {'amount': '1', 'currency': 'USD'},
+    'keywords': [
+        {'id': 9, 'adGroupId': 5, 'text': 'photo', 'matchType': 'EXACT',
+         'status': 'ACTIVE', 'bidAmount': {'amount': '1.50',
+                                           'currency': 'USD'}},
+        {'id': 10, 'adGroupId': 5, 'text': 'photo editor',
+         'matchType': 'BROAD', 'status': 'ACTIVE', 'bidAmount': None},
+    ],
+}
+
+
+class ToBulkExportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ad_group = AdGroup(**AD_GROUP)
+        self.renamed = self.ad_group.keywords[0]
+        self.renamed.text = 'photos'
+
+    def test_renamed_keyword_is_paused_and_created(self):
+        table = KeywordTable(self.ad_group)
+        payload = table.to_bulk_export(only_changed=False)
+        self.assertEqual(payload[:2],
+                         self.renamed.prepare_for_bulk_export(1, 5))
+        self.assertEqual([(row['importAction'], row['status'], row['text'])
+                          for row in payload],
+                         [('UPDATE', 'PAUSED', 'photo'),
+                          ('CREATE', 'ACTIVE', 'photos'),
+                          ('UPDATE', 'ACTIVE', 'photo editor')])
+
+    def test_table_edits_go_to_both_operations(self):
+        table = KeywordTable(self.ad_group)
+        table.set_bids(2, where=table.df['id'] == '9')
+        payload = table.to_bulk_export()
+        self.assertEqual(len(payload), 2)
+        self.assertEqual([row['bidAmount'] for row in payload],
+                         [{'amount': '2.00', 'currency': 'USD'}] * 2)
+        self.assertEqual([row['text'] for row in payload],
+                         ['photo', 'photos'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import threading
+import unittest
+from unittest import mock
+
+from search_ads.api.utils import iter_get, paginate
+
+
+class FakeEndpoint(object):
+    """
+    A list endpoint over `results`, recording the offsets requested
+    """
+
+    def __init__(self, results, total=True):
+        self.results = results
+        self.total = total
+        self.offsets = []
+        self.lock = threading.Lock()
+
+    def __call__(self, offset, limit):
+        with self.lock:
+            self.offsets.append(offset)
+        page = {'data': self.results[offset:offset + limit]}
+        if self.total:
+            page['pagination'] = {'totalResults': len(self.results),
+                                  'startIndex': offset,
+                                  'itemsPerPage': limit}
+        return page
+
+
+def results(pages):
+    return [item for page in pages for item in page['data']]
+
+
+class PaginateTest(unittest.TestCase):
+
+    def test_total_multiple_of_the_page_size(self):
+        for prefetch in (False, True):
+            endpoint = FakeEndpoint(list(range(6)))
+            pages = list(paginate(endpoint, page_size=2, prefetch=prefetch))
+            self.assertEqual(results(pages), list(range(6)))
+            self.assertEqual(endpoint.offsets, [0, 2, 4])
+
+    def test_total_not_multiple_of_the_page_size(self):
+        for prefetch in (False, True):
+            endpoint = FakeEndpoint(list(range(5)))
+            pages = list(paginate(endpoint, page_size=2, prefetch=prefetch))
+            self.assertEqual([len(page['data']) for page in pages], [2, 2, 1])
+            self.assertEqual(endpoint.offsets, [0, 2, 4])
+
+    def test_without_total_stops_at_a_short_or_empty_page(self):
+        endpoint = FakeEndpoint(list(range(5)), total=False)
+        self.assertEqual(results(paginate(endpoint, page_size=2)),
+                         list(range(5)))
+        self.assertEqual(endpoint.offsets, [0, 2, 4])
+        endpoint = FakeEndpoint(list(range(4)), total=False)
+        self.assertEqual(results(paginate(endpoint, page_size=2)),
+                         list(range(4)))
+        self.assertEqual(endpoint.offsets, [0, 2, 4])
+
+    def test_empty_and_offset(self):
+        endpoint = FakeEndpoint([])
+        self.assertEqual(results(paginate(endpoint, page_size=2)), [])
+        self.assertEqual(endpoint.offsets, [0])
+        endpoint = FakeEndpoint(list(range(5)))
+        self.assertEqual(results(paginate(endpoint, page_size=2, offset=1)),
+                         [1, 2, 3, 4])
+        self.assertEqual(endpoint.offsets, [1, 3])
+
+    def test_early_break_stops_prefetching(self):
+        endpoint = FakeEndpoint(list(range(10)))
+        running = set(threading.enumerate())
+        pages = paginate(endpoint, page_size=2, prefetch=True)
+        for page in pages:
+            break
+        pages.close()
+        threads = [thread for thread in threading.enumerate()
+                   if thread not in running]
+        for thread in threads:
+            thread.join(1)
+        # Only the page after the one consumed was downloaded ahead
+        self.assertEqual(endpoint.offsets, [0, 2])
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+
+
+class IterGetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.endpoint = FakeEndpoint(list(range(5)))
+        patcher = mock.patch(
+            'search_ads.api.utils.api_get',
+            side_effect=lambda endpoint, limit, offset, **kwargs:
+            self.endpoint(offset, limit))
+        self.api_get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_yields_every_result(self):
+        self.assertEqual(list(iter_get('campaigns', page_size=2,
+                                       prefetch=True)), list(range(5)))
+        self.assertEqual(self.api_get.call_count, 3)
+        self.assertEqual(self.api_get.call_args[0][0], 'campaigns')
+
+    def test_decode(self):
+        self.assertEqual(list(iter_get('campaigns', page_size=2,
+                                       decode=lambda items: [
+                                           -item for item in items])),
+                         [0, -1, -2, -3, -4])
+
+    def test_early_break(self):
+        for item in iter_get('campaigns', page_size=2):
+            if item == 2:
+                break
+        self.assertEqual(self.endpoint.offsets, [0, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import unittest
+from unittest import mock
+
+from search_ads.api.search_ads_building_blocks import SearchAds
+from search_ads.models.registry import EntityIndex, EntityRegistry
+from search_ads.models.store_models import AdGroup, Campaign
+
+
+def campaign(campaign_id, name, modified='2018-03-01T10:00:00.000'):
+    return Campaign(id=campaign_id, orgId=42, name=name,
+                    modificationTime=modified)
+
+
+class EntityIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = EntityIndex([
+            campaign(1, 'Brand US'), campaign(2, 'brand GB'),
+            campaign(3, 'Generic'), campaign(4, 'STRASSE'),
+            campaign(5, 'Brandy')])
+
+    def ids(self, entities):
+        return sorted(int(entity._id) for entity in entities)
+
+    def test_find_ignores_the_case(self):
+        self.assertEqual(self.ids(self.index.find('BRAND us')), [1])
+        self.assertEqual(self.ids(self.index.find('Straße')), [4])
+        self.assertEqual(self.index.find('Brand'), [])
+        self.assertEqual(self.index.get('3').name, 'Generic')
+        self.assertIs(self.index.get(3), self.index.get('3'))
+
+    def test_prefix_search(self):
+        self.assertEqual(self.ids(self.index.search('BRA', prefix=True)),
+                         [1, 2, 5])
+        self.assertEqual(self.ids(self.index.search('brand ', prefix=True)),
+                         [1, 2])
+        self.assertEqual(self.index.search('and', prefix=True), [])
+        self.assertEqual(self.ids(self.index.search('and')), [1, 2, 5])
+        self.assertEqual(self.ids(self.index.search('', prefix=True)),
+                         [1, 2, 3, 4, 5])
+
+    def test_prefix_search_after_changes(self):
+        self.index.search('b', prefix=True)  # sorts the names
+        self.index.add(campaign(6, 'Branding'))
+        self.index.add(campaign(1, 'Generic US'))  # renamed
+        self.index.remove(2)
+        self.assertEqual(self.ids(self.index.search('brand', prefix=True)),
+                         [5, 6])
+        self.assertEqual(self.ids(self.index.search('gen', prefix=True)),
+                         [1, 3])
+        self.assertEqual(len(self.index), 5)
+
+
+class EntityRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('search_ads.models.registry.time.time',
+                             lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.listed = [campaign(1, 'Brand'), campaign(2, 'Generic')]
+        self.load = mock.Mock(side_effect=lambda: list(self.listed))
+
+    def test_lists_are_kept_for_ttl_seconds(self):
+        registry = EntityRegistry(self.load, ttl=300)
+        brand = registry.campaigns().get(1)
+        self.now += 300
+        self.assertIs(registry.campaigns().get(1), brand)
+        self.assertEqual(self.load.call_count, 1)
+
+        self.listed = [campaign(1, 'Brand'),
+                       campaign(2, 'Generic 2', '2018-03-02T10:00:00.000')]
+        self.now += 1
+        campaigns = registry.campaigns()
+        self.assertEqual(self.load.call_count, 2)
+        self.assertIs(campaigns.get(1), brand)  # not modified, kept
+        self.assertEqual(campaigns.get(2).name, 'Generic 2')
+
+    def test_no_ttl(self):
+        registry = EntityRegistry(self.load, ttl=None)
+        registry.campaigns()
+        self.now += 10 ** 6
+        registry.campaigns()
+        self.assertEqual(self.load.call_count, 1)
+
+    def test_ad_groups_are_fetched_again_once_expired(self):
+        registry = EntityRegistry(self.load, ttl=300)
+        brand = registry.campaigns().get(1)
+        brand.ad_groups = [AdGroup(id=5, campaignId=1, name='Exact')]
+        fetched = [AdGroup(id=6, campaignId=1, name='Broad')]
+        with mock.patch.object(Campaign, 'fetch_ad_groups',
+                               return_value=fetched) as fetch:
+            self.assertEqual(len(registry.ad_groups(brand).find('exact')), 1)
+            fetch.assert_not_called()
+            self.now += 301
+            self.assertEqual(len(registry.ad_groups(brand).find('BROAD')), 1)
+            fetch.assert_called_once_with()
+
+
+class CreateCampaignTest(unittest.TestCase):
+
+    def test_new_campaign_is_found_within_the_ttl(self):
+        with mock.patch('search_ads.api.search_ads_building_blocks.api_get',
+                        return_value={'data': [{'orgName': 'Org',
+                                                'orgId': 42}]}):
+            api = SearchAds('Org', registry_ttl=3600)
+        listed = [campaign(1, 'Brand')]
+        api.registry.load_campaigns = lambda: list(listed)
+        self.assertIsNone(api.get_campaign_by_name('New'))
+
+        def save(self, cascade=False):
+            listed.append(campaign(2, self.name))
+
+        with mock.patch.object(Campaign, 'save', save):
+            created = api.create_campaign('New', 'Exact', 284882215, False,
+                                          1, 1000, 100)
+        self.assertEqual(created._id, '2')
+        self.assertIs(api.get_campaign_by_name('new'), created)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+import time
+import unittest
+from email.utils import formatdate
+from unittest import mock
+
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from search_ads.api import utils
+from search_ads.api.utils import AdaptiveLimiter, Scheduler, SearchAdsError, \
+    TokenBucket, api_get, api_post, _never_sent, _retry_after
+
+
+def response(status, body=b'{"data": []}', headers=None):
+    res = requests.Response()
+    res.status_code = status
+    res._content = body
+    res.headers.update(headers or {})
+    return res
+
+
+def refused():
+    return requests.ConnectionError(MaxRetryError(
+        None, 'https://api.searchads.apple.com',
+        NewConnectionError(None, 'Connection refused')))
+
+
+class FakeTransport(object):
+    """
+    Answers the requests with the given responses or exceptions, in order
+    """
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.requests = []
+
+    def request(self, method, url, cert, org_id=None, headers=None,
+                json_data=None):
+        self.requests.append((method, url))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def close(self):
+        pass
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = Scheduler(rate=1000, burst=1000)
+        old_scheduler = utils.get_scheduler()
+        utils.set_scheduler(self.scheduler)
+        self.addCleanup(utils.set_scheduler, old_scheduler)
+        credentials = mock.patch('search_ads.api.utils.get_credentials')
+        credentials.start().return_value.get_cert.return_value = \
+            ('a.pem', 'a.key')
+        self.addCleanup(credentials.stop)
+        # The waits of the backoff and of the token bucket only move a clock
+        self.now = time.monotonic()
+        self.sleeps = []
+        for name, fake in (('sleep', self.fake_sleep),
+                           ('monotonic', lambda: self.now)):
+            patcher = mock.patch('search_ads.api.utils.time.' + name, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def fake_sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def use(self, *outcomes):
+        transport = FakeTransport(*outcomes)
+        self.addCleanup(utils.set_transport, utils.get_transport())
+        utils.set_transport(transport)
+        return transport
+
+    def test_throttled_call_waits_for_retry_after(self):
+        transport = self.use(response(429, headers={'Retry-After': '3'}),
+                             response(200, b'{"data": [1]}'))
+
+        self.assertEqual(api_get('campaigns', org_id=42), {'data': [1]})
+
+        self.assertEqual(len(transport.requests), 2)
+        self.assertEqual(self.sleeps[0], 3.0)
+        self.assertEqual((self.scheduler.stats['throttled'],
+                          self.scheduler.stats['retries']), (1, 1))
+        bucket, limiter = self.scheduler._org(42)
+        # The bucket of the org was paused as long: it had no token left
+        # once the backoff was over
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertAlmostEqual(self.sleeps[1], 1.0 / bucket.rate)
+        self.assertEqual(limiter.limit, 10)
+
+    def test_post_is_not_retried_after_a_server_error(self):
+        transport = self.use(response(503, b'{}'))
+
+        with self.assertRaises(SearchAdsError) as raised:
+            api_post('campaigns', data={'name': 'Brand'})
+
+        self.assertEqual(raised.exception.status, 503)
+        self.assertEqual(len(transport.requests), 1)
+        self.assertEqual(self.scheduler.stats['failures'], 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_reading_post_and_get_are_retried_after_a_server_error(self):
+        transport = self.use(response(503), response(200), response(502),
+                             response(200))
+
+        api_post('reports/campaigns', data={}, idempotent=True)
+        api_get('campaigns')
+
+        self.assertEqual(len(transport.requests), 4)
+        self.assertEqual(self.scheduler.stats['retries'], 2)
+
+    def test_post_is_retried_when_it_was_never_sent(self):
+        transport = self.use(refused(), response(200, b'{"data": {}}'))
+
+        self.assertEqual(api_post('campaigns', data={'name': 'Brand'}),
+                         {'data': {}})
+        self.assertEqual(len(transport.requests), 2)
+
+    def test_post_is_not_retried_when_it_may_have_been_processed(self):
+        transport = self.use(requests.ReadTimeout('read timed out'))
+
+        with self.assertRaises(SearchAdsError):
+            api_post('campaigns', data={'name': 'Brand'})
+        self.assertEqual(len(transport.requests), 1)
+
+    def test_gives_up_after_max_retries(self):
+        self.scheduler.max_retries = 2
+        transport = self.use(*[response(500)] * 3)
+
+        with self.assertRaises(SearchAdsError):
+            api_get('campaigns')
+        self.assertEqual(len(transport.requests), 3)
+
+    def test_never_sent(self):
+        self.assertTrue(_never_sent(refused()))
+        self.assertTrue(_never_sent(requests.ConnectTimeout()))
+        self.assertFalse(_never_sent(requests.ReadTimeout()))
+        self.assertFalse(_never_sent(requests.ConnectionError('reset')))
+        self.assertFalse(_never_sent(None))
+
+
+class RetryAfterTest(unittest.TestCase):
+
+    def test_seconds_and_dates(self):
+        self.assertEqual(_retry_after(response(429, headers={
+            'Retry-After': '1.5'})), 1.5)
+        in_30s = formatdate(time.time() + 30, usegmt=True)
+        self.assertAlmostEqual(_retry_after(response(429, headers={
+            'Retry-After': in_30s})), 30, delta=2)
+        past = formatdate(time.time() - 30, usegmt=True)
+        self.assertEqual(_retry_after(response(429, headers={
+            'Retry-After': past})), 0)
+
+    def test_missing_or_invalid(self):
+        self.assertIsNone(_retry_after(None))
+        self.assertIsNone(_retry_after(response(429)))
+        self.assertIsNone(_retry_after(response(429, headers={
+            'Retry-After': 'soon'})))
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        self.assertEqual((bucket.try_acquire(), bucket.try_acquire()), (0, 0))
+        self.assertAlmostEqual(bucket.try_acquire(), 0.1, delta=0.01)
+
+    def test_pause(self):
+        bucket = TokenBucket(rate=10, burst=10)
+        bucket.pause(2)
+        self.assertAlmostEqual(bucket.try_acquire(), 2.1, delta=0.01)
+
+
+class AdaptiveLimiterTest(unittest.TestCase):
+
+    def calls(self, limiter, count, throttled=False):
+        for _ in range(count):
+            self.assertTrue(limiter.try_acquire())
+            limiter.release(throttled=throttled)
+
+    def test_halved_on_throttle_down_to_the_minimum(self):
+        limiter = AdaptiveLimiter(8, min_concurrency=2)
+        self.calls(limiter, 1, throttled=True)
+        self.assertEqual(limiter.limit, 4)
+        self.calls(limiter, 2, throttled=True)
+        self.assertEqual(limiter.limit, 2)
+
+    def test_grows_back_by_one_up_to_the_maximum(self):
+        limiter = AdaptiveLimiter(4, increase_every=3)
+        self.calls(limiter, 2, throttled=True)
+        self.assertEqual(limiter.limit, 1)
+        self.calls(limiter, 2)
+        self.assertEqual(limiter.limit, 1)
+        self.calls(limiter, 1)
+        self.assertEqual(limiter.limit, 2)
+        self.calls(limiter, 30)
+        self.assertEqual(limiter.limit, 4)
+
+    def test_limits_the_calls_in_flight(self):
+        limiter = AdaptiveLimiter(4)
+        self.calls(limiter, 1, throttled=True)
+        self.assertTrue(limiter.try_acquire())
+        self.assertTrue(limiter.try_acquire())
+        self.assertFalse(limiter.try_acquire())
+        limiter.release()
+        self.assertTrue(limiter.try_acquire())
+
+
+if __name__ == '__main__':
+    unittest.main()
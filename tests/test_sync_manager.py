@@ -0,0 +1,62 @@
+import json
+import unittest
+from unittest import mock
+
+from search_ads.models.store_models import AdGroup, SyncManager
+
+
+class SyncManagerSerializationTest(unittest.TestCase):
+
+    def test_to_json_with_queued_actions(self):
+        manager = SyncManager({'SEARCH-ADS-PEM': 'a.pem',
+                               'SEARCH-ADS-KEY': 'a.key'})
+        ad_group = AdGroup.decode([{'id': 5, 'campaignId': 1,
+                                    'name': 'Brand'}])[0]
+        ad_group.set_sync_manager(manager)
+        ad_group.name = 'Brand 2'
+        ad_group.save()
+        ad_group.save()  # coalesced with the first one
+
+        state = json.loads(manager.to_json())
+
+        self.assertEqual(sorted(state), ['certs', 'pending_actions'])
+        self.assertEqual(len(state['pending_actions']), 1)
+        self.assertEqual(state['pending_actions'][0][0], 'AdGroup')
+
+
+class SyncManagerReplayTest(unittest.TestCase):
+
+    def test_replays_only_the_changes(self):
+        manager = SyncManager({'SEARCH-ADS-PEM': 'a.pem',
+                               'SEARCH-ADS-KEY': 'a.key'})
+        keywords = [{'id': i, 'adGroupId': 5, 'text': 'keyword %d' % i,
+                     'matchType': 'EXACT', 'status': 'ACTIVE',
+                     'bidAmount': {'amount': '1', 'currency': 'USD'}}
+                    for i in range(100)]
+        ad_group = AdGroup.decode([{'id': 5, 'campaignId': 1,
+                                    'name': 'Brand',
+                                    'keywords': keywords}])[0]
+        ad_group.set_sync_manager(manager)
+        ad_group.keywords[3].bid_amount['amount'] = '2'
+        ad_group.keywords[7].text = 'renamed'
+        ad_group.save()
+
+        with mock.patch('search_ads.models.store_models.api_put') as put, \
+                mock.patch('search_ads.models.store_models.api_post') as post:
+            post.return_value = None
+            manager.synchronize()
+
+        put.assert_not_called()
+        operations = [operation for call in post.call_args_list
+                      for operation in call[1]['data']]
+        self.assertEqual(
+            [(op['id'], op['importAction'], op['status'], op['text'])
+             for op in operations],
+            [('3', 'UPDATE', 'ACTIVE', 'keyword 3'),
+             ('7', 'UPDATE', 'PAUSED', 'keyword 7'),
+             ('7', 'CREATE', 'ACTIVE', 'renamed')])
+        self.assertEqual(operations[0]['bidAmount']['amount'], '2')
+
+
+if __name__ == '__main__':
+    unittest.main()